@@ -1,29 +1,156 @@
+Param(
+    [Parameter(Mandatory = $false)]
+    [string]$Token,
+    [int]$MaxAttempts = 10,
+    [int]$BackoffBase = 2,
+    [int]$BackoffMax = 300,
+    [string]$StateDir = "$env:ProgramData\ZeroTouch",
+    [int]$PlanWait = 60,
+    [switch]$NoAgent,
+    [switch]$ApplyPlan
+)
+
 $ErrorActionPreference = "Stop"
 
 $ApiBase = $env:API_BASE
 if (-not $ApiBase) { $ApiBase = "https://api.localhost" }
 
-Param(
-    [Parameter(Mandatory = $false)]
-    [string]$Token
-)
-
 if (-not $Token) {
     if ($env:TOKEN) { $Token = $env:TOKEN }
 }
 
-if (-not $Token) {
+$StateFile = Join-Path $StateDir "device.json"
+
+if (-not $Token -and -not (Test-Path $StateFile)) {
     Write-Host "Usage: .\bootstrap.ps1 -Token <token>"
     exit 1
 }
 
+$serial = $null
+$machineId = $null
+try { $serial = (Get-CimInstance -ClassName Win32_BIOS).SerialNumber } catch { }
+try { $machineId = (Get-CimInstance -ClassName Win32_ComputerSystemProduct).UUID } catch { }
+
 $facts = @{
     hostname = $env:COMPUTERNAME
     os_type  = "windows"
     arch     = $env:PROCESSOR_ARCHITECTURE
-    facts    = @{ ip = (Test-Connection -ComputerName $env:COMPUTERNAME -Count 1).IPV4Address.IPAddressToString }
+    facts    = @{
+        ip         = (Test-Connection -ComputerName $env:COMPUTERNAME -Count 1).IPV4Address.IPAddressToString
+        serial     = $serial
+        machine_id = $machineId
+    }
     token    = $Token
 }
+$idempotencyKey = if ($env:IDEMPOTENCY_KEY) { $env:IDEMPOTENCY_KEY } else { [guid]::NewGuid().ToString() }
+
+function Get-RetryAfter($Response) {
+    if (-not $Response) { return $null }
+    $value = $null
+    try { $value = $Response.Headers["Retry-After"] } catch { }
+    if (-not $value) {
+        try { $value = $Response.Headers.RetryAfter.Delta.TotalSeconds } catch { }
+    }
+    $seconds = 0
+    if ($value -and [int]::TryParse("$value", [ref]$seconds)) { return $seconds }
+    return $null
+}
+
+function Register-Device($Stored) {
+    $body = $facts | ConvertTo-Json
+    for ($attempt = 1; $attempt -le $MaxAttempts; $attempt++) {
+        try {
+            $headers = @{ "Idempotency-Key" = $idempotencyKey }
+            if ($Stored) { $headers["X-Device-Token"] = $Stored.device_token }
+            $device = Invoke-RestMethod -Method Post -Uri "$ApiBase/enrollment/register" -Body $body -ContentType "application/json" -Headers $headers
+            $device | ConvertTo-Json | Write-Host
+            New-Item -ItemType Directory -Force -Path $StateDir | Out-Null
+            @{ device_id = $device.id; device_token = $device.device_token } | ConvertTo-Json | Set-Content -Path $StateFile
+            return $device
+        }
+        catch {
+            $response = $_.Exception.Response
+            $status = if ($response) { [int]$response.StatusCode } else { 0 }
+            if ($status -ne 0 -and $status -ne 429 -and $status -lt 500) {
+                Write-Error "Enrollment failed ($status): $($_.Exception.Message)"
+                exit 1
+            }
+            if ($attempt -eq $MaxAttempts) { break }
+            $retryAfter = Get-RetryAfter $response
+            if ($null -ne $retryAfter) {
+                $delay = $retryAfter + (Get-Random -Minimum 0 -Maximum ($retryAfter + 1))
+            }
+            else {
+                $ceiling = [Math]::Min($BackoffMax, $BackoffBase * [Math]::Pow(2, [Math]::Min($attempt, 16)))
+                $delay = 1 + (Get-Random -Minimum 0 -Maximum ([int]$ceiling))
+            }
+            Write-Host "Enrollment attempt $attempt got $status; retrying in $delay s"
+            Start-Sleep -Seconds $delay
+        }
+    }
 
-$body = $facts | ConvertTo-Json
-Invoke-RestMethod -Method Post -Uri "$ApiBase/enrollment/register" -Body $body -ContentType "application/json"
+    Write-Error "Enrollment failed after $MaxAttempts attempts"
+    exit 1
+}
+
+function Send-Heartbeat($Device) {
+    $ip = (Test-Connection -ComputerName $env:COMPUTERNAME -Count 1).IPV4Address.IPAddressToString
+    $body = @{ facts = @{ ip = $ip } } | ConvertTo-Json
+    try {
+        Invoke-RestMethod -Method Post -Uri "$ApiBase/devices/$($Device.device_id)/heartbeat" -Body $body -ContentType "application/json" -Headers @{ "X-Device-Token" = $Device.device_token } | Out-Null
+    }
+    catch {
+        Write-Host "Heartbeat failed: $($_.Exception.Message)"
+    }
+}
+
+function Invoke-Plan($Plan) {
+    if (-not $ApplyPlan) { return }
+    foreach ($action in $Plan.actions) {
+        Write-Host "+ $action"
+        try { Invoke-Expression $action } catch { Write-Host "Action failed: $action" }
+    }
+}
+
+function Start-Agent($Device) {
+    $etag = ""
+    $failures = 0
+    $planFile = Join-Path $StateDir "plan.json"
+    while ($true) {
+        Send-Heartbeat $Device
+        try {
+            $headers = @{ "X-Device-Token" = $Device.device_token }
+            if ($etag) { $headers["If-None-Match"] = $etag }
+            $response = Invoke-WebRequest -UseBasicParsing -Uri "$ApiBase/devices/$($Device.device_id)/plan?wait=$PlanWait" -Headers $headers
+            $failures = 0
+            $response.Content | Set-Content -Path $planFile
+            $etag = "$($response.Headers['ETag'])"
+            Write-Host "New plan received (ETag $etag)"
+            Invoke-Plan ($response.Content | ConvertFrom-Json)
+        }
+        catch {
+            $status = if ($_.Exception.Response) { [int]$_.Exception.Response.StatusCode } else { 0 }
+            if ($status -eq 304) { $failures = 0; continue }
+            if ($status -eq 401 -or $status -eq 404) {
+                Write-Error "Device credential rejected ($status); re-enroll with -Token <token>"
+                exit 1
+            }
+            $failures++
+            $ceiling = [Math]::Min($BackoffMax, $BackoffBase * [Math]::Pow(2, [Math]::Min($failures, 8)))
+            Start-Sleep -Seconds (1 + (Get-Random -Minimum 0 -Maximum ([int]$ceiling)))
+        }
+    }
+}
+
+$device = $null
+if (Test-Path $StateFile) {
+    $device = Get-Content -Path $StateFile -Raw | ConvertFrom-Json
+}
+if ($Token) {
+    $enrolled = Register-Device $device
+    $device = [pscustomobject]@{ device_id = $enrolled.id; device_token = $enrolled.device_token }
+}
+
+if (-not $NoAgent) {
+    Start-Agent $device
+}
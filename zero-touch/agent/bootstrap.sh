@@ -3,8 +3,12 @@ set -euo pipefail
 
 API_BASE=${API_BASE:-https://api.localhost}
 TOKEN=${TOKEN:-${1:-}}
+STATE_DIR=${STATE_DIR:-/var/lib/zero-touch}
+AGENT=${AGENT:-1}
+PLAN_WAIT=${PLAN_WAIT:-60}
+APPLY_PLAN=${APPLY_PLAN:-0}
 
-if [[ -z "$TOKEN" ]]; then
+if [[ -z "$TOKEN" && ! -s "$STATE_DIR/device" ]]; then
   echo "Usage: TOKEN=<token> $0"
   exit 1
 fi
@@ -15,7 +19,10 @@ payload=$(cat <<'EOF'
   "os_type": "__OS__",
   "arch": "__ARCH__",
   "facts": {
-    "ip": "__IP__"
+    "ip": "__IP__",
+    "serial": "__SERIAL__",
+    "machine_id": "__MACHINE_ID__",
+    "mac": "__MAC__"
   },
   "token": "__TOKEN__"
 }
@@ -26,8 +33,127 @@ payload=${payload/__HOSTNAME__/$(hostname)}
 payload=${payload/__OS__/$(uname -s)}
 payload=${payload/__ARCH__/$(uname -m)}
 payload=${payload/__IP__/$(hostname -I | awk '{print $1}')}
+payload=${payload/__SERIAL__/$(tr -d '"\\' < /sys/class/dmi/id/product_serial 2>/dev/null || true)}
+payload=${payload/__MACHINE_ID__/$(cat /etc/machine-id 2>/dev/null || true)}
+payload=${payload/__MAC__/$(cat /sys/class/net/"$(ip route show default 2>/dev/null | awk '{print $5; exit}')"/address 2>/dev/null || true)}
 payload=${payload/__TOKEN__/$TOKEN}
 
-curl -s -X POST "$API_BASE/enrollment/register" \
-  -H "Content-Type: application/json" \
-  -d "$payload"
+IDEMPOTENCY_KEY=${IDEMPOTENCY_KEY:-$(cat /proc/sys/kernel/random/uuid 2>/dev/null || date +%s%N)}
+
+MAX_ATTEMPTS=${MAX_ATTEMPTS:-10}
+BACKOFF_BASE=${BACKOFF_BASE:-2}
+BACKOFF_MAX=${BACKOFF_MAX:-300}
+
+headers=$(mktemp)
+trap 'rm -f "$headers"' EXIT
+
+enroll() {
+  local credential=()
+  if [[ -n "${DEVICE_TOKEN:-}" ]]; then
+    credential=(-H "X-Device-Token: $DEVICE_TOKEN")
+  fi
+  for ((attempt = 1; attempt <= MAX_ATTEMPTS; attempt++)); do
+    response=$(curl -sS -X POST "$API_BASE/enrollment/register" \
+      -H "Content-Type: application/json" \
+      -H "Idempotency-Key: $IDEMPOTENCY_KEY" \
+      ${credential[@]+"${credential[@]}"} \
+      -D "$headers" -w '\n%{http_code}' \
+      -d "$payload") || response=$'\n000'
+    status=${response##*$'\n'}
+    body=${response%$'\n'*}
+
+    if [[ "$status" =~ ^2 ]]; then
+      echo "$body"
+      DEVICE_ID=$(printf '%s' "$body" | grep -o '"id":"[^"]*"' | head -n 1 | cut -d'"' -f4)
+      DEVICE_TOKEN=$(printf '%s' "$body" | grep -o '"device_token":"[^"]*"' | cut -d'"' -f4)
+      mkdir -p "$STATE_DIR"
+      (umask 077 && printf 'DEVICE_ID=%s\nDEVICE_TOKEN=%s\n' "$DEVICE_ID" "$DEVICE_TOKEN" > "$STATE_DIR/device")
+      return 0
+    fi
+    if [[ "$status" != "000" && "$status" != "429" && ! "$status" =~ ^5 ]]; then
+      echo "Enrollment failed ($status): $body" >&2
+      exit 1
+    fi
+
+    ((attempt == MAX_ATTEMPTS)) && break
+    retry_after=$(grep -i '^retry-after:' "$headers" 2>/dev/null | tail -n 1 | tr -d '\r' | awk '{print $2}' || true)
+    if [[ "$retry_after" =~ ^[0-9]+$ ]]; then
+      delay=$((retry_after + RANDOM % (retry_after + 1)))
+    else
+      ceiling=$((BACKOFF_BASE << (attempt < 16 ? attempt : 16)))
+      ((ceiling > BACKOFF_MAX)) && ceiling=$BACKOFF_MAX
+      delay=$((1 + RANDOM % ceiling))
+    fi
+    echo "Enrollment attempt $attempt got ${status}; retrying in ${delay}s" >&2
+    sleep "$delay"
+  done
+
+  echo "Enrollment failed after $MAX_ATTEMPTS attempts" >&2
+  exit 1
+}
+
+heartbeat() {
+  curl -sS -o /dev/null -X POST "$API_BASE/devices/$DEVICE_ID/heartbeat" \
+    -H "Content-Type: application/json" \
+    -H "X-Device-Token: $DEVICE_TOKEN" \
+    -d "{\"facts\": {\"ip\": \"$(hostname -I | awk '{print $1}')\"}}" || true
+}
+
+apply_plan() {
+  if [[ "$APPLY_PLAN" != "1" ]]; then
+    return 0
+  fi
+  if ! command -v jq >/dev/null; then
+    echo "APPLY_PLAN=1 needs jq; plan saved to $STATE_DIR/plan.json" >&2
+    return 0
+  fi
+  jq -r '.actions[]' "$STATE_DIR/plan.json" | while IFS= read -r action; do
+    echo "+ $action" >&2
+    bash -c "$action" || echo "Action failed: $action" >&2
+  done
+}
+
+run_agent() {
+  local etag="" failures=0 status
+  while true; do
+    heartbeat
+    status=$(curl -sS -o "$STATE_DIR/plan.next" -D "$headers" -w '%{http_code}' \
+      "$API_BASE/devices/$DEVICE_ID/plan?wait=$PLAN_WAIT" \
+      -H "X-Device-Token: $DEVICE_TOKEN" \
+      -H "If-None-Match: $etag") || status=000
+    case "$status" in
+      200)
+        failures=0
+        mv "$STATE_DIR/plan.next" "$STATE_DIR/plan.json"
+        etag=$(grep -i '^etag:' "$headers" | tail -n 1 | cut -d' ' -f2- | tr -d '\r')
+        echo "New plan received (ETag $etag)" >&2
+        apply_plan
+        ;;
+      304)
+        failures=0
+        ;;
+      401 | 404)
+        echo "Device credential rejected ($status); re-enroll with TOKEN=<token> $0" >&2
+        exit 1
+        ;;
+      *)
+        failures=$((failures + 1))
+        ceiling=$((BACKOFF_BASE << (failures < 8 ? failures : 8)))
+        ((ceiling > BACKOFF_MAX)) && ceiling=$BACKOFF_MAX
+        sleep $((1 + RANDOM % ceiling))
+        ;;
+    esac
+  done
+}
+
+if [[ -s "$STATE_DIR/device" ]]; then
+  # shellcheck source=/dev/null
+  . "$STATE_DIR/device"
+fi
+if [[ -n "$TOKEN" ]]; then
+  enroll
+fi
+
+if [[ "$AGENT" == "1" ]]; then
+  run_agent
+fi
@@ -0,0 +1,141 @@
+import atexit
+import datetime as dt
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import insert
+
+from app.config import get_settings
+from app.db import get_engine
+from app.models import AuditLog, time_ordered_uuid
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+def _encode(row: Dict[str, Any]) -> str:
+    return json.dumps(
+        {**row, "id": str(row["id"]), "created_at": row["created_at"].isoformat()}
+    )
+
+
+def _decode(line: str) -> Dict[str, Any]:
+    row = json.loads(line)
+    row["id"] = uuid.UUID(row["id"])
+    row["created_at"] = dt.datetime.fromisoformat(row["created_at"])
+    return row
+
+
+class AuditWriter:
+    def __init__(self, max_queue: int, batch_size: int, flush_interval: float, spool_path: str):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue)
+        self._spool_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def record(self, actor: str, action: str, target_type: str, target_id: Optional[str] = None, message: str = "") -> None:
+        self.record_many(
+            [
+                {
+                    "actor": actor,
+                    "action": action,
+                    "target_type": target_type,
+                    "target_id": target_id,
+                    "message": message,
+                }
+            ]
+        )
+
+    def record_many(self, rows: Iterable[Dict[str, Any]]) -> None:
+        self.start()
+        overflow = []
+        for row in rows:
+            row = {"id": time_ordered_uuid(), "created_at": dt.datetime.utcnow(), **row}
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                overflow.append(row)
+        if overflow:
+            self._spool(overflow)
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or (self._stop.is_set() and self._queue.empty()):
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        try:
+            with get_engine().begin() as conn:
+                conn.execute(insert(AuditLog), batch)
+        except Exception:
+            logger.exception("audit flush failed; spooling %d events", len(batch))
+            self._spool(batch)
+
+    def _spool(self, rows: List[Dict[str, Any]]) -> None:
+        with self._spool_lock, open(self.spool_path, "a", encoding="utf-8") as spool:
+            spool.write("".join(_encode(row) + "\n" for row in rows))
+
+    def replay(self) -> int:
+        replaying = f"{self.spool_path}.replay"
+        with self._spool_lock:
+            if os.path.exists(self.spool_path):
+                with open(self.spool_path, encoding="utf-8") as src, open(replaying, "a", encoding="utf-8") as dst:
+                    dst.write(src.read())
+                os.remove(self.spool_path)
+        if not os.path.exists(replaying):
+            return 0
+        with open(replaying, encoding="utf-8") as spool:
+            rows = [_decode(line) for line in spool if line.strip()]
+        for start in range(0, len(rows), self.batch_size):
+            self._write(rows[start : start + self.batch_size])
+        os.remove(replaying)
+        return len(rows)
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+writer = AuditWriter(
+    max_queue=settings.audit_queue_size,
+    batch_size=settings.audit_batch_size,
+    flush_interval=settings.audit_flush_interval,
+    spool_path=settings.audit_spool_path,
+)
+record = writer.record
+record_many = writer.record_many
+atexit.register(writer.close)
@@ -0,0 +1,111 @@
+import logging
+import math
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+from amqp.exceptions import ChannelError
+from celery import Celery
+
+from app.config import get_settings
+from app.queues import POOLS, Pool
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class BrokerDepth:
+    def __init__(self, app: Celery):
+        self.app = app
+
+    def __call__(self, queues: Iterable[str]) -> int:
+        total = 0
+        with self.app.connection_for_read() as conn:
+            for queue in queues:
+                channel = conn.channel()
+                try:
+                    total += channel.queue_declare(queue=queue, passive=True).message_count
+                except ChannelError:
+                    pass
+                finally:
+                    channel.close()
+        return total
+
+
+class CeleryPools:
+    def __init__(self, app: Celery, timeout: float = 1.0):
+        self.app = app
+        self.timeout = timeout
+
+    def workers(self, pool: str) -> Dict[str, int]:
+        stats = self.app.control.inspect(timeout=self.timeout).stats() or {}
+        return {
+            name: int(info.get("pool", {}).get("max-concurrency", 0))
+            for name, info in stats.items()
+            if name.startswith(f"{pool}@")
+        }
+
+    def resize(self, worker: str, delta: int) -> None:
+        if delta > 0:
+            self.app.control.pool_grow(delta, destination=[worker])
+        elif delta < 0:
+            self.app.control.pool_shrink(-delta, destination=[worker])
+
+
+def desired_concurrency(pool: Pool, depth: int, workers: int, current: int, per_process: int) -> int:
+    wanted = math.ceil(depth / max(per_process, 1) / max(workers, 1))
+    wanted = min(max(wanted, pool.min_concurrency), pool.max_concurrency)
+    if wanted < current:
+        wanted = max(wanted, current - max((current - wanted) // 2, 1))
+    return wanted
+
+
+class Autoscaler:
+    def __init__(
+        self,
+        pools: Iterable[Pool],
+        depth: Callable[[Iterable[str]], int],
+        backend,
+        per_process: Optional[int] = None,
+        cooldown: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.pools = list(pools)
+        self.depth = depth
+        self.backend = backend
+        self.per_process = per_process or settings.autoscale_per_process
+        self.cooldown = settings.autoscale_cooldown if cooldown is None else cooldown
+        self.clock = clock
+        self._last_change: Dict[str, float] = {}
+
+    def tick(self) -> Dict[str, Dict[str, int]]:
+        decisions: Dict[str, Dict[str, int]] = {}
+        now = self.clock()
+        for pool in self.pools:
+            depth = self.depth(pool.queues)
+            workers = self.backend.workers(pool.name)
+            for worker, current in workers.items():
+                target = desired_concurrency(pool, depth, len(workers), current, self.per_process)
+                if target < current and now - self._last_change.get(worker, -math.inf) < self.cooldown:
+                    target = current
+                if target != current:
+                    self.backend.resize(worker, target - current)
+                    self._last_change[worker] = now
+                    logger.info("scaling %s from %s to %s (depth=%s)", worker, current, target, depth)
+                decisions[worker] = {"depth": depth, "from": current, "to": target}
+        return decisions
+
+    def run(self, interval: Optional[float] = None) -> None:
+        interval = interval or settings.autoscale_interval
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("autoscale tick failed")
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    from app.worker import celery_app
+
+    logging.basicConfig(level=logging.INFO)
+    Autoscaler(POOLS.values(), BrokerDepth(celery_app), CeleryPools(celery_app)).run()
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from functools import lru_cache
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import redis
+from sqlmodel import Session, select
+
+from app import blueprint_cache
+from app.cache import get_redis
+from app.config import get_settings
+from app.desired_state import BLUEPRINT_HASH_KEY
+from app.integrations import content_hash
+from app.models import Blueprint
+
+settings = get_settings()
+
+DIGEST = re.compile(r"^[0-9a-f]{64}$")
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobNotFound(KeyError):
+    pass
+
+
+class BlobTooLarge(ValueError):
+    pass
+
+
+def valid_digest(digest: str) -> bool:
+    return bool(DIGEST.match(digest or ""))
+
+
+class FileSystemWriter:
+    def __init__(self, store: "FileSystemBlobStore", max_size: int):
+        self.store = store
+        self.max_size = max_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+        os.makedirs(store.tmp_dir, exist_ok=True)
+        self._handle = tempfile.NamedTemporaryFile(dir=store.tmp_dir, delete=False)
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.max_size and self.size > self.max_size:
+            self.abort()
+            raise BlobTooLarge(f"blob exceeds {self.max_size} bytes")
+        self._hash.update(chunk)
+        self._handle.write(chunk)
+
+    def commit(self) -> Tuple[str, int]:
+        self._handle.close()
+        digest = self._hash.hexdigest()
+        path = self.store.path(digest)
+        if os.path.exists(path):
+            os.unlink(self._handle.name)
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self._handle.name, path)
+        return digest, self.size
+
+    def abort(self) -> None:
+        self._handle.close()
+        if os.path.exists(self._handle.name):
+            os.unlink(self._handle.name)
+
+
+class FileSystemBlobStore:
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def path(self, digest: str) -> str:
+        if not valid_digest(digest):
+            raise BlobNotFound(digest)
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def writer(self, max_size: Optional[int] = None) -> FileSystemWriter:
+        return FileSystemWriter(self, settings.blob_max_size if max_size is None else max_size)
+
+    def put(self, data: bytes) -> Tuple[str, int]:
+        writer = self.writer(max_size=0)
+        writer.write(data)
+        return writer.commit()
+
+    def exists(self, digest: str) -> bool:
+        return valid_digest(digest) and os.path.exists(self.path(digest))
+
+    def size(self, digest: str) -> int:
+        try:
+            return os.path.getsize(self.path(digest))
+        except OSError:
+            raise BlobNotFound(digest)
+
+    def open(self, digest: str) -> BinaryIO:
+        try:
+            return open(self.path(digest), "rb")
+        except OSError:
+            raise BlobNotFound(digest)
+
+    def delete(self, digest: str) -> None:
+        try:
+            os.unlink(self.path(digest))
+        except OSError:
+            pass
+
+    def list(self) -> Iterator[Tuple[str, float]]:
+        for directory, _, names in os.walk(self.root):
+            if directory.startswith(self.tmp_dir):
+                continue
+            for name in names:
+                if valid_digest(name):
+                    yield name, os.path.getmtime(os.path.join(directory, name))
+
+
+BACKENDS: Dict[str, Any] = {"fs": FileSystemBlobStore}
+
+
+@lru_cache
+def get_store():
+    return BACKENDS[settings.blob_backend](settings.blob_root)
+
+
+def is_ref(value: Any) -> bool:
+    return isinstance(value, dict) and valid_digest(str(value.get("sha256", "")))
+
+
+def encode(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    return json.dumps(value).encode()
+
+
+def externalize(files: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    store = get_store()
+    refs = {}
+    for path, value in files.items():
+        if is_ref(value):
+            refs[path] = {"sha256": value["sha256"], "size": store.size(value["sha256"])}
+        else:
+            digest, size = store.put(encode(value))
+            refs[path] = {"sha256": digest, "size": size}
+    return refs
+
+
+def referenced(file_maps: Iterable[Optional[Dict[str, Any]]]) -> Set[str]:
+    return {value["sha256"] for files in file_maps for value in (files or {}).values() if is_ref(value)}
+
+
+def collect(keep: Set[str], grace: Optional[float] = None) -> int:
+    store = get_store()
+    cutoff = time.time() - (settings.blob_gc_grace if grace is None else grace)
+    removed = 0
+    for digest, modified in list(store.list()):
+        if digest not in keep and modified < cutoff:
+            store.delete(digest)
+            removed += 1
+    return removed
+
+
+def byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    if not start:
+        if not end.isdigit() or int(end) == 0:
+            raise ValueError("unsatisfiable range")
+        return max(size - int(end), 0), size - 1
+    if not start.isdigit() or (end and not end.isdigit()):
+        return None
+    first, last = int(start), min(int(end) if end else size - 1, size - 1)
+    if first >= size or first > last:
+        raise ValueError("unsatisfiable range")
+    return first, last
+
+
+def read_range(handle: BinaryIO, first: int, last: int) -> Iterator[bytes]:
+    with handle:
+        handle.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = handle.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def externalize_blueprints(session: Session) -> List[Any]:
+    migrated = []
+    for blueprint in session.exec(select(Blueprint)).all():
+        files = blueprint.files or {}
+        if all(is_ref(value) for value in files.values()):
+            continue
+        blueprint.files = externalize(files)
+        blueprint.content_hash = content_hash(blueprint.dict())
+        migrated.append((blueprint.id, blueprint.content_hash))
+    session.commit()
+    client = get_redis()
+    if client is not None and migrated:
+        try:
+            with client.pipeline(transaction=False) as pipe:
+                for blueprint_id, value in migrated:
+                    pipe.set(BLUEPRINT_HASH_KEY.format(blueprint_id), value, ex=settings.desired_state_ttl)
+                pipe.execute()
+        except redis.RedisError:
+            pass
+    ids = [blueprint_id for blueprint_id, _ in migrated]
+    blueprint_cache.invalidate(ids)
+    return ids
@@ -0,0 +1,195 @@
+import copy
+import logging
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import redis
+from sqlmodel import Session, select
+
+from app import schemas
+from app.cache import MISSING, LRUCache, get_pubsub_redis, get_redis
+from app.config import get_settings
+from app.metrics import BLUEPRINT_CACHE
+from app.models import Blueprint
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+@dataclass
+class Entry:
+    version: int
+    content_hash: str
+    blueprint: Blueprint
+    verified_at: float
+    out: Optional[schemas.BlueprintOut] = None
+
+
+class BlueprintCache:
+    def __init__(self, maxsize: int, ttl: float, verify_after: float, channel: str):
+        self.verify_after = verify_after
+        self.channel = channel
+        self.connected = False
+        self.subscribed = False
+        self.counts: Dict[str, int] = {"hit": 0, "verified": 0, "stale": 0, "miss": 0}
+        self._entries = LRUCache(maxsize, ttl=ttl)
+        self._generations: Dict[uuid.UUID, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._listener_pid: Optional[int] = None
+
+    def _count(self, result: str, amount: int = 1) -> None:
+        if amount:
+            self.counts[result] += amount
+            BLUEPRINT_CACHE.labels(result).inc(amount)
+
+    def _generation(self, blueprint_id: uuid.UUID) -> Tuple[int, int]:
+        return self._epoch, self._generations.get(blueprint_id, 0)
+
+    def drop(self, blueprint_ids: Iterable[uuid.UUID]) -> None:
+        with self._lock:
+            for blueprint_id in blueprint_ids:
+                self._generations[blueprint_id] = self._generations.get(blueprint_id, 0) + 1
+                self._entries.delete(blueprint_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self._generations.clear()
+            self._entries.clear()
+
+    def invalidate(self, blueprint_ids: Iterable[uuid.UUID]) -> None:
+        blueprint_ids = list(blueprint_ids)
+        self.drop(blueprint_ids)
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            for blueprint_id in blueprint_ids:
+                client.publish(self.channel, str(blueprint_id))
+        except redis.RedisError:
+            logger.warning("could not publish blueprint invalidation")
+
+    def _listen(self, client) -> None:
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self.clear()
+                self.connected = True
+                for message in pubsub.listen():
+                    self.drop([uuid.UUID(message["data"].decode())])
+            except Exception:
+                logger.warning("blueprint invalidation subscription lost; reconnecting")
+            self.connected = False
+            time.sleep(1)
+
+    def start(self) -> None:
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            self.connected = False
+        self.clear()
+        client = get_pubsub_redis()
+        self.subscribed = client is not None
+        if client is not None:
+            threading.Thread(target=self._listen, args=(client,), daemon=True, name="blueprint-cache").start()
+
+    def get_many(self, session: Session, blueprint_ids: Iterable[uuid.UUID]) -> Dict[uuid.UUID, Blueprint]:
+        self.start()
+        wanted = {blueprint_id for blueprint_id in blueprint_ids if blueprint_id}
+        now = time.monotonic()
+        trust = self.verify_after if self.connected or not self.subscribed else 0.0
+        found: Dict[uuid.UUID, Entry] = {}
+        unverified: Dict[uuid.UUID, Entry] = {}
+        for blueprint_id in wanted:
+            entry = self._entries.get(blueprint_id)
+            if entry is MISSING:
+                continue
+            if now - entry.verified_at < trust:
+                found[blueprint_id] = entry
+            else:
+                unverified[blueprint_id] = entry
+        self._count("hit", len(found))
+
+        if unverified:
+            current = {
+                row[0]: (row[1], row[2])
+                for row in session.exec(
+                    select(Blueprint.id, Blueprint.version, Blueprint.content_hash).where(
+                        Blueprint.id.in_(list(unverified))
+                    )
+                )
+            }
+            for blueprint_id, entry in unverified.items():
+                if current.get(blueprint_id) == (entry.version, entry.content_hash):
+                    entry.verified_at = now
+                    found[blueprint_id] = entry
+                    self._count("verified")
+                else:
+                    self.drop([blueprint_id])
+                    self._count("stale")
+
+        missing = wanted - set(found)
+        if missing:
+            self._count("miss", len(missing))
+            with self._lock:
+                generations = {blueprint_id: self._generation(blueprint_id) for blueprint_id in missing}
+            for blueprint in session.exec(select(Blueprint).where(Blueprint.id.in_(list(missing)))):
+                entry = Entry(blueprint.version, blueprint.content_hash, Blueprint(**copy.deepcopy(blueprint.dict())), now)
+                found[blueprint.id] = entry
+                with self._lock:
+                    if self._generation(blueprint.id) == generations[blueprint.id]:
+                        self._entries.set(blueprint.id, entry)
+        return {blueprint_id: entry.blueprint for blueprint_id, entry in found.items()}
+
+    def get(self, session: Session, blueprint_id: Optional[uuid.UUID]) -> Optional[Blueprint]:
+        return self.get_many(session, [blueprint_id]).get(blueprint_id) if blueprint_id else None
+
+    def get_out(self, session: Session, blueprint_id: uuid.UUID) -> Optional[schemas.BlueprintOut]:
+        blueprint = self.get(session, blueprint_id)
+        if blueprint is None:
+            return None
+        entry = self._entries.get(blueprint_id)
+        if entry is MISSING or entry.version != blueprint.version or entry.content_hash != blueprint.content_hash:
+            return schemas.BlueprintOut(**blueprint.dict())
+        if entry.out is None:
+            entry.out = schemas.BlueprintOut(**entry.blueprint.dict())
+        return entry.out
+
+    def hit_ratio(self) -> float:
+        total = sum(self.counts.values())
+        return self.counts["hit"] / total if total else 0.0
+
+    def verified_ratio(self) -> float:
+        total = sum(self.counts.values())
+        return self.counts["verified"] / total if total else 0.0
+
+
+cache = BlueprintCache(
+    settings.blueprint_cache_size,
+    settings.blueprint_cache_ttl,
+    settings.blueprint_cache_verify,
+    settings.blueprint_cache_channel,
+)
+
+
+async def aget(session, blueprint_id: Optional[uuid.UUID]) -> Optional[Blueprint]:
+    if not blueprint_id:
+        return None
+    return await session.run_sync(cache.get, blueprint_id)
+
+
+async def aget_out(session, blueprint_id: uuid.UUID) -> Optional[schemas.BlueprintOut]:
+    return await session.run_sync(cache.get_out, blueprint_id)
+
+
+def invalidate(blueprint_ids: List[uuid.UUID]) -> None:
+    cache.invalidate(blueprint_ids)
@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Hashable, Optional
+
+import redis
+import redis.asyncio as aioredis
+
+from app.config import get_settings
+
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at and expires_at < time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else 0.0
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def _redis_url() -> Optional[str]:
+    url = get_settings().redis_url
+    return url if url.startswith(("redis://", "rediss://", "unix://")) else None
+
+
+@lru_cache
+def get_redis() -> Optional[redis.Redis]:
+    url = _redis_url()
+    if url is None:
+        return None
+    return redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+
+@lru_cache
+def get_async_redis() -> Optional[aioredis.Redis]:
+    url = _redis_url()
+    if url is None:
+        return None
+    return aioredis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+
+@lru_cache
+def get_pubsub_redis() -> Optional[redis.Redis]:
+    url = _redis_url()
+    if url is None:
+        return None
+    return redis.Redis.from_url(url, socket_timeout=None, socket_connect_timeout=0.5, health_check_interval=30)
@@ -0,0 +1,96 @@
+import datetime as dt
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from app.config import get_settings
+
+settings = get_settings()
+_pool = ThreadPoolExecutor(
+    max_workers=max(settings.workflow_step_concurrency, 1), thread_name_prefix="workflow-step"
+)
+
+Step = Dict[str, Any]
+Record = Dict[str, Any]
+
+
+def topological_order(steps: List[Step]) -> List[Step]:
+    by_name = {step["name"]: step for step in steps}
+    if len(by_name) != len(steps):
+        raise ValueError("duplicate step names")
+    ordered: List[Step] = []
+    state: Dict[str, str] = {}
+
+    def visit(name: str) -> None:
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"dependency cycle at step {name}")
+        if name not in by_name:
+            raise ValueError(f"unknown step dependency {name}")
+        state[name] = "visiting"
+        for dependency in by_name[name].get("after", []):
+            visit(dependency)
+        state[name] = "done"
+        ordered.append(by_name[name])
+
+    for step in steps:
+        visit(step["name"])
+    return ordered
+
+
+def timed(name: str, run: Callable[[], Any], after: Optional[List[str]] = None) -> Record:
+    started_at = dt.datetime.utcnow()
+    started = time.perf_counter()
+    try:
+        status, detail = "ok", run()
+    except Exception as exc:
+        status, detail = "failed", str(exc)
+    return {
+        "name": name,
+        "status": status,
+        "detail": detail,
+        "after": after or [],
+        "started_at": started_at.isoformat(),
+        "finished_at": dt.datetime.utcnow().isoformat(),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+def run_dag(steps: List[Step], execute: Callable[[Step], Any], completed: Optional[Dict[str, Record]] = None, concurrency: Optional[int] = None) -> List[Record]:
+    ordered = topological_order(steps)
+    limit = max(concurrency or settings.workflow_step_concurrency, 1)
+    completed = completed or {}
+    records: Dict[str, Record] = {
+        step["name"]: completed[step["name"]] for step in ordered if step["name"] in completed
+    }
+    succeeded = set(records)
+    blocked: set = set()
+    pending = [step for step in ordered if step["name"] not in records]
+    running: Dict[Future, str] = {}
+
+    while pending or running:
+        for step in list(pending):
+            after = step.get("after", [])
+            if any(dependency in blocked for dependency in after):
+                records[step["name"]] = {
+                    "name": step["name"],
+                    "status": "skipped",
+                    "detail": "dependency failed",
+                    "after": after,
+                }
+                blocked.add(step["name"])
+                pending.remove(step)
+            elif len(running) < limit and all(dependency in succeeded for dependency in after):
+                future = _pool.submit(timed, step["name"], lambda step=step: execute(step), after)
+                running[future] = step["name"]
+                pending.remove(step)
+        if not running:
+            break
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+            name = running.pop(future)
+            records[name] = future.result()
+            (succeeded if records[name]["status"] == "ok" else blocked).add(name)
+
+    return [records[step["name"]] for step in ordered]
@@ -1,21 +1,101 @@
+import asyncio
 from contextlib import contextmanager
-from sqlmodel import SQLModel, create_engine, Session
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import URL, Connection, Engine, make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlmodel import Session, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.config import get_settings
 
 
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
 settings = get_settings()
-engine = create_engine(settings.database_url, echo=False)
 
 
-def init_db() -> None:
-    SQLModel.metadata.create_all(engine)
+def async_url(url: str) -> URL:
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    return parsed.set(drivername=driver) if driver else parsed
+
+
+def engine_options(url: URL) -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "echo": False,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle,
+    }
+    if url.get_backend_name() != "sqlite":
+        options.update(
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+        )
+    return options
+
+
+SCHEMA_VERSION = 2
+
+
+@lru_cache
+def get_engine() -> Engine:
+    url = make_url(settings.database_url)
+    return create_engine(url, **engine_options(url))
+
+
+@lru_cache
+def get_async_engine() -> AsyncEngine:
+    url = (
+        make_url(settings.async_database_url)
+        if settings.async_database_url
+        else async_url(settings.database_url)
+    )
+    return create_async_engine(url, **engine_options(url))
+
+
+@lru_cache
+def _async_sessionmaker() -> async_sessionmaker:
+    return async_sessionmaker(get_async_engine(), class_=AsyncSession, expire_on_commit=False)
+
+
+def async_session() -> AsyncSession:
+    return _async_sessionmaker()()
+
+
+def read_schema_version(conn: Connection) -> Optional[int]:
+    try:
+        return conn.execute(text("SELECT version FROM schemaversion WHERE id = 1")).scalar()
+    except DBAPIError:
+        return None
+
+
+async def check_schema() -> Optional[int]:
+    async with get_async_engine().connect() as conn:
+        return await conn.run_sync(read_schema_version)
+
+
+async def prewarm(connections: int) -> None:
+    async def checkout() -> None:
+        async with get_async_engine().connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(checkout() for _ in range(connections)), return_exceptions=True)
 
 
 @contextmanager
 def get_session() -> Session:
-    session = Session(engine)
+    session = Session(get_engine())
     try:
         yield session
     finally:
         session.close()
+
+
+async def get_async_session() -> AsyncIterator[AsyncSession]:
+    async with async_session() as session:
+        yield session
@@ -1,6 +1,11 @@
+import hmac
+import uuid
+from typing import Optional
+
 from fastapi import Depends, Header, HTTPException, status
 
 from app.config import get_settings
+from app.tokens import device_token
 
 
 def require_api_key(x_api_key: str = Header(default=None)) -> None:
@@ -13,3 +18,12 @@ def require_api_key(x_api_key: str = Header(default=None)) -> None:
 
 def optional_api_key(x_api_key: str = Header(default=None)) -> str:
     return x_api_key or ""
+
+
+def require_device_token(device_id: Optional[uuid.UUID] = None, x_device_token: str = Header(default=None), x_api_key: str = Header(default=None)) -> None:
+    if x_api_key and hmac.compare_digest(x_api_key, get_settings().api_key):
+        return
+    if not device_id or not x_device_token or not hmac.compare_digest(x_device_token, device_token(device_id)):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid device token"
+        )
@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+import redis
+
+from app.cache import MISSING, LRUCache, get_async_redis, get_redis
+from app.config import get_settings
+from app.integrations.providers import provider_for
+from app.integrations.state import state_digest
+
+settings = get_settings()
+_local_ttl = settings.plan_etag_ttl if get_redis() is not None else settings.desired_state_ttl
+_assignments = LRUCache(100_000, ttl=_local_ttl)
+_blueprint_hashes = LRUCache(10_000, ttl=_local_ttl)
+
+ASSIGNMENT_KEY = "ztp:device:{}:assignment:v2"
+BLUEPRINT_HASH_KEY = "ztp:blueprint:{}:hash"
+
+
+def etag_for(device_id: uuid.UUID, blueprint_id: Optional[uuid.UUID], blueprint_hash: str, provider: str, state: str = "") -> str:
+    digest = hashlib.sha256(
+        f"{device_id}:{blueprint_id or ''}:{blueprint_hash}:{provider}:{state}".encode()
+    ).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {value.strip() for value in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+async def _redis_get(key: str) -> Optional[str]:
+    client = get_async_redis()
+    if client is None:
+        return None
+    try:
+        value = await client.get(key)
+    except redis.RedisError:
+        return None
+    return value.decode() if value is not None else None
+
+
+async def _redis_set(key: str, value: str) -> None:
+    client = get_async_redis()
+    if client is None:
+        return
+    try:
+        await client.set(key, value, ex=settings.desired_state_ttl)
+    except redis.RedisError:
+        pass
+
+
+async def remember_assignment(device_id: uuid.UUID, blueprint_id: Optional[uuid.UUID], os_type: str, facts: Optional[Dict[str, Any]] = None) -> None:
+    value = (blueprint_id, provider_for(os_type), state_digest(facts))
+    _assignments.set(device_id, value)
+    await _redis_set(ASSIGNMENT_KEY.format(device_id), f"{blueprint_id or ''}|{value[1]}|{value[2]}")
+
+
+async def forget_assignments(device_ids: Iterable[uuid.UUID]) -> None:
+    device_ids = list(device_ids)
+    for device_id in device_ids:
+        _assignments.delete(device_id)
+    client = get_async_redis()
+    if client is None or not device_ids:
+        return
+    try:
+        await client.delete(*(ASSIGNMENT_KEY.format(device_id) for device_id in device_ids))
+    except redis.RedisError:
+        pass
+
+
+async def remember_blueprint(blueprint_id: uuid.UUID, blueprint_hash: str) -> None:
+    _blueprint_hashes.set(blueprint_id, blueprint_hash)
+    await _redis_set(BLUEPRINT_HASH_KEY.format(blueprint_id), blueprint_hash)
+
+
+async def _assignment(device_id: uuid.UUID) -> Optional[Tuple[Optional[uuid.UUID], str, str]]:
+    value = _assignments.get(device_id)
+    if value is not MISSING:
+        return value
+    raw = await _redis_get(ASSIGNMENT_KEY.format(device_id))
+    if raw is None:
+        return None
+    blueprint_ref, provider, state = raw.split("|", 2)
+    value = (uuid.UUID(blueprint_ref) if blueprint_ref else None, provider, state)
+    _assignments.set(device_id, value)
+    return value
+
+
+async def _blueprint_hash(blueprint_id: uuid.UUID) -> Optional[str]:
+    value = _blueprint_hashes.get(blueprint_id)
+    if value is not MISSING:
+        return value
+    value = await _redis_get(BLUEPRINT_HASH_KEY.format(blueprint_id))
+    if value is not None:
+        _blueprint_hashes.set(blueprint_id, value)
+    return value
+
+
+async def cached_etag(device_id: uuid.UUID) -> Optional[str]:
+    assignment = await _assignment(device_id)
+    if assignment is None:
+        return None
+    blueprint_id, provider, state = assignment
+    if blueprint_id is None:
+        return etag_for(device_id, None, "", provider, state)
+    blueprint_hash = await _blueprint_hash(blueprint_id)
+    if blueprint_hash is None:
+        return None
+    return etag_for(device_id, blueprint_id, blueprint_hash, provider, state)
+
+
+async def wait_for_change(etag: str, timeout: float, resolve: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+    deadline = time.monotonic() + min(timeout, settings.plan_poll_max_wait)
+    while time.monotonic() < deadline:
+        await asyncio.sleep(min(settings.plan_poll_interval, max(deadline - time.monotonic(), 0)))
+        current = await resolve()
+        if current != etag:
+            return current
+    return etag
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import redis
+
+from app.cache import get_async_redis, get_redis
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+TERMINAL_STATUSES = {"completed", "failed"}
+
+Key = Tuple[str, str]
+
+
+def _keys(event: Dict[str, Any]) -> List[Key]:
+    return [
+        (kind, str(event[f"{kind}_id"]))
+        for kind in ("workflow", "device", "rollout")
+        if event.get(f"{kind}_id")
+    ]
+
+
+class Broadcaster:
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscribers: Dict[Key, Set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    def subscribe(self, key: Key) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(key, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, key: Key, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(key)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[key]
+
+    def deliver(self, event: Dict[str, Any]) -> None:
+        for key in _keys(event):
+            for queue in self._subscribers.get(key, ()):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(event)
+
+    def deliver_threadsafe(self, events: Iterable[Dict[str, Any]]) -> None:
+        if self._loop is None or self._loop.is_closed():
+            return
+        for event in events:
+            self._loop.call_soon_threadsafe(self.deliver, event)
+
+    async def _listen(self, client) -> None:
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(settings.events_channel)
+                async for message in pubsub.listen():
+                    self.deliver(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("event subscription lost; reconnecting")
+                await asyncio.sleep(1)
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        client = get_async_redis()
+        if client is not None and self._listener is None:
+            self._listener = asyncio.create_task(self._listen(client))
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        self._loop = None
+
+
+broadcaster = Broadcaster(settings.sse_queue_size)
+
+
+def publish_many(events: List[Dict[str, Any]]) -> None:
+    if not events:
+        return
+    client = get_redis()
+    if client is None:
+        broadcaster.deliver_threadsafe(events)
+        return
+    payloads = [json.dumps(event, default=str) for event in events]
+    try:
+        with client.pipeline(transaction=False) as pipe:
+            for payload in payloads:
+                pipe.publish(settings.events_channel, payload)
+            pipe.execute()
+    except redis.RedisError:
+        logger.warning("could not publish %d workflow events", len(events))
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    return f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, default=str)}\n\n"
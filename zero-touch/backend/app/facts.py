@@ -0,0 +1,361 @@
+import ipaddress
+import json
+import re
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, Set, Tuple
+
+from sqlalchemy import Numeric, String, case, cast, func, inspect, literal_column, not_, or_, text
+from sqlalchemy.dialects.postgresql import INET, JSONB
+from sqlalchemy.engine import Connection, make_url
+from sqlalchemy.sql.elements import ColumnElement
+
+from app.cache import MISSING
+from app.config import get_settings
+from app.models import Device
+
+settings = get_settings()
+DIALECT = make_url(settings.database_url).get_backend_name()
+
+KEY_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_-]*$")
+PROMOTED_FACTS = tuple(
+    key.strip()
+    for key in settings.promoted_facts.split(",")
+    if key.strip() and re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", key.strip())
+)
+DEVICE_COLUMNS = {"hostname", "os_type", "arch", "status"}
+IPV4_PATTERN = r"^((25[0-5]|2[0-4][0-9]|1?[0-9]?[0-9])\.){3}(25[0-5]|2[0-4][0-9]|1?[0-9]?[0-9])$"
+
+TOKEN = re.compile(
+    r'\s*(?:(?P<string>"(?:[^"\\]|\\.)*")|(?P<list>\[[^\]]*\])|(?P<op>>=|<=|!=|=|<|>)|(?P<word>[^\s\[\]"=<>!]+))'
+)
+OPERATORS = {"=", "!=", "<", "<=", ">", ">=", "in", "exists"}
+NETWORKS = (ipaddress.IPv4Network, ipaddress.IPv6Network)
+STRING_TYPE = "string" if DIALECT == "postgresql" else "text"
+
+PostFilter = Callable[[Dict[str, Any]], bool]
+Predicate = Callable[[Dict[str, Any]], bool]
+
+
+class QueryError(ValueError):
+    pass
+
+
+class Condition(NamedTuple):
+    field: str
+    path: Tuple[str, ...]
+    op: str
+    value: Any
+
+
+def _scalar(token: str) -> Any:
+    token = token.strip()
+    if token.startswith('"'):
+        return json.loads(token)
+    if token in ("true", "false", "null"):
+        return json.loads(token)
+    try:
+        return int(token)
+    except ValueError:
+        pass
+    try:
+        return float(token)
+    except ValueError:
+        pass
+    if "/" in token:
+        try:
+            return ipaddress.ip_network(token, strict=False)
+        except ValueError:
+            pass
+    return token
+
+
+def _tokens(query: str) -> List[Tuple[str, str]]:
+    tokens, position = [], 0
+    query = query.strip()
+    while position < len(query):
+        match = TOKEN.match(query, position)
+        if not match or match.end() == position:
+            raise QueryError(f"unexpected input at offset {position}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+def _field(token: str) -> Tuple[str, Tuple[str, ...]]:
+    if token in DEVICE_COLUMNS:
+        return token, ()
+    if token.startswith("facts."):
+        path = tuple(token[len("facts."):].split("."))
+        if all(KEY_PATTERN.match(key) for key in path):
+            return "facts", path
+    raise QueryError(f"unknown field {token!r}")
+
+
+def parse(query: str) -> List[Condition]:
+    conditions: List[Condition] = []
+    tokens = _tokens(query)
+    index = 0
+    while index < len(tokens):
+        if conditions:
+            if tokens[index][1].lower() != "and":
+                raise QueryError(f"expected 'and', got {tokens[index][1]!r}")
+            index += 1
+        if index + 1 >= len(tokens):
+            raise QueryError("incomplete condition")
+        field, path = _field(tokens[index][1])
+        op = tokens[index + 1][1].lower()
+        if op not in OPERATORS:
+            raise QueryError(f"unknown operator {tokens[index + 1][1]!r}")
+        if op == "exists":
+            if field != "facts":
+                raise QueryError("'exists' only applies to facts")
+            conditions.append(Condition(field, path, op, None))
+            index += 2
+            continue
+        if index + 2 >= len(tokens):
+            raise QueryError(f"missing value for {tokens[index][1]}")
+        kind, raw = tokens[index + 2]
+        if op == "in" and kind == "list":
+            value: Any = [_scalar(item) for item in raw[1:-1].split(",") if item.strip()]
+        elif kind in ("string", "word"):
+            value = _scalar(raw)
+        else:
+            raise QueryError(f"unexpected {raw!r}")
+        if op == "in" and not isinstance(value, (list, *NETWORKS)):
+            raise QueryError("'in' expects a [list] or a CIDR network")
+        if field != "facts" and (op not in ("=", "!=", "in") or isinstance(value, NETWORKS)):
+            raise QueryError(f"unsupported comparison on {field}")
+        conditions.append(Condition(field, path, op, value))
+        index += 3
+    return conditions
+
+
+def _lookup(facts: Any, path: Sequence[str]) -> Any:
+    for key in path:
+        if not isinstance(facts, dict) or key not in facts:
+            return MISSING
+        facts = facts[key]
+    return facts
+
+
+def _in_network(value: Any, network) -> bool:
+    if not isinstance(value, str):
+        return False
+    try:
+        return ipaddress.ip_address(value) in network
+    except ValueError:
+        return False
+
+
+def _same(actual: Any, expected: Any) -> bool:
+    if expected is None or isinstance(expected, (bool, str)):
+        return type(actual) is type(expected) and actual == expected
+    return isinstance(actual, (int, float)) and not isinstance(actual, bool) and actual == expected
+
+
+def _nested(path: Sequence[str], value: Any) -> Dict[str, Any]:
+    for key in reversed(path[1:]):
+        value = {key: value}
+    return {path[0]: value}
+
+
+def _promoted(path: Sequence[str]) -> bool:
+    return len(path) == 1 and path[0] in PROMOTED_FACTS
+
+
+def _promoted_column(path: Sequence[str]) -> ColumnElement:
+    return literal_column(f"device.fact_{path[0]}", String)
+
+
+def _sqlite_path(path: Sequence[str]) -> str:
+    return "$" + "".join(f'."{key}"' for key in path)
+
+
+def _document() -> ColumnElement:
+    return cast(Device.facts, JSONB)
+
+
+def _jsonb(path: Sequence[str]):
+    document = _document()
+    return document[path[0]] if len(path) == 1 else document[tuple(path)]
+
+
+def fact_text(path: Sequence[str]) -> ColumnElement:
+    if _promoted(path):
+        return _promoted_column(path)
+    if DIALECT == "postgresql":
+        return _jsonb(path).astext
+    return func.json_extract(Device.facts, _sqlite_path(path))
+
+
+def fact_type(path: Sequence[str]) -> ColumnElement:
+    if DIALECT == "postgresql":
+        return func.jsonb_typeof(_jsonb(path))
+    return func.json_type(Device.facts, _sqlite_path(path))
+
+
+def fact_exists(path: Sequence[str]) -> ColumnElement:
+    if DIALECT == "postgresql":
+        if len(path) == 1:
+            return _document().has_key(path[0])
+        return _jsonb(path).isnot(None)
+    return fact_type(path).isnot(None)
+
+
+def fact_equals(path: Sequence[str], value: Any) -> ColumnElement:
+    if isinstance(value, str) and _promoted(path):
+        return (_promoted_column(path) == value) & (fact_type(path) == STRING_TYPE)
+    if DIALECT == "postgresql":
+        return _document().contains(_nested(path, value))
+    if value is None:
+        return fact_type(path) == "null"
+    if isinstance(value, bool):
+        return fact_type(path) == ("true" if value else "false")
+    if isinstance(value, str):
+        return (fact_type(path) == STRING_TYPE) & (fact_text(path) == value)
+    return fact_type(path).in_(("integer", "real")) & (fact_text(path) == value)
+
+
+def _compare(path: Sequence[str], op: str, value: Any) -> ColumnElement:
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise QueryError(f"'{op}' needs a number or string")
+    if isinstance(value, str):
+        expression = case((fact_type(path) == STRING_TYPE, fact_text(path)))
+    elif DIALECT == "postgresql":
+        expression = case((fact_type(path) == "number", cast(_jsonb(path).astext, Numeric)))
+    else:
+        expression = case(
+            (fact_type(path).in_(("integer", "real")), func.json_extract(Device.facts, _sqlite_path(path)))
+        )
+    return {
+        "<": expression < value,
+        "<=": expression <= value,
+        ">": expression > value,
+        ">=": expression >= value,
+    }[op]
+
+
+def _cidr(path: Sequence[str], network) -> Tuple[List[ColumnElement], List[PostFilter]]:
+    clauses: List[ColumnElement] = [fact_exists(path)]
+    octets = network.prefixlen // 8 if network.version == 4 else 0
+    if octets:
+        prefix = ".".join(str(network.network_address).split(".")[:octets]) + ".%"
+        clauses.append(fact_text(path).like(prefix))
+    if DIALECT == "postgresql" and network.version == 4:
+        address = fact_text(path)
+        clauses.append(
+            case((address.op("~")(IPV4_PATTERN), cast(address, INET))).op("<<=")(
+                cast(str(network), INET)
+            )
+        )
+        return clauses, []
+
+    return clauses, [lambda facts: _in_network(_lookup(facts, path), network)]
+
+
+def compile_conditions(conditions: List[Condition]) -> Tuple[List[ColumnElement], List[PostFilter]]:
+    clauses: List[ColumnElement] = []
+    post_filters: List[PostFilter] = []
+    for condition in conditions:
+        if condition.field != "facts":
+            column = getattr(Device, condition.field)
+            if condition.op == "in":
+                clauses.append(column.in_([str(item) for item in condition.value]))
+            elif condition.op == "=":
+                clauses.append(column == str(condition.value))
+            else:
+                clauses.append(column != str(condition.value))
+            continue
+        path, op, value = condition.path, condition.op, condition.value
+        if op == "exists":
+            clauses.append(fact_exists(path))
+        elif op == "=":
+            clauses.append(fact_equals(path, value))
+        elif op == "!=":
+            clauses.append(fact_exists(path) & not_(fact_equals(path, value)))
+        elif op == "in" and isinstance(value, list):
+            clauses.append(or_(*[fact_equals(path, item) for item in value]) if value else text("1 = 0"))
+        elif op == "in":
+            network_clauses, network_filters = _cidr(path, value)
+            clauses += network_clauses
+            post_filters += network_filters
+        else:
+            clauses.append(_compare(path, op, value))
+    return clauses, post_filters
+
+
+def ensure_fact_indexes(conn: Connection) -> None:
+    existing = {column["name"] for column in inspect(conn).get_columns("device")}
+    for key in PROMOTED_FACTS:
+        column = f"fact_{key}"
+        if DIALECT == "postgresql":
+            if column not in existing:
+                conn.execute(
+                    text(
+                        f"ALTER TABLE device ADD COLUMN {column} text "
+                        f"GENERATED ALWAYS AS (facts ->> '{key}') STORED"
+                    )
+                )
+            conn.execute(
+                text(f"CREATE INDEX IF NOT EXISTS ix_device_{column} ON device ({column} text_pattern_ops)")
+            )
+        elif DIALECT == "sqlite":
+            if column not in existing:
+                conn.execute(
+                    text(
+                        f"ALTER TABLE device ADD COLUMN {column} TEXT "
+                        f"GENERATED ALWAYS AS (json_extract(facts, '$.\"{key}\"')) VIRTUAL"
+                    )
+                )
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_device_{column} ON device ({column})"))
+
+
+def _condition_predicate(condition: Condition) -> Predicate:
+    op, value = condition.op, condition.value
+    if condition.field != "facts":
+        field = condition.field
+        if op == "in":
+            allowed = {str(item) for item in value}
+            return lambda row: str(row.get(field)) in allowed
+        if op == "=":
+            return lambda row: str(row.get(field)) == str(value)
+        return lambda row: str(row.get(field)) != str(value)
+
+    path = condition.path
+    if op == "exists":
+        return lambda row: _lookup(row.get("facts"), path) is not MISSING
+    if op == "=":
+        return lambda row: _same(_lookup(row.get("facts"), path), value)
+    if op == "!=":
+        return lambda row: (actual := _lookup(row.get("facts"), path)) is not MISSING and not _same(actual, value)
+    if op == "in" and isinstance(value, list):
+        return lambda row: any(_same(_lookup(row.get("facts"), path), item) for item in value)
+    if op == "in":
+        return lambda row: _in_network(_lookup(row.get("facts"), path), value)
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise QueryError(f"'{op}' needs a number or string")
+    compare = {
+        "<": lambda a, b: a < b,
+        "<=": lambda a, b: a <= b,
+        ">": lambda a, b: a > b,
+        ">=": lambda a, b: a >= b,
+    }[op]
+    kinds = (str,) if isinstance(value, str) else (int, float)
+
+    def check(row: Dict[str, Any]) -> bool:
+        actual = _lookup(row.get("facts"), path)
+        return isinstance(actual, kinds) and not isinstance(actual, bool) and compare(actual, value)
+
+    return check
+
+
+def compile_predicate(conditions: List[Condition]) -> Predicate:
+    checks = [_condition_predicate(condition) for condition in conditions]
+    return lambda row: all(check(row) for check in checks)
+
+
+def referenced_fields(conditions: List[Condition]) -> Set[str]:
+    return {
+        f"facts.{condition.path[0]}" if condition.field == "facts" else condition.field
+        for condition in conditions
+    }
@@ -0,0 +1,114 @@
+import datetime as dt
+import threading
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, delete, func, insert
+from sqlmodel import Session, select
+
+from app import facts
+from app.models import Device, DeviceGroup, GroupMembership
+
+DEVICE_FIELDS = ("hostname", "os_type", "arch", "status")
+
+
+class GroupIndex:
+    def __init__(self, groups: Iterable[Tuple[uuid.UUID, str]]):
+        self.predicates: Dict[uuid.UUID, facts.Predicate] = {}
+        self.by_field: Dict[str, Set[uuid.UUID]] = defaultdict(set)
+        for group_id, query in groups:
+            conditions = facts.parse(query)
+            self.predicates[group_id] = facts.compile_predicate(conditions)
+            for field in facts.referenced_fields(conditions):
+                self.by_field[field].add(group_id)
+
+    def candidates(self, changed: Optional[Set[str]] = None) -> Set[uuid.UUID]:
+        if changed is None:
+            return set(self.predicates)
+        return {group_id for field in changed for group_id in self.by_field.get(field, ())}
+
+
+_index: Optional[GroupIndex] = None
+_index_version: Any = None
+_index_lock = threading.Lock()
+
+
+def group_index(session: Session) -> GroupIndex:
+    global _index, _index_version
+    version = tuple(session.exec(select(func.count(), func.max(DeviceGroup.updated_at))).one())
+    with _index_lock:
+        if _index is None or version != _index_version:
+            groups = session.exec(select(DeviceGroup.id, DeviceGroup.query)).all()
+            _index, _index_version = GroupIndex(groups), version
+        return _index
+
+
+def _row(device: Any) -> Dict[str, Any]:
+    return {**{field: getattr(device, field) for field in DEVICE_FIELDS}, "facts": device.facts or {}}
+
+
+def _apply_diff(session: Session, current: Set[Tuple[uuid.UUID, uuid.UUID]], desired: Set[Tuple[uuid.UUID, uuid.UUID]]) -> Tuple[int, int]:
+    added, removed = desired - current, current - desired
+    if added:
+        now = dt.datetime.utcnow()
+        session.execute(
+            insert(GroupMembership),
+            [{"group_id": group_id, "device_id": device_id, "added_at": now} for group_id, device_id in added],
+        )
+    if removed:
+        table = GroupMembership.__table__
+        session.execute(
+            delete(table).where(
+                table.c.group_id == bindparam("_group_id"),
+                table.c.device_id == bindparam("_device_id"),
+            ),
+            [{"_group_id": group_id, "_device_id": device_id} for group_id, device_id in removed],
+        )
+    return len(added), len(removed)
+
+
+def update_memberships(session: Session, device_ids: Iterable[uuid.UUID], changed: Optional[Set[str]] = None) -> Tuple[int, int]:
+    device_ids = list(device_ids)
+    if not device_ids:
+        return 0, 0
+    index = group_index(session)
+    candidates = index.candidates(changed)
+    if not candidates:
+        return 0, 0
+    devices = session.exec(
+        select(Device.id, Device.hostname, Device.os_type, Device.arch, Device.status, Device.facts)
+        .where(Device.id.in_(device_ids))
+    ).all()
+    current = set(
+        session.exec(
+            select(GroupMembership.group_id, GroupMembership.device_id).where(
+                GroupMembership.device_id.in_(device_ids),
+                GroupMembership.group_id.in_(candidates),
+            )
+        ).all()
+    )
+    desired = set()
+    for device in devices:
+        row = _row(device)
+        desired.update(
+            (group_id, device.id) for group_id in candidates if index.predicates[group_id](row)
+        )
+    return _apply_diff(session, current, desired)
+
+
+def rebuild_group(session: Session, group: DeviceGroup) -> Tuple[int, int]:
+    clauses, post_filters = facts.compile_conditions(facts.parse(group.query))
+    if post_filters:
+        rows = session.exec(select(Device.id, Device.facts).where(*clauses)).all()
+        matches = {device_id for device_id, device_facts in rows if all(check(device_facts or {}) for check in post_filters)}
+    else:
+        matches = set(session.exec(select(Device.id).where(*clauses)).all())
+    current = set(
+        session.exec(
+            select(GroupMembership.group_id, GroupMembership.device_id).where(
+                GroupMembership.group_id == group.id
+            )
+        ).all()
+    )
+    return _apply_diff(session, current, {(group.id, device_id) for device_id in matches})
@@ -0,0 +1,255 @@
+import asyncio
+import datetime as dt
+import json
+import logging
+import threading
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import redis
+from sqlalchemy import bindparam, update
+from sqlmodel import select
+
+from app import desired_state, groups
+from app.cache import get_async_redis
+from app.config import get_settings
+from app.db import async_session
+from app.integrations.state import STATE_FACTS
+from app.models import Device
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+Entry = Tuple[uuid.UUID, dt.datetime, Dict[str, Any]]
+
+REQUEUE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if not current or current < ARGV[2] then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+end
+for i = 3, #ARGV, 2 do
+    redis.call('HSETNX', KEYS[2], ARGV[i], ARGV[i + 1])
+end
+redis.call('SADD', KEYS[3], ARGV[1])
+"""
+
+
+class MemoryHeartbeatBuffer:
+    def __init__(self):
+        self._pending: Dict[uuid.UUID, Tuple[dt.datetime, Dict[str, Any]]] = {}
+        self._last_seen: Dict[uuid.UUID, dt.datetime] = {}
+        self._lock = threading.Lock()
+
+    async def record(self, device_id: uuid.UUID, seen_at: dt.datetime, facts: Dict[str, Any]) -> None:
+        with self._lock:
+            _, pending_facts = self._pending.get(device_id, (seen_at, {}))
+            pending_facts.update(facts)
+            self._pending[device_id] = (seen_at, pending_facts)
+            self._last_seen[device_id] = seen_at
+
+    async def requeue(self, entries: List[Entry]) -> None:
+        with self._lock:
+            for device_id, seen_at, facts in entries:
+                pending_seen, pending_facts = self._pending.get(device_id, (seen_at, {}))
+                self._pending[device_id] = (max(seen_at, pending_seen), {**facts, **pending_facts})
+                self._last_seen[device_id] = max(seen_at, self._last_seen.get(device_id, seen_at))
+
+    async def drain(self, limit: int) -> List[Entry]:
+        with self._lock:
+            device_ids = list(self._pending)[:limit]
+            return [(device_id, *self._pending.pop(device_id)) for device_id in device_ids]
+
+    async def last_seen(self, device_ids: Iterable[uuid.UUID]) -> Dict[uuid.UUID, dt.datetime]:
+        with self._lock:
+            return {
+                device_id: self._last_seen[device_id]
+                for device_id in device_ids
+                if device_id in self._last_seen
+            }
+
+    async def forget(self, entries: List[Entry]) -> None:
+        with self._lock:
+            for device_id, seen_at, _ in entries:
+                if self._last_seen.get(device_id) == seen_at and device_id not in self._pending:
+                    del self._last_seen[device_id]
+
+
+class RedisHeartbeatBuffer:
+    LAST_SEEN_KEY = "ztp:hb:last_seen"
+    DIRTY_KEY = "ztp:hb:dirty"
+    FACTS_KEY = "ztp:hb:facts:{}"
+
+    def __init__(self, client):
+        self.client = client
+        self.fallback = MemoryHeartbeatBuffer()
+        self._requeue = client.register_script(REQUEUE_SCRIPT)
+
+    async def record(self, device_id: uuid.UUID, seen_at: dt.datetime, facts: Dict[str, Any]) -> None:
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.hset(self.LAST_SEEN_KEY, str(device_id), seen_at.isoformat())
+                if facts:
+                    pipe.hset(
+                        self.FACTS_KEY.format(device_id),
+                        mapping={key: json.dumps(value) for key, value in facts.items()},
+                    )
+                pipe.sadd(self.DIRTY_KEY, str(device_id))
+                await pipe.execute()
+        except redis.RedisError:
+            logger.warning("heartbeat buffer unavailable; buffering in process")
+            await self.fallback.record(device_id, seen_at, facts)
+
+    async def requeue(self, entries: List[Entry]) -> None:
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for device_id, seen_at, facts in entries:
+                    args = [str(device_id), seen_at.isoformat()]
+                    for key, value in facts.items():
+                        args += [key, json.dumps(value)]
+                    await self._requeue(
+                        keys=[self.LAST_SEEN_KEY, self.FACTS_KEY.format(device_id), self.DIRTY_KEY],
+                        args=args,
+                        client=pipe,
+                    )
+                await pipe.execute()
+        except redis.RedisError:
+            await self.fallback.requeue(entries)
+
+    async def drain(self, limit: int) -> List[Entry]:
+        entries = await self.fallback.drain(limit)
+        if len(entries) >= limit:
+            return entries
+        try:
+            return entries + await self._drain(limit - len(entries))
+        except redis.RedisError:
+            logger.warning("heartbeat buffer unavailable; flushing in-process heartbeats only")
+            return entries
+
+    async def _drain(self, limit: int) -> List[Entry]:
+        device_ids = await self.client.spop(self.DIRTY_KEY, limit)
+        if not device_ids:
+            return []
+        device_ids = [raw.decode() for raw in device_ids]
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hmget(self.LAST_SEEN_KEY, device_ids)
+            for device_id in device_ids:
+                pipe.hgetall(self.FACTS_KEY.format(device_id))
+                pipe.delete(self.FACTS_KEY.format(device_id))
+            results = await pipe.execute()
+        seen = results[0]
+        facts = results[1::2]
+        entries = []
+        for device_id, seen_at, raw_facts in zip(device_ids, seen, facts):
+            if seen_at is None:
+                continue
+            entries.append(
+                (
+                    uuid.UUID(device_id),
+                    dt.datetime.fromisoformat(seen_at.decode()),
+                    {key.decode(): json.loads(value) for key, value in raw_facts.items()},
+                )
+            )
+        return entries
+
+    async def last_seen(self, device_ids: Iterable[uuid.UUID]) -> Dict[uuid.UUID, dt.datetime]:
+        device_ids = list(device_ids)
+        found = await self.fallback.last_seen(device_ids)
+        if not device_ids:
+            return found
+        try:
+            values = await self.client.hmget(self.LAST_SEEN_KEY, [str(d) for d in device_ids])
+        except redis.RedisError:
+            return found
+        for device_id, value in zip(device_ids, values):
+            if value is not None:
+                seen_at = dt.datetime.fromisoformat(value.decode())
+                found[device_id] = max(seen_at, found.get(device_id, seen_at))
+        return found
+
+    async def forget(self, entries: List[Entry]) -> None:
+        await self.fallback.forget(entries)
+
+
+def _make_buffer():
+    client = get_async_redis()
+    return RedisHeartbeatBuffer(client) if client is not None else MemoryHeartbeatBuffer()
+
+
+buffer = _make_buffer()
+
+
+async def record(device_id: uuid.UUID, facts: Dict[str, Any]) -> dt.datetime:
+    seen_at = dt.datetime.utcnow()
+    await buffer.record(device_id, seen_at, facts)
+    return seen_at
+
+
+async def merged_last_seen(devices: List[Device]) -> Dict[uuid.UUID, Optional[dt.datetime]]:
+    buffered = await buffer.last_seen(device.id for device in devices)
+    merged = {}
+    for device in devices:
+        candidates = [value for value in (device.last_seen, buffered.get(device.id)) if value]
+        merged[device.id] = max(candidates) if candidates else None
+    return merged
+
+
+async def flush(limit: Optional[int] = None) -> int:
+    entries = await buffer.drain(limit or settings.heartbeat_flush_batch)
+    if not entries:
+        return 0
+    try:
+        await _apply(entries)
+    except Exception:
+        await buffer.requeue(entries)
+        raise
+    await buffer.forget(entries)
+    return len(entries)
+
+
+async def _apply(entries: List[Entry]) -> None:
+    table = Device.__table__
+    seen_rows = [{"_id": device_id, "last_seen": seen_at} for device_id, seen_at, _ in entries]
+    with_facts = {device_id: facts for device_id, _, facts in entries if facts}
+    async with async_session() as session:
+        await session.execute(
+            update(table)
+            .where(table.c.id == bindparam("_id"))
+            .values(last_seen=bindparam("last_seen")),
+            seen_rows,
+        )
+        if with_facts:
+            current = await session.exec(
+                select(Device.id, Device.facts).where(Device.id.in_(list(with_facts)))
+            )
+            fact_rows = [
+                {"_id": device_id, "facts": {**(facts or {}), **with_facts[device_id]}}
+                for device_id, facts in current.all()
+            ]
+            if fact_rows:
+                await session.execute(
+                    update(table)
+                    .where(table.c.id == bindparam("_id"))
+                    .values(facts=bindparam("facts")),
+                    fact_rows,
+                )
+                changed = {f"facts.{key}" for facts in with_facts.values() for key in facts}
+                await session.run_sync(
+                    groups.update_memberships, [row["_id"] for row in fact_rows], changed
+                )
+        await session.commit()
+    await desired_state.forget_assignments(
+        device_id for device_id, facts in with_facts.items() if any(key in facts for key in STATE_FACTS)
+    )
+
+
+async def run_flusher(stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=settings.heartbeat_flush_interval)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            while await flush() >= settings.heartbeat_flush_batch:
+                pass
+        except Exception:
+            logger.exception("heartbeat flush failed")
@@ -1,3 +1,5 @@
+from app.integrations.plans import content_hash, plan_for, render, steps_for
 from app.integrations.providers import dispatch
+from app.integrations.state import diff, state_digest
 
-__all__ = ["dispatch"]
+__all__ = ["content_hash", "diff", "dispatch", "plan_for", "render", "state_digest", "steps_for"]
@@ -0,0 +1,77 @@
+import hashlib
+import json
+from string import Template
+from typing import Any, Callable, Dict, List
+
+import redis
+
+from app.cache import MISSING, LRUCache, get_redis
+from app.config import get_settings
+from app.integrations.providers import PROVIDERS, ProvisionResult, provider_for
+from app.integrations.state import diff
+from app.metrics import PLAN_CACHE
+
+HASHED_FIELDS = ("os_targets", "packages", "files", "users", "security")
+
+settings = get_settings()
+_local = LRUCache(settings.plan_cache_size)
+
+
+def content_hash(blueprint: Dict[str, Any]) -> str:
+    payload = {field: blueprint.get(field) for field in HASHED_FIELDS}
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def compile_plan(provider: str, blueprint: Dict[str, Any]) -> List[Dict[str, Any]]:
+    result = PROVIDERS[provider](blueprint, {})
+    if not result.ok:
+        raise RuntimeError(result.error or "plan compilation failed")
+    return result.steps
+
+
+def get_plan(blueprint_hash: str, provider: str, load: Callable[[], Dict[str, Any]]) -> List[Dict[str, Any]]:
+    key = (blueprint_hash, provider)
+    plan = _local.get(key)
+    if plan is not MISSING:
+        PLAN_CACHE.labels("local_hit").inc()
+        return plan
+
+    client = get_redis()
+    redis_key = f"ztp:plan:v3:{blueprint_hash}:{provider}"
+    if client is not None:
+        try:
+            raw = client.get(redis_key)
+        except redis.RedisError:
+            raw = None
+        if raw is not None:
+            plan = json.loads(raw)
+            _local.set(key, plan)
+            PLAN_CACHE.labels("redis_hit").inc()
+            return plan
+
+    PLAN_CACHE.labels("miss").inc()
+    plan = compile_plan(provider, load())
+    _local.set(key, plan)
+    if client is not None:
+        try:
+            client.set(redis_key, json.dumps(plan), ex=settings.plan_cache_ttl)
+        except redis.RedisError:
+            pass
+    return plan
+
+
+def render(actions: List[str], facts: Dict[str, Any]) -> List[str]:
+    return [Template(action).safe_substitute(facts) if "$" in action else action for action in actions]
+
+
+def steps_for(os_type: str, blueprint: Any) -> List[Dict[str, Any]]:
+    blueprint_hash = blueprint.content_hash or content_hash(blueprint.dict())
+    return get_plan(blueprint_hash, provider_for(os_type), blueprint.dict)
+
+
+def plan_for(os_type: str, blueprint: Any, facts: Dict[str, Any]) -> ProvisionResult:
+    delta, unchanged = diff(steps_for(os_type, blueprint), facts or {})
+    steps = [{**step, "actions": render(step["actions"], facts or {})} for step in delta]
+    return ProvisionResult(ok=True, steps=steps, unchanged=unchanged)
+
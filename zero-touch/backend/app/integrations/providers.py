@@ -1,49 +1,101 @@
-from typing import Dict, List
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from app.integrations.state import content_digest
 
 
 class ProvisionResult:
-    def __init__(self, ok: bool, actions: List[str], error: str | None = None):
+    def __init__(self, ok: bool, actions: List[str] | None = None, error: str | None = None, steps: List[Dict[str, Any]] | None = None, unchanged: Dict[str, List[str]] | None = None):
         self.ok = ok
-        self.actions = actions
+        self.steps = steps or []
+        self.unchanged = unchanged or {}
+        self.actions = actions if actions is not None else [action for step in self.steps for action in step["actions"]]
         self.error = error
 
 
+def step(name: str, actions: List[str], after: Sequence[str] = (), items: Optional[List[Dict[str, Any]]] = None, batch: Optional[str] = None) -> Dict[str, Any]:
+    return {"name": name, "after": list(after), "actions": actions, "items": items or [], "batch": batch}
+
+
+def item(kind: str, key: str, action: Optional[str] = None, digest: Optional[str] = None) -> Dict[str, Any]:
+    return {"kind": kind, "key": key, "action": action, "digest": digest}
+
+
+def file_item(path: str, content: Any) -> Dict[str, Any]:
+    if isinstance(content, dict) and "sha256" in content:
+        digest = content["sha256"]
+        return item("file", path, f"fetch blob {digest} -> {path} ({content.get('size', 0)} bytes)", digest)
+    return item("file", path, f"write file {path} ({len(str(content))} chars)", content_digest(content))
+
+
 def for_windows(blueprint: dict, facts: dict) -> ProvisionResult:
-    actions = []
+    steps = []
     packages = blueprint.get("packages", {}).get("choco", [])
     if packages:
-        actions.append(f"choco install {' '.join(packages)} -y")
+        steps.append(
+            step(
+                "packages",
+                [f"choco install {' '.join(packages)} -y"],
+                items=[item("package", package) for package in packages],
+                batch="choco install {} -y",
+            )
+        )
     users = blueprint.get("users", {}).get("local", [])
-    for user in users:
-        actions.append(f"powershell.exe New-LocalUser {user.get('name')}")
-    return ProvisionResult(ok=True, actions=actions)
+    if users:
+        actions = [f"powershell.exe New-LocalUser {user.get('name')}" for user in users]
+        steps.append(
+            step(
+                "users",
+                actions,
+                items=[item("user", str(user.get("name")), action) for user, action in zip(users, actions)],
+            )
+        )
+    return ProvisionResult(ok=True, steps=steps)
 
 
 def for_macos_linux(blueprint: dict, facts: dict) -> ProvisionResult:
-    actions = []
+    steps = []
     pkgs = blueprint.get("packages", {}).get("brew", []) or blueprint.get(
         "packages", {}
     ).get("apt", [])
     if pkgs:
-        actions.append(f"install packages: {' '.join(pkgs)}")
+        steps.append(
+            step(
+                "packages",
+                [f"install packages: {' '.join(pkgs)}"],
+                items=[item("package", package) for package in pkgs],
+                batch="install packages: {}",
+            )
+        )
     files = blueprint.get("files", {})
-    for path, content in files.items():
-        actions.append(f"write file {path} ({len(str(content))} chars)")
-    return ProvisionResult(ok=True, actions=actions)
+    if files:
+        items = [file_item(path, content) for path, content in files.items()]
+        steps.append(step("files", [entry["action"] for entry in items], items=items))
+    return ProvisionResult(ok=True, steps=steps)
 
 
 def for_mobile_or_iot(blueprint: dict, facts: dict) -> ProvisionResult:
     webhook = blueprint.get("security", {}).get("mdm_webhook")
-    actions = []
+    steps = []
     if webhook:
-        actions.append(f"invoke webhook {webhook}")
-    return ProvisionResult(ok=True, actions=actions)
+        steps.append(step("webhook", [f"invoke webhook {webhook}"]))
+    return ProvisionResult(ok=True, steps=steps)
 
 
-def dispatch(os_type: str, blueprint: dict, facts: dict) -> ProvisionResult:
+PROVIDERS: Dict[str, Callable[[dict, dict], ProvisionResult]] = {
+    "windows": for_windows,
+    "macos-linux": for_macos_linux,
+    "mobile-iot": for_mobile_or_iot,
+}
+
+
+def provider_for(os_type: str) -> str:
     lowered = os_type.lower()
     if "windows" in lowered:
-        return for_windows(blueprint, facts)
+        return "windows"
     if lowered in {"macos", "darwin", "linux"}:
-        return for_macos_linux(blueprint, facts)
-    return for_mobile_or_iot(blueprint, facts)
+        return "macos-linux"
+    return "mobile-iot"
+
+
+def dispatch(os_type: str, blueprint: dict, facts: dict) -> ProvisionResult:
+    return PROVIDERS[provider_for(os_type)](blueprint, facts)
@@ -0,0 +1,63 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+STATE_FACTS = ("packages", "files", "users")
+
+
+def content_digest(content: Any) -> str:
+    return hashlib.sha256(str(content).encode()).hexdigest()
+
+
+def state_digest(facts: Optional[Dict[str, Any]]) -> str:
+    state = {key: facts[key] for key in STATE_FACTS if key in (facts or {})}
+    if not state:
+        return ""
+    encoded = json.dumps(state, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+
+def _names(value: Any) -> Set[str]:
+    if isinstance(value, dict):
+        return {str(key).lower() for key in value}
+    if isinstance(value, (list, tuple, set)):
+        return {str(item.get("name") if isinstance(item, dict) else item).lower() for item in value}
+    return set()
+
+
+def _present(item: Dict[str, Any], facts: Dict[str, Any]) -> bool:
+    kind = item["kind"]
+    if kind == "package":
+        return item["key"].lower() in _names(facts.get("packages"))
+    if kind == "user":
+        return item["key"].lower() in _names(facts.get("users"))
+    if kind == "file":
+        reported = facts.get("files")
+        return isinstance(reported, dict) and reported.get(item["key"]) == item["digest"]
+    return False
+
+
+def diff(steps: List[Dict[str, Any]], facts: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str, List[str]]]:
+    delta: List[Dict[str, Any]] = []
+    unchanged: Dict[str, List[str]] = {}
+    for step in steps:
+        items = step.get("items") or []
+        if not items:
+            delta.append(step)
+            continue
+        missing = [item for item in items if not _present(item, facts)]
+        done = [item["key"] for item in items if item not in missing]
+        if done:
+            unchanged[step["name"]] = done
+        if not missing:
+            continue
+        if len(missing) == len(items):
+            delta.append(step)
+        elif step.get("batch"):
+            delta.append({**step, "items": missing, "actions": [step["batch"].format(" ".join(item["key"] for item in missing))]})
+        else:
+            delta.append({**step, "items": missing, "actions": [item["action"] for item in missing]})
+    kept = {step["name"] for step in delta}
+    return [
+        {**step, "after": [name for name in step.get("after", []) if name in kept]} for step in delta
+    ], unchanged
@@ -1,9 +1,13 @@
-from fastapi import FastAPI
+import asyncio
+
+from fastapi import FastAPI, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 
-from app import models
-from app.db import init_db
-from app.routers import blueprints, devices, enrollment, workflows
+from app import audit, events, heartbeats, metrics, models, tokens
+from app.config import get_settings
+from app.db import SCHEMA_VERSION, check_schema, get_async_engine, get_engine, prewarm
+from app.routers import audit as audit_router, blobs, blueprints, devices, enrollment, groups, summary, workflows
 
 
 def create_app() -> FastAPI:
@@ -15,19 +19,57 @@ def create_app() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    settings = get_settings()
+    if settings.metrics_enabled:
+        metrics.install(lambda: [get_engine(), get_async_engine().sync_engine])
+        app.add_middleware(metrics.MetricsMiddleware)
 
     @app.on_event("startup")
-    def _startup() -> None:
-        init_db()
+    async def _startup() -> None:
+        version = await check_schema()
+        if version != SCHEMA_VERSION:
+            if not settings.auto_migrate:
+                raise RuntimeError(
+                    f"database schema is at version {version}, expected {SCHEMA_VERSION}; run `python -m app.migrate`"
+                )
+            from app.migrate import migrate
+
+            await run_in_threadpool(migrate)
+        app.state.prewarm = asyncio.create_task(prewarm(settings.db_pool_prewarm))
+        audit.writer.start()
+        audit.writer.replay()
+        events.broadcaster.start()
+        tokens.token_filter.start()
+        app.state.heartbeat_stop = asyncio.Event()
+        app.state.heartbeat_flusher = asyncio.create_task(
+            heartbeats.run_flusher(app.state.heartbeat_stop)
+        )
+
+    @app.on_event("shutdown")
+    async def _shutdown() -> None:
+        app.state.prewarm.cancel()
+        app.state.heartbeat_stop.set()
+        await app.state.heartbeat_flusher
+        audit.writer.close()
+        await events.broadcaster.stop()
 
     @app.get("/healthz")
     def health() -> dict[str, str]:
         return {"status": "ok"}
 
+    @app.get("/metrics", include_in_schema=False)
+    def metrics_endpoint() -> Response:
+        body, content_type = metrics.render()
+        return Response(content=body, media_type=content_type)
+
     app.include_router(enrollment.router)
     app.include_router(devices.router)
     app.include_router(blueprints.router)
+    app.include_router(blobs.router)
+    app.include_router(groups.router)
     app.include_router(workflows.router)
+    app.include_router(audit_router.router)
+    app.include_router(summary.router)
     return app
 
 
@@ -0,0 +1,273 @@
+import contextvars
+import datetime as dt
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type, Union
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from app.config import get_settings
+from app.models import OutboxMessage
+
+REQUESTS = Counter(
+    "ztp_http_requests_total", "HTTP requests", ["method", "route", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "ztp_http_request_duration_seconds", "HTTP request latency", ["method", "route"]
+)
+DB_QUERIES = Histogram(
+    "ztp_db_queries_per_request",
+    "SQL statements executed per request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+DB_TIME = Histogram(
+    "ztp_db_time_per_request_seconds",
+    "Time spent in SQL statements per request",
+    ["route"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+PLAN_CACHE = Counter(
+    "ztp_plan_cache_lookups_total", "Compiled plan cache lookups", ["result"]
+)
+BLUEPRINT_CACHE = Counter(
+    "ztp_blueprint_cache_lookups_total", "Blueprint cache lookups", ["result"]
+)
+TOKEN_FILTER_REJECTS = Counter(
+    "ztp_token_filter_rejects_total", "Registrations rejected by the enrollment token filter without a database lookup"
+)
+OUTBOX_RELAYED = Counter(
+    "ztp_outbox_messages_total", "Workflow dispatches relayed from the outbox", ["result"]
+)
+RATE_LIMITED = Counter(
+    "ztp_rate_limited_total", "Requests rejected by rate limits or admission control", ["scope", "reason"]
+)
+RETENTION_ROWS = Counter(
+    "ztp_retention_rows_total", "Rows archived or purged by the retention job", ["policy"]
+)
+RETENTION_DURATION = Histogram(
+    "ztp_retention_policy_duration_seconds", "Time spent applying a retention policy", ["policy"]
+)
+ROLLUP_FOLDED = Counter(
+    "ztp_rollup_deltas_folded_total", "Status rollup deltas folded into the summary counters"
+)
+ROLLUP_DRIFT = Counter(
+    "ztp_rollup_drift_total", "Counter drift corrected by status rollup reconciliation", ["kind"]
+)
+
+_db_stats: contextvars.ContextVar[Optional[List[float]]] = contextvars.ContextVar(
+    "ztp_db_stats", default=None
+)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("ztp_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["ztp_query_start"].pop()
+    stats = _db_stats.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+
+
+def _handle_error(context):
+    starts = context.connection.info.get("ztp_query_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine: Union[Engine, Type[Engine]]) -> None:
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self._children = {}
+
+    def _observers(self, method: str, path: str, code: int):
+        key = (method, path, code)
+        observers = self._children.get(key)
+        if observers is None:
+            observers = (
+                REQUESTS.labels(method, path, str(code)),
+                REQUEST_LATENCY.labels(method, path),
+                DB_QUERIES.labels(path),
+                DB_TIME.labels(path),
+            )
+            self._children[key] = observers
+        return observers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        stats = [0, 0.0]
+        token = _db_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _db_stats.reset(token)
+            path = getattr(scope.get("route"), "path", "unmatched")
+            requests, latency, queries, db_time = self._observers(
+                scope["method"], path, status["code"]
+            )
+            requests.inc()
+            latency.observe(elapsed)
+            queries.observe(stats[0])
+            db_time.observe(stats[1])
+
+
+class AppCollector:
+    def __init__(self, engines: Callable[[], List[Engine]], queues: Iterable[str] = ("celery",)):
+        self.engines = engines
+        self.queues = list(queues)
+        self._redis = None
+        self._db_values: Optional[Tuple[float, Dict[str, Any]]] = None
+
+    def describe(self):
+        return []
+
+    def _broker(self):
+        settings = get_settings()
+        if self._redis is None and settings.broker_url.startswith("redis"):
+            import redis
+
+            self._redis = redis.Redis.from_url(
+                settings.broker_url, socket_timeout=0.5, socket_connect_timeout=0.5
+            )
+        return self._redis
+
+    def _read_db(self, engine: Engine) -> Dict[str, Any]:
+        from app import rollups
+
+        values: Dict[str, Any] = {}
+        try:
+            with Session(engine) as session:
+                totals, pending = rollups.current(session, rollups.window_start())
+            by_status: Dict[str, int] = {}
+            for (kind, _, _, run_status), count in totals.items():
+                if kind == rollups.WORKFLOW:
+                    by_status[run_status] = by_status.get(run_status, 0) + count
+            values["workflows"] = (sorted(by_status.items()), pending)
+        except Exception:
+            pass
+        try:
+            with Session(engine) as session:
+                values["outbox"] = session.exec(select(func.count(), func.min(OutboxMessage.created_at))).one()
+        except Exception:
+            pass
+        return values
+
+    def _db(self, engine: Engine) -> Dict[str, Any]:
+        now = time.monotonic()
+        if self._db_values is None or now - self._db_values[0] >= get_settings().metrics_db_cache:
+            self._db_values = (now, self._read_db(engine))
+        return self._db_values[1]
+
+    def collect(self):
+        checked_out = GaugeMetricFamily(
+            "ztp_db_pool_checked_out", "Connections checked out of the pool", labels=["engine"]
+        )
+        overflow = GaugeMetricFamily(
+            "ztp_db_pool_overflow", "Connections open beyond pool_size", labels=["engine"]
+        )
+        engines = self.engines()
+        for engine in engines:
+            pool = engine.pool
+            name = engine.dialect.driver
+            if hasattr(pool, "checkedout"):
+                checked_out.add_metric([name], pool.checkedout())
+            if hasattr(pool, "overflow"):
+                overflow.add_metric([name], max(pool.overflow(), 0))
+        yield checked_out
+        yield overflow
+
+        depth = GaugeMetricFamily(
+            "ztp_celery_queue_depth", "Messages waiting in the broker", labels=["queue"]
+        )
+        broker = self._broker()
+        if broker is not None:
+            try:
+                for queue in self.queues:
+                    depth.add_metric([queue], broker.llen(queue))
+            except Exception:
+                pass
+        yield depth
+
+        db = self._db(engines[0])
+        outcomes = GaugeMetricFamily(
+            "ztp_workflows", "Workflow runs by status over the rollup window", labels=["status"]
+        )
+        unfolded = GaugeMetricFamily("ztp_rollup_pending_deltas", "Status rollup deltas not yet folded into the counters")
+        if "workflows" in db:
+            by_status, pending = db["workflows"]
+            for run_status, count in by_status:
+                outcomes.add_metric([run_status], count)
+            unfolded.add_metric([], pending)
+        yield outcomes
+        yield unfolded
+
+        backlog = GaugeMetricFamily("ztp_outbox_pending", "Workflow dispatches waiting in the outbox")
+        oldest = GaugeMetricFamily("ztp_outbox_oldest_seconds", "Age of the oldest undelivered outbox message")
+        if "outbox" in db:
+            pending, created = db["outbox"]
+            backlog.add_metric([], pending)
+            oldest.add_metric([], (dt.datetime.utcnow() - created).total_seconds() if created else 0)
+        yield backlog
+        yield oldest
+
+        from app.blueprint_cache import cache
+        from app.tokens import token_filter
+
+        yield GaugeMetricFamily(
+            "ztp_blueprint_cache_hit_ratio", "Share of blueprint lookups served from memory without a database query", value=cache.hit_ratio()
+        )
+        yield GaugeMetricFamily(
+            "ztp_blueprint_cache_verified_ratio",
+            "Share of blueprint lookups served from memory after a version check query",
+            value=cache.verified_ratio(),
+        )
+        token_stats = token_filter.stats()
+        yield GaugeMetricFamily("ztp_token_filter_entries", "Enrollment tokens in the filter", value=token_stats["entries"])
+        yield GaugeMetricFamily("ztp_token_filter_bytes", "Memory used by the enrollment token filter", value=token_stats["bytes"])
+        yield GaugeMetricFamily(
+            "ztp_token_filter_false_positive_rate",
+            "Estimated false-positive rate of the enrollment token filter",
+            value=token_stats["false_positive_rate"],
+        )
+
+
+_collector: Optional[AppCollector] = None
+
+
+def install(engines: Callable[[], List[Engine]]) -> None:
+    global _collector
+    instrument_engine(Engine)
+    if _collector is None:
+        from app.queues import ALL_QUEUES
+
+        _collector = AppCollector(engines, ALL_QUEUES)
+        REGISTRY.register(_collector)
+
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
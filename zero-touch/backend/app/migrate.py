@@ -0,0 +1,91 @@
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import inspect, literal, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import Connection, Engine
+from sqlmodel import Session, SQLModel, select
+
+from app.blobs import externalize_blueprints
+from app.db import SCHEMA_VERSION, get_engine, read_schema_version
+from app.facts import ensure_fact_indexes
+from app.integrations import content_hash
+from app.models import Blueprint, SchemaVersion
+from app.rollups import fold, reconcile
+from app.tokens import hash_plaintext_tokens
+
+logger = logging.getLogger(__name__)
+
+BASELINE_VERSION = 1
+V2_COLUMNS = {
+    "blueprint": {"content_hash": "", "version": 1},
+    "device": {"hardware_id": None},
+    "workflowrun": {"rollout_id": None, "dry_run": False},
+}
+
+
+def _add_column(conn: Connection, table: str, name: str, default) -> None:
+    column = SQLModel.metadata.tables[table].c[name]
+    ddl = f"ALTER TABLE {table} ADD COLUMN {name} {column.type.compile(dialect=conn.dialect)}"
+    if default is not None:
+        value = literal(default).compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+        ddl += f" NOT NULL DEFAULT {value}"
+    for foreign_key in column.foreign_keys:
+        ddl += f" REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})"
+    conn.execute(text(ddl))
+
+
+def upgrade_v2(conn: Connection) -> None:
+    inspector = inspect(conn)
+    for table, columns in V2_COLUMNS.items():
+        existing = {column["name"] for column in inspector.get_columns(table)}
+        for name, default in columns.items():
+            if name not in existing:
+                _add_column(conn, table, name, default)
+    if conn.dialect.name == "postgresql":
+        facts = next(column for column in inspector.get_columns("device") if column["name"] == "facts")
+        if not isinstance(facts["type"], JSONB):
+            conn.execute(text("ALTER TABLE device ALTER COLUMN facts TYPE jsonb USING facts::jsonb"))
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+UPGRADES: Dict[int, Callable[[Connection], None]] = {2: upgrade_v2}
+
+
+def backfill_content_hashes(session: Session) -> int:
+    blueprints = session.exec(select(Blueprint).where(Blueprint.content_hash == "")).all()
+    for blueprint in blueprints:
+        blueprint.content_hash = content_hash(blueprint.dict())
+    session.commit()
+    return len(blueprints)
+
+
+def migrate(engine: Optional[Engine] = None) -> int:
+    engine = engine or get_engine()
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        version = read_schema_version(conn) or BASELINE_VERSION
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for target in range(version + 1, SCHEMA_VERSION + 1):
+            logger.info("upgrading schema to version %s", target)
+            UPGRADES[target](conn)
+        ensure_fact_indexes(conn)
+    with Session(engine) as session:
+        externalize_blueprints(session)
+        backfill_content_hashes(session)
+        hash_plaintext_tokens(session)
+        reconcile(session)
+        fold(session)
+        session.merge(SchemaVersion(id=1, version=SCHEMA_VERSION))
+        session.commit()
+    logger.info("schema at version %s (%.0f ms)", SCHEMA_VERSION, (time.perf_counter() - started) * 1000)
+    return SCHEMA_VERSION
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    migrate()
@@ -1,14 +1,29 @@
 import datetime as dt
+import secrets
+import time
 import uuid
 from typing import Any, Dict, List, Optional
 
-from sqlalchemy import JSON, Column
+from sqlalchemy import JSON, Column, Index, LargeBinary, String
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import Field, Relationship, SQLModel
 
 
+def time_ordered_uuid() -> uuid.UUID:
+    millis = time.time_ns() // 1_000_000
+    value = (
+        (millis << 80)
+        | (0x7 << 76)
+        | (secrets.randbits(12) << 64)
+        | (0b10 << 62)
+        | secrets.randbits(62)
+    )
+    return uuid.UUID(int=value)
+
+
 class EnrollmentToken(SQLModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
-    token: str = Field(index=True, unique=True)
+    token_hash: str = Field(sa_column=Column("token", String, index=True, unique=True, nullable=False))
     expires_at: dt.datetime
     uses_remaining: int = Field(default=1)
     created_by: str = Field(default="system")
@@ -25,22 +40,32 @@ class Blueprint(SQLModel, table=True):
     files: Dict[str, Any] = Field(sa_column=Column(JSON), default_factory=dict)
     users: Dict[str, Any] = Field(sa_column=Column(JSON), default_factory=dict)
     security: Dict[str, Any] = Field(sa_column=Column(JSON), default_factory=dict)
+    content_hash: str = Field(default="")
+    version: int = Field(default=1)
     devices: List["Device"] = Relationship(back_populates="blueprint")
     workflows: List["WorkflowRun"] = Relationship(back_populates="blueprint")
+    rollouts: List["Rollout"] = Relationship(back_populates="blueprint")
 
 
 class Device(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_device_facts_gin", "facts", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     hostname: str
     os_type: str
     arch: str
+    hardware_id: Optional[str] = Field(default=None, index=True, unique=True)
     status: str = Field(default="pending")
     last_seen: Optional[dt.datetime] = None
     blueprint_id: Optional[uuid.UUID] = Field(default=None, foreign_key="blueprint.id")
     enrollment_token_id: Optional[uuid.UUID] = Field(
-        default=None, foreign_key="enrollmenttoken.id"
+        default=None, foreign_key="enrollmenttoken.id", index=True
+    )
+    facts: Dict[str, Any] = Field(
+        sa_column=Column(JSON().with_variant(JSONB(), "postgresql")), default_factory=dict
     )
-    facts: Dict[str, Any] = Field(sa_column=Column(JSON), default_factory=dict)
 
     blueprint: Optional[Blueprint] = Relationship(back_populates="devices")
     enrollment_token: Optional[EnrollmentToken] = Relationship(
@@ -49,11 +74,52 @@ class Device(SQLModel, table=True):
     workflows: List["WorkflowRun"] = Relationship(back_populates="device")
 
 
+class Rollout(SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    blueprint_id: uuid.UUID = Field(foreign_key="blueprint.id")
+    selector: Dict[str, Any] = Field(sa_column=Column(JSON), default_factory=dict)
+    group_id: Optional[uuid.UUID] = None
+    dry_run: bool = Field(default=False)
+    total: int = Field(default=0)
+    created_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
+
+    blueprint: Blueprint = Relationship(back_populates="rollouts")
+    workflows: List["WorkflowRun"] = Relationship(back_populates="rollout")
+
+
+class DeviceGroup(SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    name: str = Field(index=True, unique=True)
+    description: str = Field(default="")
+    query: str
+    created_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
+    updated_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
+
+
+class GroupMembership(SQLModel, table=True):
+    __table_args__ = (Index("ix_groupmembership_device", "device_id"),)
+
+    group_id: uuid.UUID = Field(foreign_key="devicegroup.id", primary_key=True)
+    device_id: uuid.UUID = Field(foreign_key="device.id", primary_key=True)
+    added_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
+
+
+class IdempotencyRecord(SQLModel, table=True):
+    key: str = Field(primary_key=True)
+    request_hash: str
+    response: Dict[str, Any] = Field(sa_column=Column(JSON), default_factory=dict)
+    created_at: dt.datetime = Field(default_factory=dt.datetime.utcnow, index=True)
+
+
 class WorkflowRun(SQLModel, table=True):
+    __table_args__ = (Index("ix_workflowrun_rollout_status", "rollout_id", "status"),)
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     device_id: uuid.UUID = Field(foreign_key="device.id")
     blueprint_id: uuid.UUID = Field(foreign_key="blueprint.id")
+    rollout_id: Optional[uuid.UUID] = Field(default=None, foreign_key="rollout.id")
     status: str = Field(default="queued")
+    dry_run: bool = Field(default=False)
     steps: List[Dict[str, Any]] = Field(sa_column=Column(JSON), default_factory=list)
     started_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
     updated_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
@@ -61,13 +127,66 @@ class WorkflowRun(SQLModel, table=True):
 
     device: Device = Relationship(back_populates="workflows")
     blueprint: Blueprint = Relationship(back_populates="workflows")
+    rollout: Optional[Rollout] = Relationship(back_populates="workflows")
+
+
+class WorkflowArchive(SQLModel, table=True):
+    id: uuid.UUID = Field(primary_key=True)
+    device_id: uuid.UUID = Field(index=True)
+    blueprint_id: uuid.UUID
+    rollout_id: Optional[uuid.UUID] = Field(default=None, index=True)
+    status: str
+    started_at: dt.datetime
+    updated_at: dt.datetime
+    archived_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
+    payload: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
 
 
 class AuditLog(SQLModel, table=True):
-    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    __table_args__ = (
+        Index("ix_auditlog_target", "target_type", "target_id", "created_at"),
+        Index("ix_auditlog_created", "created_at", "id"),
+    )
+
+    id: uuid.UUID = Field(default_factory=time_ordered_uuid, primary_key=True)
     actor: str
     action: str
     target_type: str
     target_id: Optional[str] = None
     message: str = Field(default="")
     created_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
+
+
+class OutboxMessage(SQLModel, table=True):
+    __table_args__ = (Index("ix_outboxmessage_available", "available_at", "id"),)
+
+    id: uuid.UUID = Field(default_factory=time_ordered_uuid, primary_key=True)
+    workflow_id: uuid.UUID = Field(index=True)
+    queue: str
+    attempts: int = Field(default=0)
+    last_error: Optional[str] = None
+    created_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
+    available_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
+
+
+class RollupCounter(SQLModel, table=True):
+    kind: str = Field(primary_key=True)
+    bucket: dt.datetime = Field(primary_key=True)
+    dimension: str = Field(primary_key=True)
+    status: str = Field(primary_key=True)
+    count: int = Field(default=0)
+
+
+class RollupDelta(SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=time_ordered_uuid, primary_key=True)
+    kind: str
+    bucket: dt.datetime
+    dimension: str
+    status: str
+    delta: int
+
+
+class SchemaVersion(SQLModel, table=True):
+    id: int = Field(default=1, primary_key=True)
+    version: int
+    applied_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
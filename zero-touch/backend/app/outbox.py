@@ -0,0 +1,110 @@
+import datetime as dt
+import logging
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, insert, update
+from sqlmodel import Session, select
+
+from app import queues
+from app.config import get_settings
+from app.db import get_engine
+from app.metrics import OUTBOX_RELAYED
+from app.models import OutboxMessage, time_ordered_uuid
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+def stage(session: Session, runs: Sequence[Tuple[uuid.UUID, str]], priority: str = "high", dry_run: bool = False) -> None:
+    if not runs:
+        return
+    now = dt.datetime.utcnow()
+    session.execute(
+        insert(OutboxMessage),
+        [
+            {
+                "id": time_ordered_uuid(),
+                "workflow_id": workflow_id,
+                "queue": queues.queue_for(os_type, priority, dry_run),
+                "attempts": 0,
+                "created_at": now,
+                "available_at": now,
+            }
+            for workflow_id, os_type in runs
+        ],
+    )
+
+
+def backoff(attempts: int) -> float:
+    return min(settings.outbox_retry_base * 2 ** attempts, settings.outbox_retry_max)
+
+
+class Relay:
+    def __init__(self, app, batch_size: Optional[int] = None, rate: Optional[float] = None):
+        self.app = app
+        self.batch_size = max(batch_size or settings.enqueue_batch_size, 1)
+        self.rate = settings.enqueue_rate_per_second if rate is None else rate
+
+    def send(self, queue: str, workflow_ids: List[str]) -> None:
+        self.app.send_task("app.worker.run_workflow_batch", args=[workflow_ids], queue=queue)
+
+    def relay_once(self, session: Session) -> int:
+        now = dt.datetime.utcnow()
+        rows = session.exec(
+            select(OutboxMessage.id, OutboxMessage.workflow_id, OutboxMessage.queue, OutboxMessage.attempts)
+            .where(OutboxMessage.available_at <= now)
+            .order_by(OutboxMessage.available_at, OutboxMessage.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        by_queue: Dict[str, List[Any]] = {}
+        for row in rows:
+            by_queue.setdefault(row.queue, []).append(row)
+        sent: List[uuid.UUID] = []
+        for queue, group in by_queue.items():
+            try:
+                self.send(queue, [str(row.workflow_id) for row in group])
+            except Exception as exc:
+                attempts = max(row.attempts for row in group) + 1
+                logger.warning("outbox send to %s failed (attempt %s): %s", queue, attempts, exc)
+                session.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_([row.id for row in group]))
+                    .values(
+                        attempts=OutboxMessage.attempts + 1,
+                        last_error=str(exc)[:500],
+                        available_at=now + dt.timedelta(seconds=backoff(attempts)),
+                    )
+                )
+                OUTBOX_RELAYED.labels("failed").inc(len(group))
+                continue
+            sent += [row.id for row in group]
+            OUTBOX_RELAYED.labels("sent").inc(len(group))
+        if sent:
+            session.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(sent)))
+        session.commit()
+        return len(rows)
+
+    def run(self, poll_interval: Optional[float] = None) -> None:
+        poll_interval = settings.outbox_poll_interval if poll_interval is None else poll_interval
+        while True:
+            started = time.monotonic()
+            try:
+                with Session(get_engine()) as session:
+                    relayed = self.relay_once(session)
+            except Exception:
+                logger.exception("outbox relay pass failed")
+                relayed = 0
+            if relayed < self.batch_size:
+                time.sleep(poll_interval)
+            elif self.rate > 0:
+                time.sleep(max(relayed / self.rate - (time.monotonic() - started), 0))
+
+
+if __name__ == "__main__":
+    from app.worker import celery_app
+
+    logging.basicConfig(level=logging.INFO)
+    Relay(celery_app).run()
@@ -0,0 +1,85 @@
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from app.config import get_settings
+from app.integrations.providers import PROVIDERS, provider_for
+
+settings = get_settings()
+
+PRIORITIES = ("high", "normal")
+FAMILIES = tuple(PROVIDERS)
+DEFAULT_QUEUE = "ztp.default"
+DRY_RUN_QUEUE = "ztp.dryrun"
+
+
+def workflow_queue(priority: str, family: str) -> str:
+    return f"ztp.{priority}.{family}"
+
+
+ALL_QUEUES = [
+    DEFAULT_QUEUE,
+    DRY_RUN_QUEUE,
+    *(workflow_queue(priority, family) for priority in PRIORITIES for family in FAMILIES),
+]
+
+
+def queue_for(os_type: str, priority: str = "normal", dry_run: bool = False) -> str:
+    if dry_run:
+        return DRY_RUN_QUEUE
+    return workflow_queue(priority if priority in PRIORITIES else "normal", provider_for(os_type))
+
+
+@dataclass(frozen=True)
+class Pool:
+    name: str
+    queues: Tuple[str, ...]
+    prefetch: int
+    min_concurrency: int
+    max_concurrency: int
+
+
+def _pool_queues(name: str) -> Tuple[str, ...]:
+    if name == "urgent":
+        return (DEFAULT_QUEUE, *(workflow_queue("high", family) for family in FAMILIES))
+    if name == "dryrun":
+        return (DRY_RUN_QUEUE,)
+    if name in FAMILIES:
+        return (workflow_queue("normal", name),)
+    raise ValueError(f"unknown worker pool {name!r}")
+
+
+def parse_pools(spec: str) -> Dict[str, Pool]:
+    pools: Dict[str, Pool] = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, prefetch, concurrency = item.split(":")
+        low, _, high = concurrency.partition("-")
+        low_value = int(low)
+        high_value = max(int(high or low), low_value)
+        pools[name] = Pool(name, _pool_queues(name), max(int(prefetch), 1), max(low_value, 1), high_value)
+    missing = set(ALL_QUEUES) - {queue for pool in pools.values() for queue in pool.queues}
+    if missing:
+        raise ValueError(f"queues without a worker pool: {', '.join(sorted(missing))}")
+    return pools
+
+
+POOLS = parse_pools(settings.worker_pools)
+
+
+def worker_argv(pool: Pool) -> List[str]:
+    return [
+        "worker",
+        f"--hostname={pool.name}@%h",
+        f"--queues={','.join(pool.queues)}",
+        f"--prefetch-multiplier={pool.prefetch}",
+        f"--concurrency={pool.min_concurrency}",
+        "--loglevel=info",
+    ]
+
+
+if __name__ == "__main__":
+    from app.worker import celery_app
+
+    if len(sys.argv) != 2 or sys.argv[1] not in POOLS:
+        raise SystemExit(f"usage: python -m app.queues <{'|'.join(POOLS)}>")
+    celery_app.worker_main(worker_argv(POOLS[sys.argv[1]]))
@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import redis
+from fastapi import HTTPException, Request, status
+
+from app.cache import get_async_redis
+from app.config import get_settings
+from app.metrics import RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+Rate = Tuple[float, float]
+
+TOKEN_BUCKET_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local levels = {}
+local limited = 0
+local wait = 0
+for i, key in ipairs(KEYS) do
+  local rate = tonumber(ARGV[2 * i - 1])
+  local burst = tonumber(ARGV[2 * i])
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(state[1]) or burst
+  local ts = tonumber(state[2]) or now
+  tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+  levels[i] = tokens
+  if tokens < 1 and (1 - tokens) / rate > wait then
+    limited = i
+    wait = (1 - tokens) / rate
+  end
+end
+for i, key in ipairs(KEYS) do
+  local rate = tonumber(ARGV[2 * i - 1])
+  local burst = tonumber(ARGV[2 * i])
+  local tokens = levels[i]
+  if limited == 0 then
+    tokens = tokens - 1
+  end
+  redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+  redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+end
+return {limited, tostring(wait)}
+"""
+
+Limit = Tuple[str, float, float]
+
+
+class MemoryBuckets:
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, limits: List[Limit]) -> Tuple[Optional[int], float]:
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            limited, wait = None, 0.0
+            for index, (key, rate, burst) in enumerate(limits):
+                tokens, last = self._buckets.pop(key, (burst, now))
+                tokens = min(burst, tokens + (now - last) * rate)
+                levels.append(tokens)
+                if tokens < 1 and (1 - tokens) / rate > wait:
+                    limited, wait = index, (1 - tokens) / rate
+            for (key, _, _), tokens in zip(limits, levels):
+                self._buckets[key] = (tokens - 1 if limited is None else tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return limited, wait
+
+
+class RedisBuckets:
+    def __init__(self, client, fallback: MemoryBuckets):
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.fallback = fallback
+
+    async def take(self, limits: List[Limit]) -> Tuple[Optional[int], float]:
+        args: List[float] = []
+        for _, rate, burst in limits:
+            args += [rate, burst]
+        try:
+            limited, wait = await self.script(keys=[f"ztp:rl:{key}" for key, _, _ in limits], args=args)
+        except redis.RedisError:
+            logger.warning("rate limit store unavailable; using local buckets")
+            return await self.fallback.take(limits)
+        return (int(limited) - 1 if int(limited) else None), float(wait)
+
+
+def _make_buckets():
+    memory = MemoryBuckets()
+    client = get_async_redis()
+    return RedisBuckets(client, memory) if client is not None else memory
+
+
+buckets = _make_buckets()
+
+
+def too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many requests",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def client_ip(request: Request) -> str:
+    if settings.rate_limit_trust_forwarded:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+
+async def enforce(scope: str, limits: List[Tuple[str, Rate]]) -> None:
+    if not settings.rate_limit_enabled:
+        return
+    active = [(name, rate, burst) for name, (rate, burst) in limits if rate > 0]
+    if not active:
+        return
+    limited, wait = await buckets.take([(f"{scope}:{name}", rate, burst) for name, rate, burst in active])
+    if limited is not None:
+        RATE_LIMITED.labels(scope, active[limited][0].split(":", 1)[0]).inc()
+        raise too_many_requests(wait)
+
+
+def throttle(scope: str, per_ip: Rate, global_limit: Optional[Rate] = None) -> Callable:
+    async def dependency(request: Request) -> None:
+        limits = [(f"ip:{client_ip(request)}", per_ip)]
+        if global_limit:
+            limits.append(("global", global_limit))
+        await enforce(scope, limits)
+
+    return dependency
+
+
+class AdmissionGate:
+    def __init__(self, scope: str, limit: int):
+        self.scope = scope
+        self.limit = limit
+        self._semaphores: Dict[int, asyncio.Semaphore] = {}
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop_id = id(asyncio.get_running_loop())
+        if loop_id not in self._semaphores:
+            self._semaphores = {loop_id: asyncio.Semaphore(self.limit)}
+        return self._semaphores[loop_id]
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self.limit <= 0 or not settings.rate_limit_enabled:
+            yield
+            return
+        semaphore = self._semaphore()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=settings.admission_max_wait)
+        except asyncio.TimeoutError:
+            RATE_LIMITED.labels(self.scope, "concurrency").inc()
+            raise too_many_requests(settings.admission_retry_after)
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    async def __call__(self) -> AsyncIterator[None]:
+        async with self.slot():
+            yield
+
+
+register_gate = AdmissionGate("register", settings.register_max_concurrency)
+plan_gate = AdmissionGate("plan", settings.plan_max_concurrency)
+register_throttle = throttle("register", settings.register_limit_per_ip, settings.register_limit_global)
+agent_throttle = throttle("agent", settings.agent_limit_per_ip)
@@ -0,0 +1,177 @@
+import datetime as dt
+import gzip
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, delete, insert, or_, update
+from sqlalchemy.sql import Select
+from sqlmodel import Session, select
+
+from app import audit, blobs
+from app.config import get_settings
+from app.db import get_session
+from app.metrics import RETENTION_DURATION, RETENTION_ROWS
+from app.models import AuditLog, Blueprint, Device, EnrollmentToken, IdempotencyRecord, WorkflowArchive, WorkflowRun
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+Policy = Tuple[str, Select, Callable[[Session, Sequence[Any]], None]]
+
+
+def pack(run: WorkflowRun) -> bytes:
+    body = {"dry_run": run.dry_run, "steps": run.steps or [], "last_error": run.last_error}
+    return gzip.compress(json.dumps(body, default=str, separators=(",", ":")).encode())
+
+
+def unpack(payload: bytes) -> Dict[str, Any]:
+    return json.loads(gzip.decompress(payload))
+
+
+def _archive_workflows(session: Session, ids: Sequence[Any]) -> None:
+    runs = session.exec(select(WorkflowRun).where(WorkflowRun.id.in_(ids))).all()
+    now = dt.datetime.utcnow()
+    session.execute(
+        insert(WorkflowArchive),
+        [
+            {
+                "id": run.id,
+                "device_id": run.device_id,
+                "blueprint_id": run.blueprint_id,
+                "rollout_id": run.rollout_id,
+                "status": run.status,
+                "started_at": run.started_at,
+                "updated_at": run.updated_at,
+                "archived_at": now,
+                "payload": pack(run),
+            }
+            for run in runs
+        ],
+    )
+    session.execute(delete(WorkflowRun).where(WorkflowRun.id.in_(ids)))
+
+
+def _purge_tokens(session: Session, ids: Sequence[Any]) -> None:
+    session.execute(
+        update(Device).where(Device.enrollment_token_id.in_(ids)).values(enrollment_token_id=None)
+    )
+    session.execute(delete(EnrollmentToken).where(EnrollmentToken.id.in_(ids)))
+
+
+def _purge(model) -> Callable[[Session, Sequence[Any]], None]:
+    key = next(iter(model.__table__.primary_key.columns))
+
+    def apply(session: Session, ids: Sequence[Any]) -> None:
+        session.execute(delete(model).where(key.in_(ids)))
+
+    return apply
+
+
+def policies(now: dt.datetime) -> List[Policy]:
+    found: List[Policy] = []
+    if settings.retention_workflow_days > 0:
+        cutoff = now - dt.timedelta(days=settings.retention_workflow_days)
+        found.append((
+            "workflows_archived",
+            select(WorkflowRun.id)
+            .where(WorkflowRun.status.in_(TERMINAL_STATUSES), WorkflowRun.updated_at < cutoff)
+            .order_by(WorkflowRun.updated_at)
+            .with_for_update(skip_locked=True),
+            _archive_workflows,
+        ))
+    if settings.retention_audit_days > 0:
+        cutoff = now - dt.timedelta(days=settings.retention_audit_days)
+        found.append((
+            "audit_purged",
+            select(AuditLog.id).where(AuditLog.created_at < cutoff).order_by(AuditLog.created_at, AuditLog.id),
+            _purge(AuditLog),
+        ))
+    if settings.retention_token_days > 0:
+        cutoff = now - dt.timedelta(days=settings.retention_token_days)
+        found.append((
+            "tokens_purged",
+            select(EnrollmentToken.id)
+            .where(
+                or_(
+                    EnrollmentToken.expires_at < cutoff,
+                    and_(EnrollmentToken.uses_remaining <= 0, EnrollmentToken.expires_at < now),
+                )
+            )
+            .order_by(EnrollmentToken.expires_at),
+            _purge_tokens,
+        ))
+    found.append((
+        "idempotency_purged",
+        select(IdempotencyRecord.key)
+        .where(IdempotencyRecord.created_at < now - dt.timedelta(seconds=settings.idempotency_ttl))
+        .order_by(IdempotencyRecord.created_at),
+        _purge(IdempotencyRecord),
+    ))
+    return found
+
+
+def drain(session: Session, query: Select, apply: Callable[[Session, Sequence[Any]], None], batch_size: Optional[int] = None) -> int:
+    batch_size = max(batch_size or settings.retention_batch_size, 1)
+    total = 0
+    for batch in range(settings.retention_max_batches):
+        if batch:
+            time.sleep(settings.retention_batch_pause)
+        ids = session.exec(query.limit(batch_size)).all()
+        if not ids:
+            break
+        apply(session, ids)
+        session.commit()
+        session.expunge_all()
+        total += len(ids)
+        if len(ids) < batch_size:
+            break
+    return total
+
+
+def _measure(session: Session, name: str, apply: Callable[[], int]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        rows = apply()
+    except Exception:
+        session.rollback()
+        logger.exception("retention policy %s failed", name)
+        rows = None
+    elapsed = time.perf_counter() - started
+    RETENTION_DURATION.labels(name).observe(elapsed)
+    if rows:
+        RETENTION_ROWS.labels(name).inc(rows)
+    return {"rows": rows, "duration_ms": round(elapsed * 1000, 1)}
+
+
+def run(now: Optional[dt.datetime] = None) -> Dict[str, Any]:
+    now = now or dt.datetime.utcnow()
+    started = time.perf_counter()
+    report: Dict[str, Any] = {}
+    with get_session() as session:
+        for name, query, apply in policies(now):
+            report[name] = _measure(session, name, lambda: drain(session, query, apply))
+        report["blobs_purged"] = _measure(
+            session,
+            "blobs_purged",
+            lambda: blobs.collect(blobs.referenced(session.exec(select(Blueprint.files)).all())),
+        )
+    report["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    summary = " ".join(f"{name}={value['rows']}" for name, value in report.items() if isinstance(value, dict))
+    logger.info("retention finished in %sms: %s", report["duration_ms"], summary)
+    audit.record(
+        actor="retention",
+        action="retention",
+        target_type="system",
+        message=f"{summary} duration_ms={report['duration_ms']}",
+    )
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(run(), indent=2))
+    audit.writer.close()
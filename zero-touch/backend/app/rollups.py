@@ -0,0 +1,209 @@
+import datetime as dt
+import json
+import logging
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, insert, or_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select
+
+from app.config import get_settings
+from app.db import get_session
+from app.metrics import ROLLUP_DRIFT, ROLLUP_FOLDED
+from app.models import Device, RollupCounter, RollupDelta, WorkflowArchive, WorkflowRun, time_ordered_uuid
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+DEVICE = "device"
+WORKFLOW = "workflow"
+EPOCH = dt.datetime(1970, 1, 1)
+UPSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+Key = Tuple[str, dt.datetime, str, str]
+
+
+def hour(value: dt.datetime) -> dt.datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def window_start(now: Optional[dt.datetime] = None) -> dt.datetime:
+    return hour(now or dt.datetime.utcnow()) - dt.timedelta(hours=max(settings.rollup_window_hours, 1) - 1)
+
+
+def device_key(os_type: str, status: str) -> Key:
+    return (DEVICE, EPOCH, os_type, status)
+
+
+def workflow_key(blueprint_id: uuid.UUID, started_at: dt.datetime, status: str) -> Key:
+    return (WORKFLOW, hour(started_at), str(blueprint_id), status)
+
+
+def move(deltas: Counter, before: Optional[Key], after: Optional[Key]) -> None:
+    if before == after:
+        return
+    if before:
+        deltas[before] -= 1
+    if after:
+        deltas[after] += 1
+
+
+def stage(session: Session, deltas: Counter) -> None:
+    rows = [
+        {"id": time_ordered_uuid(), "kind": kind, "bucket": bucket, "dimension": dimension, "status": status, "delta": delta}
+        for (kind, bucket, dimension, status), delta in deltas.items()
+        if delta
+    ]
+    if rows:
+        session.execute(insert(RollupDelta), rows)
+
+
+def _increment(session: Session, totals: Counter) -> None:
+    rows = [
+        {"kind": kind, "bucket": bucket, "dimension": dimension, "status": status, "count": count}
+        for (kind, bucket, dimension, status), count in sorted(totals.items())
+        if count
+    ]
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect in UPSERTS:
+        stmt = UPSERTS[dialect](RollupCounter).values(rows)
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[RollupCounter.kind, RollupCounter.bucket, RollupCounter.dimension, RollupCounter.status],
+                set_={"count": RollupCounter.count + stmt.excluded["count"]},
+            )
+        )
+        return
+    for row in rows:
+        updated = session.execute(
+            update(RollupCounter)
+            .where(
+                RollupCounter.kind == row["kind"],
+                RollupCounter.bucket == row["bucket"],
+                RollupCounter.dimension == row["dimension"],
+                RollupCounter.status == row["status"],
+            )
+            .values(count=RollupCounter.count + row["count"])
+        )
+        if updated.rowcount == 0:
+            session.execute(insert(RollupCounter), [row])
+
+
+def fold(session: Session, batch_size: Optional[int] = None) -> int:
+    batch_size = max(batch_size or settings.rollup_fold_batch, 1)
+    total = 0
+    while True:
+        deltas = session.exec(
+            select(RollupDelta).order_by(RollupDelta.id).limit(batch_size).with_for_update(skip_locked=True)
+        ).all()
+        if not deltas:
+            break
+        totals: Counter = Counter()
+        for row in deltas:
+            totals[(row.kind, row.bucket, row.dimension, row.status)] += row.delta
+        _increment(session, totals)
+        session.execute(delete(RollupDelta).where(RollupDelta.id.in_([row.id for row in deltas])))
+        session.commit()
+        session.expunge_all()
+        ROLLUP_FOLDED.inc(len(deltas))
+        total += len(deltas)
+        if len(deltas) < batch_size:
+            break
+    return total
+
+
+def _in_window(model, since: dt.datetime):
+    return or_(model.kind == DEVICE, and_(model.kind == WORKFLOW, model.bucket >= since))
+
+
+def current(session: Session, since: dt.datetime) -> Tuple[Counter, int]:
+    totals: Counter = Counter()
+    for kind, bucket, dimension, status, count in session.exec(
+        select(RollupCounter.kind, RollupCounter.bucket, RollupCounter.dimension, RollupCounter.status, RollupCounter.count)
+        .where(_in_window(RollupCounter, since))
+    ):
+        totals[(kind, bucket, dimension, status)] += count
+    pending = 0
+    for kind, bucket, dimension, status, delta, rows in session.exec(
+        select(RollupDelta.kind, RollupDelta.bucket, RollupDelta.dimension, RollupDelta.status, func.sum(RollupDelta.delta), func.count())
+        .where(_in_window(RollupDelta, since))
+        .group_by(RollupDelta.kind, RollupDelta.bucket, RollupDelta.dimension, RollupDelta.status)
+    ):
+        totals[(kind, bucket, dimension, status)] += delta
+        pending += rows
+    return totals, pending
+
+
+def recount(session: Session, since: dt.datetime) -> Counter:
+    totals: Counter = Counter()
+    for os_type, status, count in session.exec(
+        select(Device.os_type, Device.status, func.count()).group_by(Device.os_type, Device.status)
+    ):
+        totals[device_key(os_type, status)] += count
+    for model in (WorkflowRun, WorkflowArchive):
+        rows = session.exec(
+            select(model.blueprint_id, model.started_at, model.status)
+            .where(model.started_at >= since)
+            .execution_options(yield_per=settings.rollup_fold_batch)
+        )
+        for blueprint_id, started_at, status in rows:
+            totals[workflow_key(blueprint_id, started_at, status)] += 1
+    return totals
+
+
+def summary(session: Session, now: Optional[dt.datetime] = None) -> Dict[str, Any]:
+    since = window_start(now)
+    totals, pending = current(session, since)
+    devices: Dict[str, Dict[str, int]] = {}
+    workflows: Dict[str, Dict[str, int]] = {}
+    for (kind, _, dimension, status), count in sorted(totals.items()):
+        if not count:
+            continue
+        if kind == DEVICE:
+            devices.setdefault(status, {})[dimension] = count
+        else:
+            by_status = workflows.setdefault(dimension, {})
+            by_status[status] = by_status.get(status, 0) + count
+    return {"devices": devices, "workflows": workflows, "since": since, "pending_deltas": pending}
+
+
+def reconcile(session: Session, now: Optional[dt.datetime] = None) -> Dict[str, int]:
+    since = window_start(now)
+    if session.get_bind().dialect.name == "postgresql":
+        session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    expected = recount(session, since)
+    totals, _ = current(session, since)
+    drift: Counter = Counter()
+    for key in expected.keys() | totals.keys():
+        drift[key] = expected[key] - totals[key]
+    stage(session, drift)
+    session.commit()
+    corrected = {DEVICE: 0, WORKFLOW: 0}
+    for (kind, *_), delta in drift.items():
+        corrected[kind] += abs(delta)
+    for kind, amount in corrected.items():
+        if amount:
+            ROLLUP_DRIFT.labels(kind).inc(amount)
+            logger.warning("status rollups drifted by %s %s transitions; corrections staged", amount, kind)
+    session.execute(delete(RollupCounter).where(RollupCounter.kind == WORKFLOW, RollupCounter.bucket < since))
+    session.execute(delete(RollupDelta).where(RollupDelta.kind == WORKFLOW, RollupDelta.bucket < since))
+    session.commit()
+    return corrected
+
+
+def run() -> Dict[str, Any]:
+    started = time.perf_counter()
+    with get_session() as session:
+        report: Dict[str, Any] = {"drift": reconcile(session), "folded": fold(session)}
+    report["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(run(), indent=2))
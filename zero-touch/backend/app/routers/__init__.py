@@ -1,3 +1,3 @@
-from app.routers import blueprints, devices, enrollment, workflows
+from app.routers import audit, blobs, blueprints, devices, enrollment, groups, summary, workflows
 
-__all__ = ["blueprints", "devices", "enrollment", "workflows"]
+__all__ = ["audit", "blobs", "blueprints", "devices", "enrollment", "groups", "summary", "workflows"]
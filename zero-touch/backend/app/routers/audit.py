@@ -0,0 +1,65 @@
+import base64
+import datetime as dt
+import uuid
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import and_, or_
+from sqlmodel import select
+
+from app import schemas
+from app.db import get_async_session
+from app.deps import require_api_key
+from app.models import AuditLog
+
+router = APIRouter(prefix="/audit", tags=["audit"])
+
+
+def _encode_cursor(entry: AuditLog) -> str:
+    raw = f"{entry.created_at.isoformat()}|{entry.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[dt.datetime, uuid.UUID]:
+    try:
+        created_at, entry_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return dt.datetime.fromisoformat(created_at), uuid.UUID(entry_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("", response_model=schemas.AuditPage)
+async def list_audit(
+    target_type: Optional[str] = None,
+    target_id: Optional[str] = None,
+    since: Optional[dt.datetime] = None,
+    until: Optional[dt.datetime] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    session=Depends(get_async_session),
+    _: None = Depends(require_api_key),
+):
+    query = select(AuditLog)
+    if target_type:
+        query = query.where(AuditLog.target_type == target_type)
+    if target_id:
+        query = query.where(AuditLog.target_id == target_id)
+    if since:
+        query = query.where(AuditLog.created_at >= since)
+    if until:
+        query = query.where(AuditLog.created_at < until)
+    if cursor:
+        created_at, entry_id = _decode_cursor(cursor)
+        query = query.where(
+            or_(
+                AuditLog.created_at < created_at,
+                and_(AuditLog.created_at == created_at, AuditLog.id < entry_id),
+            )
+        )
+    query = query.order_by(AuditLog.created_at.desc(), AuditLog.id.desc()).limit(limit + 1)
+    entries = (await session.exec(query)).all()
+    page = entries[:limit]
+    return schemas.AuditPage(
+        items=[schemas.AuditLogOut(**entry.dict()) for entry in page],
+        next_cursor=_encode_cursor(page[-1]) if len(entries) > limit else None,
+    )
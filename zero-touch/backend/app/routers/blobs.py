@@ -0,0 +1,80 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from app import audit, blobs, desired_state, ratelimit, schemas
+from app.deps import require_api_key, require_device_token
+
+router = APIRouter(prefix="/blobs", tags=["blobs"])
+
+
+@router.post("", response_model=schemas.BlobOut, status_code=201)
+async def upload_blob(request: Request, _: None = Depends(require_api_key)):
+    writer = await run_in_threadpool(blobs.get_store().writer)
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(writer.write, chunk)
+    except blobs.BlobTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    except BaseException:
+        await run_in_threadpool(writer.abort)
+        raise
+    digest, size = await run_in_threadpool(writer.commit)
+    audit.record(
+        actor="api",
+        action="upload_blob",
+        target_type="blob",
+        target_id=digest,
+        message=f"size={size}",
+    )
+    return schemas.BlobOut(sha256=digest, size=size)
+
+
+@router.api_route(
+    "/{digest}",
+    methods=["GET", "HEAD"],
+    dependencies=[Depends(require_device_token), Depends(ratelimit.agent_throttle)],
+)
+async def get_blob(
+    digest: str,
+    request: Request,
+    range_header: Optional[str] = Header(default=None, alias="Range"),
+    if_range: Optional[str] = Header(default=None),
+    if_none_match: Optional[str] = Header(default=None),
+):
+    store = blobs.get_store()
+    try:
+        size = await run_in_threadpool(store.size, digest)
+    except blobs.BlobNotFound:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    etag = f'"{digest}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=31536000, immutable",
+    }
+    if desired_state.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if if_range and if_range != etag:
+        range_header = None
+    try:
+        selected = blobs.byte_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    first, last = selected or (0, size - 1)
+    headers["Content-Length"] = str(max(last - first + 1, 0))
+    status_code = 200
+    if selected:
+        status_code = 206
+        headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+    if request.method == "HEAD" or size == 0:
+        return Response(status_code=status_code, headers=headers, media_type="application/octet-stream")
+    handle = await run_in_threadpool(store.open, digest)
+    return StreamingResponse(
+        blobs.read_range(handle, first, last),
+        status_code=status_code,
+        headers=headers,
+        media_type="application/octet-stream",
+    )
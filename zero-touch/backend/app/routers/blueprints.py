@@ -1,81 +1,103 @@
+import uuid
+
+from typing import Any, Dict
+
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import select
 
-from app import schemas
-from app.db import get_session
+from app import audit, blobs, blueprint_cache, desired_state, schemas
+from app.db import get_async_session
 from app.deps import require_api_key
-from app.models import AuditLog, Blueprint
+from app.integrations import content_hash
+from app.models import Blueprint
 
 router = APIRouter(prefix="/blueprints", tags=["blueprints"])
 
 
+async def _stored(payload: schemas.BlueprintCreate) -> Dict[str, Any]:
+    try:
+        files = await run_in_threadpool(blobs.externalize, payload.files)
+    except blobs.BlobNotFound as exc:
+        raise HTTPException(status_code=400, detail=f"Unknown blob {exc.args[0]}")
+    return {**payload.dict(), "files": files}
+
+
 @router.post("", response_model=schemas.BlueprintOut)
-def create_blueprint(payload: schemas.BlueprintCreate, session=Depends(get_session), _: None = Depends(require_api_key)):
-    bp = Blueprint(**payload.dict())
+async def create_blueprint(payload: schemas.BlueprintCreate, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    data = await _stored(payload)
+    bp = Blueprint(**data, content_hash=content_hash(data))
     session.add(bp)
-    session.add(
-        AuditLog(
-            actor="api",
-            action="create_blueprint",
-            target_type="blueprint",
-            target_id=str(bp.id),
-            message=payload.name,
-        )
+    await session.commit()
+    audit.record(
+        actor="api",
+        action="create_blueprint",
+        target_type="blueprint",
+        target_id=str(bp.id),
+        message=payload.name,
     )
-    session.commit()
-    session.refresh(bp)
+    await session.refresh(bp)
+    await desired_state.remember_blueprint(bp.id, bp.content_hash)
     return schemas.BlueprintOut(**bp.dict())
 
 
 @router.get("", response_model=list[schemas.BlueprintOut])
-def list_blueprints(session=Depends(get_session), _: None = Depends(require_api_key)):
-    blueprints = session.exec(select(Blueprint)).all()
+async def list_blueprints(session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    blueprints = (await session.exec(select(Blueprint))).all()
     return [schemas.BlueprintOut(**bp.dict()) for bp in blueprints]
 
 
 @router.get("/{blueprint_id}", response_model=schemas.BlueprintOut)
-def get_blueprint(blueprint_id: str, session=Depends(get_session), _: None = Depends(require_api_key)):
-    bp = session.get(Blueprint, blueprint_id)
-    if not bp:
+async def get_blueprint(blueprint_id: uuid.UUID, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    out = await blueprint_cache.aget_out(session, blueprint_id)
+    if out is None:
         raise HTTPException(status_code=404, detail="Blueprint not found")
-    return schemas.BlueprintOut(**bp.dict())
+    return out
 
 
 @router.put("/{blueprint_id}", response_model=schemas.BlueprintOut)
-def update_blueprint(blueprint_id: str, payload: schemas.BlueprintUpdate, session=Depends(get_session), _: None = Depends(require_api_key)):
-    bp = session.get(Blueprint, blueprint_id)
+async def update_blueprint(blueprint_id: uuid.UUID, payload: schemas.BlueprintUpdate, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    bp = await session.get(Blueprint, blueprint_id)
     if not bp:
         raise HTTPException(status_code=404, detail="Blueprint not found")
-    for key, value in payload.dict().items():
+    data = await _stored(payload)
+    for key, value in data.items():
         setattr(bp, key, value)
-    session.add(
-        AuditLog(
-            actor="api",
-            action="update_blueprint",
-            target_type="blueprint",
-            target_id=str(bp.id),
-            message=payload.name,
-        )
+    bp.content_hash = content_hash(data)
+    bp.version += 1
+    await session.commit()
+    audit.record(
+        actor="api",
+        action="update_blueprint",
+        target_type="blueprint",
+        target_id=str(bp.id),
+        message=payload.name,
     )
-    session.commit()
-    session.refresh(bp)
+    await session.refresh(bp)
+    await run_in_threadpool(blueprint_cache.invalidate, [bp.id])
+    await desired_state.remember_blueprint(bp.id, bp.content_hash)
     return schemas.BlueprintOut(**bp.dict())
 
 
 @router.delete("/{blueprint_id}")
-def delete_blueprint(blueprint_id: str, session=Depends(get_session), _: None = Depends(require_api_key)):
-    bp = session.get(Blueprint, blueprint_id)
+async def delete_blueprint(blueprint_id: uuid.UUID, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    bp = await session.get(Blueprint, blueprint_id)
     if not bp:
         raise HTTPException(status_code=404, detail="Blueprint not found")
-    session.delete(bp)
-    session.add(
-        AuditLog(
-            actor="api",
-            action="delete_blueprint",
-            target_type="blueprint",
-            target_id=str(bp.id),
-            message=bp.name,
-        )
+    await session.delete(bp)
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(status_code=409, detail="Blueprint is still referenced by workflows or rollouts")
+    audit.record(
+        actor="api",
+        action="delete_blueprint",
+        target_type="blueprint",
+        target_id=str(bp.id),
+        message=bp.name,
     )
-    session.commit()
+    await run_in_threadpool(blueprint_cache.invalidate, [blueprint_id])
+    await desired_state.remember_blueprint(blueprint_id, "")
     return {"status": "deleted"}
@@ -1,44 +1,141 @@
-from fastapi import APIRouter, Depends, HTTPException
+import uuid
+from typing import Any, List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import select
 
-from app import schemas
-from app.db import get_session
-from app.deps import require_api_key
+from app import blueprint_cache, desired_state, facts, heartbeats, ratelimit, schemas, serialization
+from app.config import get_settings
+from app.db import get_async_session
+from app.deps import require_api_key, require_device_token
+from app.integrations import plan_for, state_digest
+from app.integrations.providers import ProvisionResult, provider_for
 from app.models import Device
 
 router = APIRouter(prefix="/devices", tags=["devices"])
+settings = get_settings()
+
+HEARTBEAT_FACT_KEYS = {key.strip() for key in settings.heartbeat_fact_keys.split(",") if key.strip()}
 
 
 @router.get("", response_model=list[schemas.DeviceOut])
-def list_devices(session=Depends(get_session), _: None = Depends(require_api_key)):
-    devices = session.exec(select(Device)).all()
-    return [
-        schemas.DeviceOut(
-            id=d.id,
-            hostname=d.hostname,
-            os_type=d.os_type,
-            arch=d.arch,
-            status=d.status,
-            blueprint_id=d.blueprint_id,
-            last_seen=d.last_seen,
-            facts=d.facts,
-        )
-        for d in devices
-    ]
+async def list_devices(session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    rows = (await session.exec(select(*serialization.DEVICE_COLUMNS))).all()
+    last_seen = await heartbeats.merged_last_seen(rows)
+    return serialization.RawJSONResponse(serialization.devices(rows, last_seen))
+
+
+@router.get("/search", response_model=schemas.DevicePage)
+async def search_devices(q: str = "", limit: int = Query(default=100, ge=1, le=1000), cursor: Optional[uuid.UUID] = None, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    try:
+        clauses, post_filters = facts.compile_conditions(facts.parse(q))
+    except facts.QueryError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    matches: List[Any] = []
+    while len(matches) <= limit:
+        query = select(*serialization.DEVICE_COLUMNS).where(*clauses).order_by(Device.id).limit(limit + 1)
+        if cursor:
+            query = query.where(Device.id > cursor)
+        chunk = (await session.exec(query)).all()
+        matches += [d for d in chunk if all(check(d.facts or {}) for check in post_filters)]
+        if len(chunk) <= limit:
+            break
+        cursor = chunk[-1].id
+
+    page = matches[:limit]
+    last_seen = await heartbeats.merged_last_seen(page)
+    return serialization.RawJSONResponse(
+        {
+            "items": serialization.devices(page, last_seen),
+            "next_cursor": str(page[-1].id) if len(matches) > limit else None,
+        }
+    )
 
 
 @router.get("/{device_id}", response_model=schemas.DeviceOut)
-def get_device(device_id: str, session=Depends(get_session), _: None = Depends(require_api_key)):
-    device = session.get(Device, device_id)
+async def get_device(device_id: uuid.UUID, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    row = (await session.exec(select(*serialization.DEVICE_COLUMNS).where(Device.id == device_id))).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Device not found")
+    last_seen = await heartbeats.merged_last_seen([row])
+    return serialization.RawJSONResponse(serialization.device(row, last_seen))
+
+
+@router.post("/{device_id}/heartbeat", response_model=schemas.HeartbeatOut, status_code=202, dependencies=[Depends(ratelimit.agent_throttle), Depends(require_device_token)])
+async def heartbeat(device_id: uuid.UUID, payload: schemas.HeartbeatIn):
+    if len(payload.facts) > settings.heartbeat_max_fact_keys:
+        raise HTTPException(status_code=413, detail="Too many fact keys in heartbeat")
+    unsupported = set(payload.facts) - HEARTBEAT_FACT_KEYS
+    if unsupported:
+        raise HTTPException(status_code=422, detail=f"Unsupported heartbeat fact keys: {', '.join(sorted(unsupported))}")
+    received_at = await heartbeats.record(device_id, payload.facts)
+    return schemas.HeartbeatOut(device_id=device_id, received_at=received_at)
+
+
+async def _current_etag(session, device_id: uuid.UUID) -> Optional[str]:
+    etag = await desired_state.cached_etag(device_id)
+    if etag is not None:
+        return etag
+    device = await session.get(Device, device_id)
     if not device:
+        return None
+    await desired_state.remember_assignment(device.id, device.blueprint_id, device.os_type, device.facts)
+    if device.blueprint_id:
+        blueprint = await blueprint_cache.aget(session, device.blueprint_id)
+        await desired_state.remember_blueprint(
+            device.blueprint_id, blueprint.content_hash if blueprint else ""
+        )
+    await session.rollback()
+    return await desired_state.cached_etag(device_id)
+
+
+@router.get("/{device_id}/plan", response_model=schemas.DevicePlanOut, dependencies=[Depends(ratelimit.agent_throttle), Depends(require_device_token)])
+async def get_device_plan(
+    device_id: uuid.UUID,
+    response: Response,
+    wait: float = Query(default=0, ge=0),
+    if_none_match: Optional[str] = Header(default=None),
+    session=Depends(get_async_session),
+):
+    etag = await _current_etag(session, device_id)
+    if etag is None:
         raise HTTPException(status_code=404, detail="Device not found")
-    return schemas.DeviceOut(
-        id=device.id,
-        hostname=device.hostname,
-        os_type=device.os_type,
-        arch=device.arch,
-        status=device.status,
+    if desired_state.etag_matches(if_none_match, etag):
+        if wait:
+            etag = await desired_state.wait_for_change(
+                etag, wait, lambda: _current_etag(session, device_id)
+            )
+        if etag is None:
+            raise HTTPException(status_code=404, detail="Device not found")
+        if desired_state.etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+    async with ratelimit.plan_gate.slot():
+        device = await session.get(Device, device_id)
+        if not device:
+            raise HTTPException(status_code=404, detail="Device not found")
+        blueprint = await blueprint_cache.aget(session, device.blueprint_id)
+        provider = provider_for(device.os_type)
+        plan = ProvisionResult(ok=True)
+        if blueprint:
+            plan = await run_in_threadpool(plan_for, device.os_type, blueprint, device.facts)
+    blueprint_hash = blueprint.content_hash if blueprint else ""
+    await desired_state.remember_assignment(device.id, device.blueprint_id, device.os_type, device.facts)
+    if device.blueprint_id:
+        await desired_state.remember_blueprint(device.blueprint_id, blueprint_hash)
+    response.headers["ETag"] = desired_state.etag_for(
+        device.id, device.blueprint_id, blueprint_hash, provider, state_digest(device.facts)
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    return schemas.DevicePlanOut(
+        device_id=device.id,
         blueprint_id=device.blueprint_id,
-        last_seen=device.last_seen,
-        facts=device.facts,
+        content_hash=blueprint_hash,
+        version=blueprint.version if blueprint else 0,
+        provider=provider,
+        actions=plan.actions,
+        steps=[schemas.PlanStep(**step) for step in plan.steps],
+        unchanged=plan.unchanged,
     )
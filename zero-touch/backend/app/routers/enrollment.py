@@ -1,17 +1,42 @@
 import datetime as dt
+import hashlib
+import hmac
+import json
 import secrets
-from typing import List
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
 
 import qrcode
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import select
 
-from app import schemas
-from app.db import get_session
+from app import audit, desired_state, groups, ratelimit, rollups, schemas, serialization, tokens
+from app.config import get_settings
+from app.db import get_async_session
 from app.deps import require_api_key
-from app.models import AuditLog, Device, EnrollmentToken
+from app.models import Device, EnrollmentToken, IdempotencyRecord
 
 router = APIRouter(prefix="/enrollment", tags=["enrollment"])
+settings = get_settings()
+
+UPSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+PLACEHOLDER_IDS = {
+    "default string",
+    "none",
+    "n/a",
+    "not applicable",
+    "not specified",
+    "system serial number",
+    "to be filled by o.e.m.",
+    "unknown",
+    "0123456789",
+    "ffffffffffff",
+}
 
 
 def _make_qr_ascii(content: str) -> str:
@@ -25,28 +50,35 @@ def _make_qr_ascii(content: str) -> str:
     return "\n".join(lines)
 
 
+def _blueprint_ref(facts: dict) -> uuid.UUID | None:
+    value = facts.get("blueprint_id")
+    try:
+        return uuid.UUID(str(value)) if value else None
+    except ValueError:
+        return None
+
+
 @router.post("/tokens", response_model=schemas.EnrollmentTokenOut)
-def create_token(payload: schemas.EnrollmentTokenCreate, session=Depends(get_session), _: None = Depends(require_api_key)):
+async def create_token(payload: schemas.EnrollmentTokenCreate, session=Depends(get_async_session), _: None = Depends(require_api_key)):
     token_value = secrets.token_urlsafe(24)
     expires_at = dt.datetime.utcnow() + dt.timedelta(minutes=payload.ttl_minutes)
     token = EnrollmentToken(
-        token=token_value,
+        token_hash=tokens.hash_token(token_value),
         expires_at=expires_at,
         uses_remaining=payload.max_uses,
         claims=payload.claims,
     )
     session.add(token)
-    session.add(
-        AuditLog(
-            actor="api",
-            action="create_token",
-            target_type="enrollment",
-            target_id=str(token.id),
-            message=f"ttl={payload.ttl_minutes} uses={payload.max_uses}",
-        )
+    await session.commit()
+    audit.record(
+        actor="api",
+        action="create_token",
+        target_type="enrollment",
+        target_id=str(token.id),
+        message=f"ttl={payload.ttl_minutes} uses={payload.max_uses}",
     )
-    session.commit()
-    session.refresh(token)
+    await session.refresh(token)
+    await run_in_threadpool(tokens.minted, token.token_hash)
     enrollment_url = f"https://api.localhost/enroll?token={token_value}"
     return schemas.EnrollmentTokenOut(
         token=token_value,
@@ -57,48 +89,163 @@ def create_token(payload: schemas.EnrollmentTokenCreate, session=Depends(get_ses
     )
 
 
-@router.post("/register", response_model=schemas.DeviceOut)
-def register_device(payload: schemas.DeviceRegister, session=Depends(get_session)):
-    token = session.exec(
-        select(EnrollmentToken).where(EnrollmentToken.token == payload.token)
+def _hardware_id(payload: schemas.DeviceRegister) -> Optional[str]:
+    candidates = [("hardware_id", payload.hardware_id)] + [
+        (key, payload.facts.get(key)) for key in settings.hardware_id_facts.split(",") if key
+    ]
+    for key, value in candidates:
+        normalized = str(value or "").strip().lower()
+        if key == "mac":
+            normalized = normalized.replace(":", "").replace("-", "").replace(".", "")
+        if normalized and normalized not in PLACEHOLDER_IDS and normalized.strip("0"):
+            return hashlib.sha256(f"{key}:{normalized}".encode()).hexdigest()
+    return None
+
+
+def _request_hash(payload: schemas.DeviceRegister) -> str:
+    return hashlib.sha256(json.dumps(payload.dict(), sort_keys=True, default=str).encode()).hexdigest()
+
+
+async def _replay(session, key: str, request_hash: str) -> Optional[serialization.RawJSONResponse]:
+    record = await session.get(IdempotencyRecord, key)
+    if not record:
+        return None
+    if record.created_at < dt.datetime.utcnow() - dt.timedelta(seconds=settings.idempotency_ttl):
+        await session.delete(record)
+        await session.commit()
+        return None
+    if record.request_hash != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key reused with a different request")
+    return serialization.RawJSONResponse(
+        {**record.response, "device_token": tokens.device_token(record.response["id"])},
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+def _holds_device_token(device_id: uuid.UUID, presented: Optional[str]) -> bool:
+    return bool(presented) and hmac.compare_digest(presented, tokens.device_token(device_id))
+
+
+async def _upsert_device(session, values: Dict[str, Any]) -> Tuple[uuid.UUID, Optional[uuid.UUID]]:
+    refresh = {key: values[key] for key in ("hostname", "os_type", "arch", "facts", "status", "last_seen", "enrollment_token_id")}
+    dialect = session.bind.dialect.name
+    if dialect in UPSERTS:
+        stmt = UPSERTS[dialect](Device).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Device.hardware_id],
+            set_={**refresh, "blueprint_id": func.coalesce(stmt.excluded.blueprint_id, Device.blueprint_id)},
+        ).returning(Device.id, Device.blueprint_id)
+        return tuple((await session.execute(stmt)).one())
+    device = None
+    if values["hardware_id"]:
+        device = (await session.exec(select(Device).where(Device.hardware_id == values["hardware_id"]).with_for_update())).first()
+    if device is None:
+        device = Device(**values)
+        session.add(device)
+    else:
+        for key, value in refresh.items():
+            setattr(device, key, value)
+        device.blueprint_id = values["blueprint_id"] or device.blueprint_id
+    await session.flush()
+    return device.id, device.blueprint_id
+
+
+@router.post("/register", response_model=schemas.DeviceEnrolled, dependencies=[Depends(ratelimit.register_throttle), Depends(ratelimit.register_gate)])
+async def register_device(
+    payload: schemas.DeviceRegister,
+    idempotency_key: Optional[str] = Header(default=None, max_length=255),
+    x_device_token: Optional[str] = Header(default=None),
+    session=Depends(get_async_session),
+):
+    token_ref = ratelimit.token_key(payload.token)
+    await ratelimit.enforce("register", [(f"token:{token_ref}", settings.register_limit_per_token)])
+    record_key = f"register:{token_ref}:{idempotency_key}" if idempotency_key else None
+    request_hash = _request_hash(payload)
+    if record_key:
+        replayed = await _replay(session, record_key, request_hash)
+        if replayed:
+            return replayed
+
+    token_hash = tokens.hash_token(payload.token)
+    if not await tokens.token_filter.might_contain(token_hash):
+        raise HTTPException(status_code=404, detail="Token not found")
+    token = (
+        await session.exec(
+            select(EnrollmentToken).where(EnrollmentToken.token_hash == token_hash)
+        )
     ).first()
     if not token:
         raise HTTPException(status_code=404, detail="Token not found")
     if token.expires_at < dt.datetime.utcnow():
         raise HTTPException(status_code=400, detail="Token expired")
-    if token.uses_remaining <= 0:
-        raise HTTPException(status_code=400, detail="Token exhausted")
-
-    device = Device(
-        hostname=payload.hostname,
-        os_type=payload.os_type,
-        arch=payload.arch,
-        facts=payload.facts,
-        enrollment_token_id=token.id,
-        status="enrolled",
-        last_seen=dt.datetime.utcnow(),
-        blueprint_id=payload.facts.get("blueprint_id"),
-    )
-    token.uses_remaining -= 1
-    session.add(device)
-    session.add(
-        AuditLog(
-            actor=payload.hostname,
-            action="register_device",
-            target_type="device",
-            target_id=str(device.id),
-            message=f"os={payload.os_type} arch={payload.arch}",
+
+    now = dt.datetime.utcnow()
+    new_id = uuid.uuid4()
+    hardware_id = _hardware_id(payload)
+    previous = None
+    if hardware_id:
+        previous = (
+            await session.exec(
+                select(Device.id, Device.os_type, Device.status).where(Device.hardware_id == hardware_id).with_for_update()
+            )
+        ).first()
+    if previous is None or not _holds_device_token(previous.id, x_device_token):
+        claimed = await session.execute(
+            update(EnrollmentToken)
+            .where(EnrollmentToken.id == token.id, EnrollmentToken.uses_remaining > 0)
+            .values(uses_remaining=EnrollmentToken.uses_remaining - 1)
         )
+        if claimed.rowcount == 0:
+            await session.rollback()
+            raise HTTPException(status_code=400, detail="Token exhausted")
+    device_id, blueprint_id = await _upsert_device(
+        session,
+        {
+            "id": new_id,
+            "hostname": payload.hostname,
+            "os_type": payload.os_type,
+            "arch": payload.arch,
+            "hardware_id": hardware_id,
+            "facts": payload.facts,
+            "enrollment_token_id": token.id,
+            "status": "enrolled",
+            "last_seen": now,
+            "blueprint_id": _blueprint_ref(payload.facts),
+        },
     )
-    session.commit()
-    session.refresh(device)
-    return schemas.DeviceOut(
-        id=device.id,
-        hostname=device.hostname,
-        os_type=device.os_type,
-        arch=device.arch,
-        status=device.status,
-        blueprint_id=device.blueprint_id,
-        last_seen=device.last_seen,
-        facts=device.facts,
+    created = device_id == new_id
+    if created or previous:
+        deltas: Counter = Counter()
+        rollups.move(deltas, None if created else rollups.device_key(previous.os_type, previous.status), rollups.device_key(payload.os_type, "enrolled"))
+        await session.run_sync(rollups.stage, deltas)
+    out = {
+        "id": device_id,
+        "hostname": payload.hostname,
+        "os_type": payload.os_type,
+        "arch": payload.arch,
+        "status": "enrolled",
+        "blueprint_id": blueprint_id,
+        "last_seen": now,
+        "facts": payload.facts,
+    }
+    if record_key:
+        session.add(IdempotencyRecord(key=record_key, request_hash=request_hash, response=json.loads(serialization.dumps(out))))
+    try:
+        await session.flush()
+    except IntegrityError:
+        await session.rollback()
+        replayed = await _replay(session, record_key, request_hash) if record_key else None
+        if not replayed:
+            raise HTTPException(status_code=409, detail="Registration already in progress")
+        return replayed
+    await session.run_sync(groups.update_memberships, [device_id])
+    await session.commit()
+    audit.record(
+        actor=payload.hostname,
+        action="register_device" if created else "reenroll_device",
+        target_type="device",
+        target_id=str(device_id),
+        message=f"os={payload.os_type} arch={payload.arch}",
     )
+    await desired_state.remember_assignment(device_id, blueprint_id, payload.os_type, payload.facts)
+    return serialization.RawJSONResponse({**out, "device_token": tokens.device_token(device_id)})
@@ -0,0 +1,145 @@
+import datetime as dt
+import uuid
+from typing import Dict, Iterable, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import delete, func
+from sqlmodel import select
+
+from app import audit, facts, groups, heartbeats, schemas, serialization
+from app.db import get_async_session
+from app.deps import require_api_key
+from app.models import Device, DeviceGroup, GroupMembership
+
+router = APIRouter(prefix="/groups", tags=["groups"])
+
+
+def _validate(query: str) -> None:
+    try:
+        facts.parse(query)
+    except facts.QueryError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+async def _member_counts(session, group_ids: Iterable[uuid.UUID]) -> Dict[uuid.UUID, int]:
+    rows = (
+        await session.exec(
+            select(GroupMembership.group_id, func.count())
+            .where(GroupMembership.group_id.in_(list(group_ids)))
+            .group_by(GroupMembership.group_id)
+        )
+    ).all()
+    return dict(rows)
+
+
+async def _name_taken(session, name: str, group_id: Optional[uuid.UUID] = None) -> bool:
+    query = select(DeviceGroup.id).where(DeviceGroup.name == name)
+    if group_id:
+        query = query.where(DeviceGroup.id != group_id)
+    return (await session.exec(query)).first() is not None
+
+
+@router.post("", response_model=schemas.DeviceGroupOut)
+async def create_group(payload: schemas.DeviceGroupCreate, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    _validate(payload.query)
+    if await _name_taken(session, payload.name):
+        raise HTTPException(status_code=409, detail="Group name already exists")
+    group = DeviceGroup(**payload.dict())
+    session.add(group)
+    await session.flush()
+    added, _ = await session.run_sync(groups.rebuild_group, group)
+    await session.commit()
+    audit.record(
+        actor="api",
+        action="create_group",
+        target_type="group",
+        target_id=str(group.id),
+        message=f"{payload.name} members={added}",
+    )
+    return schemas.DeviceGroupOut(**group.dict(), members=added)
+
+
+@router.get("", response_model=list[schemas.DeviceGroupOut])
+async def list_groups(session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    device_groups = (await session.exec(select(DeviceGroup).order_by(DeviceGroup.name))).all()
+    counts = await _member_counts(session, [group.id for group in device_groups])
+    return [
+        schemas.DeviceGroupOut(**group.dict(), members=counts.get(group.id, 0))
+        for group in device_groups
+    ]
+
+
+@router.get("/{group_id}", response_model=schemas.DeviceGroupOut)
+async def get_group(group_id: uuid.UUID, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    group = await session.get(DeviceGroup, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    counts = await _member_counts(session, [group.id])
+    return schemas.DeviceGroupOut(**group.dict(), members=counts.get(group.id, 0))
+
+
+@router.put("/{group_id}", response_model=schemas.DeviceGroupOut)
+async def update_group(group_id: uuid.UUID, payload: schemas.DeviceGroupUpdate, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    group = await session.get(DeviceGroup, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    _validate(payload.query)
+    if await _name_taken(session, payload.name, group.id):
+        raise HTTPException(status_code=409, detail="Group name already exists")
+    for key, value in payload.dict().items():
+        setattr(group, key, value)
+    group.updated_at = dt.datetime.utcnow()
+    await session.flush()
+    added, removed = await session.run_sync(groups.rebuild_group, group)
+    await session.commit()
+    audit.record(
+        actor="api",
+        action="update_group",
+        target_type="group",
+        target_id=str(group.id),
+        message=f"{payload.name} added={added} removed={removed}",
+    )
+    counts = await _member_counts(session, [group.id])
+    return schemas.DeviceGroupOut(**group.dict(), members=counts.get(group.id, 0))
+
+
+@router.delete("/{group_id}")
+async def delete_group(group_id: uuid.UUID, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    group = await session.get(DeviceGroup, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    await session.execute(delete(GroupMembership).where(GroupMembership.group_id == group.id))
+    await session.delete(group)
+    await session.commit()
+    audit.record(
+        actor="api",
+        action="delete_group",
+        target_type="group",
+        target_id=str(group.id),
+        message=group.name,
+    )
+    return {"status": "deleted"}
+
+
+@router.get("/{group_id}/devices", response_model=schemas.DevicePage)
+async def list_group_devices(group_id: uuid.UUID, limit: int = Query(default=100, ge=1, le=1000), cursor: Optional[uuid.UUID] = None, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    if not await session.get(DeviceGroup, group_id):
+        raise HTTPException(status_code=404, detail="Group not found")
+    query = (
+        select(*serialization.DEVICE_COLUMNS)
+        .join(GroupMembership, GroupMembership.device_id == Device.id)
+        .where(GroupMembership.group_id == group_id)
+        .order_by(Device.id)
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(Device.id > cursor)
+    rows = (await session.exec(query)).all()
+    page = rows[:limit]
+    last_seen = await heartbeats.merged_last_seen(page)
+    return serialization.RawJSONResponse(
+        {
+            "items": serialization.devices(page, last_seen),
+            "next_cursor": str(page[-1].id) if len(rows) > limit else None,
+        }
+    )
@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Depends
+
+from app import rollups, schemas
+from app.db import get_async_session
+from app.deps import require_api_key
+
+router = APIRouter(prefix="/summary", tags=["summary"])
+
+
+@router.get("", response_model=schemas.StatusSummary)
+async def get_summary(session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    return await session.run_sync(rollups.summary)
@@ -1,24 +1,31 @@
+import asyncio
 import datetime as dt
 import uuid
+from collections import Counter
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, insert, update
 from sqlmodel import select
 
-from app import schemas
-from app.db import get_session
+from app import audit, blueprint_cache, events, groups, outbox, retention, rollups, schemas, serialization
+from app.config import get_settings
+from app.db import async_session, get_async_session
 from app.deps import require_api_key
-from app.models import AuditLog, Blueprint, Device, WorkflowRun
-from app.worker import enqueue_workflow
+from app.models import Device, DeviceGroup, GroupMembership, Rollout, WorkflowArchive, WorkflowRun
+from app.selectors import device_filters
 
 router = APIRouter(prefix="/workflows", tags=["workflows"])
+settings = get_settings()
 
 
 @router.post("/devices/{device_id}", response_model=schemas.WorkflowOut)
-def start_workflow(device_id: str, payload: schemas.WorkflowStart, session=Depends(get_session), _: None = Depends(require_api_key)):
-    device = session.get(Device, device_id)
+async def start_workflow(device_id: uuid.UUID, payload: schemas.WorkflowStart, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    device = await session.get(Device, device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
-    blueprint = session.get(Blueprint, payload.blueprint_id)
+    blueprint = await blueprint_cache.aget(session, payload.blueprint_id)
     if not blueprint:
         raise HTTPException(status_code=404, detail="Blueprint not found")
 
@@ -26,47 +33,261 @@ def start_workflow(device_id: str, payload: schemas.WorkflowStart, session=Depen
         device_id=device.id,
         blueprint_id=blueprint.id,
         status="queued",
+        dry_run=payload.dry_run,
         steps=[],
     )
+    deltas: Counter = Counter()
+    rollups.move(deltas, None, rollups.workflow_key(blueprint.id, run.started_at, "queued"))
+    rollups.move(deltas, rollups.device_key(device.os_type, device.status), rollups.device_key(device.os_type, "provisioning"))
     device.status = "provisioning"
     session.add(run)
-    session.add(
-        AuditLog(
-            actor="api",
-            action="start_workflow",
-            target_type="workflow",
-            target_id=str(run.id),
-            message=f"device={device.hostname} blueprint={blueprint.name}",
+    await session.flush()
+    await session.run_sync(groups.update_memberships, [device.id], {"status"})
+    await session.run_sync(rollups.stage, deltas)
+    await session.run_sync(outbox.stage, [(run.id, device.os_type)], payload.priority, payload.dry_run)
+    await session.commit()
+    audit.record(
+        actor="api",
+        action="start_workflow",
+        target_type="workflow",
+        target_id=str(run.id),
+        message=f"device={device.hostname} blueprint={blueprint.name}",
+    )
+    return serialization.RawJSONResponse(serialization.workflow(run))
+
+
+async def _rollout_out(session, rollout: Rollout) -> schemas.RolloutOut:
+    rows = (
+        await session.exec(
+            select(WorkflowRun.status, func.count())
+            .where(WorkflowRun.rollout_id == rollout.id)
+            .group_by(WorkflowRun.status)
         )
+    ).all()
+    archived = (
+        await session.exec(
+            select(WorkflowArchive.status, func.count())
+            .where(WorkflowArchive.rollout_id == rollout.id)
+            .group_by(WorkflowArchive.status)
+        )
+    ).all()
+    progress: Dict[str, int] = {}
+    for run_status, count in [*rows, *archived]:
+        progress[run_status] = progress.get(run_status, 0) + count
+    return schemas.RolloutOut(
+        id=rollout.id,
+        blueprint_id=rollout.blueprint_id,
+        group_id=rollout.group_id,
+        dry_run=rollout.dry_run,
+        total=rollout.total,
+        created_at=rollout.created_at,
+        progress=progress,
     )
-    session.commit()
-    enqueue_workflow(run.id, dry_run=payload.dry_run)
-    return schemas.WorkflowOut(
-        id=run.id,
-        device_id=run.device_id,
-        blueprint_id=run.blueprint_id,
-        status=run.status,
-        started_at=run.started_at,
-        updated_at=run.updated_at,
-        steps=[],
-        last_error=None,
+
+
+@router.post("/rollouts", response_model=schemas.RolloutOut)
+async def start_rollout(payload: schemas.RolloutStart, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    blueprint = await blueprint_cache.aget(session, payload.blueprint_id)
+    if not blueprint:
+        raise HTTPException(status_code=404, detail="Blueprint not found")
+
+    query = select(Device.id, Device.os_type, Device.status).where(*device_filters(payload.selector))
+    if payload.group_id:
+        if not await session.get(DeviceGroup, payload.group_id):
+            raise HTTPException(status_code=404, detail="Group not found")
+        query = query.where(
+            Device.id.in_(
+                select(GroupMembership.device_id).where(GroupMembership.group_id == payload.group_id)
+            )
+        )
+    targets = (await session.exec(query)).all()
+    device_ids = [device_id for device_id, _, _ in targets]
+    rollout = Rollout(
+        blueprint_id=blueprint.id,
+        selector=payload.selector.dict(),
+        group_id=payload.group_id,
+        dry_run=payload.dry_run,
+        total=len(device_ids),
     )
+    session.add(rollout)
+    await session.flush()
+
+    now = dt.datetime.utcnow()
+    rows = [
+        {
+            "id": uuid.uuid4(),
+            "device_id": device_id,
+            "blueprint_id": blueprint.id,
+            "rollout_id": rollout.id,
+            "status": "queued",
+            "dry_run": payload.dry_run,
+            "steps": [],
+            "started_at": now,
+            "updated_at": now,
+        }
+        for device_id in device_ids
+    ]
+    if rows:
+        await session.execute(insert(WorkflowRun), rows)
+        await session.execute(
+            update(Device)
+            .where(
+                Device.id.in_(
+                    select(WorkflowRun.device_id).where(WorkflowRun.rollout_id == rollout.id)
+                )
+            )
+            .values(status="provisioning")
+        )
+        await session.run_sync(groups.update_memberships, device_ids, {"status"})
+        deltas: Counter = Counter()
+        for _, os_type, device_status in targets:
+            rollups.move(deltas, None, rollups.workflow_key(blueprint.id, now, "queued"))
+            rollups.move(deltas, rollups.device_key(os_type, device_status), rollups.device_key(os_type, "provisioning"))
+        await session.run_sync(rollups.stage, deltas)
+        await session.run_sync(
+            outbox.stage,
+            [(row["id"], os_type) for row, (_, os_type, _) in zip(rows, targets)],
+            payload.priority,
+            payload.dry_run,
+        )
+    await session.commit()
+    audit.record(
+        actor="api",
+        action="start_rollout",
+        target_type="rollout",
+        target_id=str(rollout.id),
+        message=f"blueprint={blueprint.name} devices={len(rows)}",
+    )
+    return schemas.RolloutOut(
+        id=rollout.id,
+        blueprint_id=rollout.blueprint_id,
+        group_id=rollout.group_id,
+        dry_run=rollout.dry_run,
+        total=rollout.total,
+        created_at=rollout.created_at,
+        progress={"queued": len(rows)} if rows else {},
+    )
+
+
+@router.get("/rollouts/{rollout_id}", response_model=schemas.RolloutOut)
+async def get_rollout(rollout_id: uuid.UUID, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    rollout = await session.get(Rollout, rollout_id)
+    if not rollout:
+        raise HTTPException(status_code=404, detail="Rollout not found")
+    return await _rollout_out(session, rollout)
+
+
+def _workflow_event(run: WorkflowRun) -> Dict[str, Any]:
+    return {
+        "type": "workflow",
+        "workflow_id": run.id,
+        "device_id": run.device_id,
+        "rollout_id": run.rollout_id,
+        "status": run.status,
+        "steps": run.steps or [],
+        "last_error": run.last_error,
+        "updated_at": run.updated_at,
+    }
+
+
+async def _event_stream(request: Request, key: events.Key, queue: asyncio.Queue, initial: List[Dict[str, Any]], until_terminal: bool) -> AsyncIterator[str]:
+    try:
+        for event in initial:
+            yield events.format_sse(event)
+            if until_terminal and event.get("status") in events.TERMINAL_STATUSES:
+                return
+        while not await request.is_disconnected():
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=settings.sse_keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield events.format_sse(event)
+            if until_terminal and event.get("status") in events.TERMINAL_STATUSES:
+                return
+    finally:
+        events.broadcaster.unsubscribe(key, queue)
+
+
+def _sse(stream: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/events")
+async def stream_events(request: Request, device_id: Optional[uuid.UUID] = None, rollout_id: Optional[uuid.UUID] = None, _: None = Depends(require_api_key)):
+    if (device_id is None) == (rollout_id is None):
+        raise HTTPException(status_code=400, detail="Pass exactly one of device_id or rollout_id")
+    key = ("device", str(device_id)) if device_id else ("rollout", str(rollout_id))
+    queue = events.broadcaster.subscribe(key)
+    initial = []
+    if rollout_id:
+        async with async_session() as session:
+            rollout = await session.get(Rollout, rollout_id)
+            if not rollout:
+                events.broadcaster.unsubscribe(key, queue)
+                raise HTTPException(status_code=404, detail="Rollout not found")
+            initial.append({"type": "rollout", **(await _rollout_out(session, rollout)).dict()})
+    return _sse(_event_stream(request, key, queue, initial, until_terminal=False))
+
+
+@router.get("/{workflow_id}/events")
+async def stream_workflow_events(request: Request, workflow_id: uuid.UUID, _: None = Depends(require_api_key)):
+    key = ("workflow", str(workflow_id))
+    queue = events.broadcaster.subscribe(key)
+    async with async_session() as session:
+        run = await session.get(WorkflowRun, workflow_id)
+    if not run:
+        events.broadcaster.unsubscribe(key, queue)
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    return _sse(_event_stream(request, key, queue, [_workflow_event(run)], until_terminal=True))
+
+
+async def _archived_workflow(session, workflow_id: uuid.UUID) -> serialization.RawJSONResponse:
+    archived = await session.get(WorkflowArchive, workflow_id)
+    if not archived:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    return serialization.RawJSONResponse(serialization.workflow(archived, retention.unpack(archived.payload)))
 
 
 @router.get("/{workflow_id}", response_model=schemas.WorkflowOut)
-def get_workflow(workflow_id: uuid.UUID, session=Depends(get_session), _: None = Depends(require_api_key)):
-    run = session.get(WorkflowRun, workflow_id)
+async def get_workflow(workflow_id: uuid.UUID, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    row = (await session.exec(select(*serialization.WORKFLOW_COLUMNS).where(WorkflowRun.id == workflow_id))).first()
+    if not row:
+        return await _archived_workflow(session, workflow_id)
+    return serialization.RawJSONResponse(serialization.workflow(row))
+
+
+@router.post("/{workflow_id}/resume", response_model=schemas.WorkflowOut)
+async def resume_workflow(workflow_id: uuid.UUID, session=Depends(get_async_session), _: None = Depends(require_api_key)):
+    run = await session.get(WorkflowRun, workflow_id)
     if not run:
         raise HTTPException(status_code=404, detail="Workflow not found")
-    return schemas.WorkflowOut(
-        id=run.id,
-        device_id=run.device_id,
-        blueprint_id=run.blueprint_id,
-        status=run.status,
-        started_at=run.started_at,
-        updated_at=run.updated_at,
-        steps=[
-            schemas.WorkflowStep(**step) for step in (run.steps or [])
-        ],
-        last_error=run.last_error,
+    if run.status != "failed":
+        raise HTTPException(status_code=409, detail="Only failed workflows can be resumed")
+    device = await session.get(Device, run.device_id)
+    deltas: Counter = Counter()
+    rollups.move(deltas, rollups.workflow_key(run.blueprint_id, run.started_at, run.status), rollups.workflow_key(run.blueprint_id, run.started_at, "queued"))
+    if device:
+        rollups.move(deltas, rollups.device_key(device.os_type, device.status), rollups.device_key(device.os_type, "provisioning"))
+    run.status = "queued"
+    run.last_error = None
+    run.updated_at = dt.datetime.utcnow()
+    if device:
+        device.status = "provisioning"
+        await session.flush()
+        await session.run_sync(groups.update_memberships, [device.id], {"status"})
+    await session.run_sync(rollups.stage, deltas)
+    await session.run_sync(outbox.stage, [(run.id, device.os_type if device else "")], "high", run.dry_run)
+    await session.commit()
+    audit.record(
+        actor="api",
+        action="resume_workflow",
+        target_type="workflow",
+        target_id=str(run.id),
+        message=f"completed_steps={sum(1 for step in run.steps or [] if step.get('status') == 'ok')}",
     )
+    return serialization.RawJSONResponse(serialization.workflow(run))
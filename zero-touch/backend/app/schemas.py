@@ -1,6 +1,6 @@
 import datetime as dt
 import uuid
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Literal, Optional
 
 from pydantic import BaseModel, Field
 
@@ -24,9 +24,19 @@ class DeviceRegister(BaseModel):
     hostname: str
     os_type: str
     arch: str
+    hardware_id: Optional[str] = None
     facts: Dict[str, Any] = Field(default_factory=dict)
 
 
+class HeartbeatIn(BaseModel):
+    facts: Dict[str, Any] = Field(default_factory=dict)
+
+
+class HeartbeatOut(BaseModel):
+    device_id: uuid.UUID
+    received_at: dt.datetime
+
+
 class DeviceOut(BaseModel):
     id: uuid.UUID
     hostname: str
@@ -38,6 +48,32 @@ class DeviceOut(BaseModel):
     facts: Dict[str, Any]
 
 
+class DeviceEnrolled(DeviceOut):
+    device_token: str
+
+
+class DevicePage(BaseModel):
+    items: List[DeviceOut] = Field(default_factory=list)
+    next_cursor: Optional[str] = None
+
+
+class PlanStep(BaseModel):
+    name: str
+    after: List[str] = Field(default_factory=list)
+    actions: List[str] = Field(default_factory=list)
+
+
+class DevicePlanOut(BaseModel):
+    device_id: uuid.UUID
+    blueprint_id: Optional[uuid.UUID]
+    content_hash: str
+    version: int
+    provider: str
+    actions: List[str] = Field(default_factory=list)
+    steps: List[PlanStep] = Field(default_factory=list)
+    unchanged: Dict[str, List[str]] = Field(default_factory=dict)
+
+
 class BlueprintCreate(BaseModel):
     name: str
     description: str = ""
@@ -54,17 +90,31 @@ class BlueprintUpdate(BlueprintCreate):
 
 class BlueprintOut(BlueprintCreate):
     id: uuid.UUID
+    content_hash: str = ""
+    version: int = 1
+
+
+class BlobOut(BaseModel):
+    sha256: str
+    size: int
 
 
 class WorkflowStart(BaseModel):
     blueprint_id: uuid.UUID
     dry_run: bool = False
+    priority: Literal["high", "normal"] = "high"
 
 
 class WorkflowStep(BaseModel):
     name: str
     status: str
-    detail: Optional[str] = None
+    detail: Optional[Any] = None
+    after: List[str] = Field(default_factory=list)
+    started_at: Optional[dt.datetime] = None
+    finished_at: Optional[dt.datetime] = None
+    duration_ms: Optional[float] = None
+    resumed: bool = False
+    skipped: List[str] = Field(default_factory=list)
 
 
 class WorkflowOut(BaseModel):
@@ -76,3 +126,68 @@ class WorkflowOut(BaseModel):
     updated_at: dt.datetime
     steps: List[WorkflowStep] = Field(default_factory=list)
     last_error: Optional[str] = None
+    archived: bool = False
+
+
+class DeviceSelector(BaseModel):
+    os_type: List[str] = Field(default_factory=list)
+    status: List[str] = Field(default_factory=list)
+    arch: List[str] = Field(default_factory=list)
+    facts: Dict[str, Any] = Field(default_factory=dict)
+
+
+class RolloutStart(BaseModel):
+    blueprint_id: uuid.UUID
+    selector: DeviceSelector = Field(default_factory=DeviceSelector)
+    group_id: Optional[uuid.UUID] = None
+    dry_run: bool = False
+    priority: Literal["high", "normal"] = "normal"
+
+
+class RolloutOut(BaseModel):
+    id: uuid.UUID
+    blueprint_id: uuid.UUID
+    group_id: Optional[uuid.UUID] = None
+    dry_run: bool
+    total: int
+    created_at: dt.datetime
+    progress: Dict[str, int] = Field(default_factory=dict)
+
+
+class DeviceGroupCreate(BaseModel):
+    name: str
+    description: str = ""
+    query: str
+
+
+class DeviceGroupUpdate(DeviceGroupCreate):
+    pass
+
+
+class DeviceGroupOut(DeviceGroupCreate):
+    id: uuid.UUID
+    members: int = 0
+    created_at: dt.datetime
+    updated_at: dt.datetime
+
+
+class AuditLogOut(BaseModel):
+    id: uuid.UUID
+    actor: str
+    action: str
+    target_type: str
+    target_id: Optional[str]
+    message: str
+    created_at: dt.datetime
+
+
+class AuditPage(BaseModel):
+    items: List[AuditLogOut] = Field(default_factory=list)
+    next_cursor: Optional[str] = None
+
+
+class StatusSummary(BaseModel):
+    devices: Dict[str, Dict[str, int]] = Field(default_factory=dict)
+    workflows: Dict[str, Dict[str, int]] = Field(default_factory=dict)
+    since: dt.datetime
+    pending_deltas: int = 0
@@ -0,0 +1,20 @@
+from typing import List
+
+from sqlalchemy.sql.elements import ColumnElement
+
+from app import schemas
+from app.facts import fact_equals
+from app.models import Device
+
+
+def device_filters(selector: schemas.DeviceSelector) -> List[ColumnElement]:
+    clauses: List[ColumnElement] = []
+    if selector.os_type:
+        clauses.append(Device.os_type.in_(selector.os_type))
+    if selector.status:
+        clauses.append(Device.status.in_(selector.status))
+    if selector.arch:
+        clauses.append(Device.arch.in_(selector.arch))
+    for key, value in selector.facts.items():
+        clauses.append(fact_equals((key,), value))
+    return clauses
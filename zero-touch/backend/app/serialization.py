@@ -0,0 +1,95 @@
+import datetime as dt
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+from app import schemas
+from app.models import Device, WorkflowRun
+
+DEVICE_COLUMNS = (
+    Device.id,
+    Device.hostname,
+    Device.os_type,
+    Device.arch,
+    Device.status,
+    Device.blueprint_id,
+    Device.last_seen,
+    Device.facts,
+)
+WORKFLOW_COLUMNS = (
+    WorkflowRun.id,
+    WorkflowRun.device_id,
+    WorkflowRun.blueprint_id,
+    WorkflowRun.status,
+    WorkflowRun.started_at,
+    WorkflowRun.updated_at,
+    WorkflowRun.steps,
+    WorkflowRun.last_error,
+)
+STEP_DEFAULTS = {
+    name: None if field.is_required() else field.get_default(call_default_factory=True)
+    for name, field in schemas.WorkflowStep.model_fields.items()
+}
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, (dt.datetime, dt.date, dt.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(content: Any) -> bytes:
+    try:
+        return orjson.dumps(content, default=_default)
+    except orjson.JSONEncodeError:
+        return json.dumps(content, default=_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class RawJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return content if isinstance(content, bytes) else dumps(content)
+
+
+def device(row: Any, last_seen: Optional[Dict[Any, Any]] = None) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "hostname": row.hostname,
+        "os_type": row.os_type,
+        "arch": row.arch,
+        "status": row.status,
+        "blueprint_id": row.blueprint_id,
+        "last_seen": last_seen[row.id] if last_seen is not None else row.last_seen,
+        "facts": row.facts or {},
+    }
+
+
+def devices(rows: Iterable[Any], last_seen: Dict[Any, Any]) -> List[Dict[str, Any]]:
+    return [device(row, last_seen) for row in rows]
+
+
+def step(values: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: values.get(name, default) for name, default in STEP_DEFAULTS.items()}
+
+
+def workflow(row: Any, archived: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    body = archived or {"steps": row.steps, "last_error": row.last_error}
+    return {
+        "id": row.id,
+        "device_id": row.device_id,
+        "blueprint_id": row.blueprint_id,
+        "status": row.status,
+        "started_at": row.started_at,
+        "updated_at": row.updated_at,
+        "steps": [step(values) for values in body["steps"] or []],
+        "last_error": body["last_error"],
+        "archived": archived is not None,
+    }
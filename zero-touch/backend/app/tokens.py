@@ -0,0 +1,223 @@
+import datetime as dt
+import hashlib
+import hmac
+import logging
+import math
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+import redis
+from sqlmodel import Session, select
+
+from app.cache import get_async_redis, get_pubsub_redis, get_redis
+from app.config import get_settings
+from app.db import get_engine
+from app.metrics import TOKEN_FILTER_REJECTS
+from app.models import EnrollmentToken
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+HASH_LENGTH = 64
+ANNOUNCE_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('PUBLISH', ARGV[1], 'add:' .. ARGV[2] .. ':' .. seq)
+return seq
+"""
+
+
+def hash_token(token: str) -> str:
+    return hmac.new(settings.token_hash_key.encode(), token.encode(), hashlib.sha256).hexdigest()
+
+
+def device_token(device_id) -> str:
+    return hmac.new(settings.device_token_key.encode(), str(device_id).encode(), hashlib.sha256).hexdigest()
+
+
+def hash_plaintext_tokens(session: Session) -> int:
+    tokens = [
+        token
+        for token in session.exec(select(EnrollmentToken)).all()
+        if len(token.token_hash) != HASH_LENGTH
+    ]
+    for token in tokens:
+        token.token_hash = hash_token(token.token_hash)
+    session.commit()
+    return len(tokens)
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, fp_rate: float):
+        capacity = max(capacity, 1)
+        self.bits = max(int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.bits / capacity * math.log(2))), 1)
+        self.count = 0
+        self._data = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, digest: str) -> Iterable[int]:
+        first, second = int(digest[:16], 16), int(digest[16:32], 16) | 1
+        return ((first + i * second) % self.bits for i in range(self.hashes))
+
+    def add(self, digest: str) -> None:
+        for position in self._positions(digest):
+            self._data[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest: str) -> bool:
+        return all(self._data[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self._data)
+
+    def false_positive_rate(self) -> float:
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+
+class TokenFilter:
+    def __init__(self, capacity: int, fp_rate: float, channel: str, rebuild_interval: float):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.channel = channel
+        self.sequence_key = f"{channel}:seq"
+        self.rebuild_interval = rebuild_interval
+        self.ready = False
+        self.seq = 0
+        self.stale = False
+        self._filter = BloomFilter(capacity, fp_rate)
+        self._pending: Optional[List[Tuple[str, int]]] = None
+        self._unsent: List[str] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    async def _behind(self) -> bool:
+        client = get_async_redis()
+        if client is None:
+            return True
+        try:
+            latest = await client.get(self.sequence_key)
+        except redis.RedisError:
+            return True
+        return int(latest or 0) > self.seq
+
+    async def might_contain(self, digest: str) -> bool:
+        if not self.ready or digest in self._filter:
+            return True
+        if await self._behind():
+            self.stale = True
+            return True
+        TOKEN_FILTER_REJECTS.inc()
+        return False
+
+    def add(self, digest: str, seq: int = 0) -> None:
+        with self._lock:
+            self._filter.add(digest)
+            if self._pending is not None:
+                self._pending.append((digest, seq))
+            elif seq == self.seq + 1:
+                self.seq = seq
+
+    def rebuild(self, session: Session) -> BloomFilter:
+        with self._lock:
+            self._pending = []
+            self.stale = False
+        client = get_redis()
+        baseline = int(client.get(self.sequence_key) or 0) if client is not None else self.seq
+        now = dt.datetime.utcnow()
+        live = session.exec(select(EnrollmentToken.token_hash).where(EnrollmentToken.expires_at > now)).all()
+        fresh = BloomFilter(max(self.capacity, len(live)), self.fp_rate)
+        for digest in live:
+            fresh.add(digest)
+        with self._lock:
+            for digest, seq in self._pending:
+                fresh.add(digest)
+                if seq == baseline + 1:
+                    baseline = seq
+            self._pending = None
+            self._filter = fresh
+            self.seq = baseline
+        logger.info(
+            "token filter rebuilt: %s tokens, %s bytes, estimated false-positive rate %.2g",
+            fresh.count,
+            fresh.size_bytes,
+            fresh.false_positive_rate(),
+        )
+        return fresh
+
+    def stats(self) -> dict:
+        current = self._filter
+        return {
+            "ready": self.ready,
+            "entries": current.count,
+            "bytes": current.size_bytes,
+            "hashes": current.hashes,
+            "false_positive_rate": current.false_positive_rate(),
+            "target_false_positive_rate": self.fp_rate,
+        }
+
+    def _handle(self, data: bytes) -> bool:
+        action, _, rest = data.decode().partition(":")
+        if action == "add":
+            digest, _, seq = rest.partition(":")
+            self.add(digest, int(seq or 0))
+        return action == "rebuild"
+
+    def _listen(self, client) -> None:
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                due = 0.0
+                while True:
+                    self.announce()
+                    if self.stale or time.monotonic() >= due:
+                        with Session(get_engine()) as session:
+                            self.rebuild(session)
+                        self.ready = True
+                        due = time.monotonic() + self.rebuild_interval
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and self._handle(message["data"]):
+                        due = 0.0
+            except Exception:
+                logger.warning("token filter subscription lost; falling back to database lookups")
+            self.ready = False
+            time.sleep(1)
+
+    def start(self) -> None:
+        client = get_pubsub_redis()
+        if client is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._listen, args=(client,), daemon=True, name="token-filter")
+        self._thread.start()
+
+    def announce(self, digest: Optional[str] = None) -> None:
+        client = get_redis()
+        with self._lock:
+            if digest is not None and client is not None:
+                self._unsent.append(digest)
+            unsent, self._unsent = self._unsent, []
+        if not unsent:
+            return
+        script = client.register_script(ANNOUNCE_SCRIPT)
+        for position, pending in enumerate(unsent):
+            try:
+                script(keys=[self.sequence_key], args=[self.channel, pending])
+            except redis.RedisError:
+                logger.warning("could not publish token filter update; retrying")
+                with self._lock:
+                    self._unsent[:0] = unsent[position:]
+                return
+
+
+token_filter = TokenFilter(
+    settings.token_filter_capacity,
+    settings.token_filter_fp_rate,
+    settings.token_filter_channel,
+    settings.token_filter_rebuild,
+)
+
+
+def minted(digest: str) -> None:
+    token_filter.add(digest)
+    token_filter.announce(digest)
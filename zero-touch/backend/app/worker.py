@@ -1,66 +1,210 @@
 import datetime as dt
-import os
+import logging
 import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
 
 from celery import Celery
-from sqlmodel import select
+from sqlalchemy import update
+from sqlmodel import Session, select
 
+from app import audit, blueprint_cache, dag, events, groups, queues, retention, rollups
 from app.config import get_settings
-from app.db import engine, get_session
-from app.integrations import dispatch
-from app.models import AuditLog, Blueprint, Device, WorkflowRun
+from app.db import get_session
+from app.integrations import content_hash, diff, render, steps_for
+from app.models import Blueprint, Device, WorkflowRun
 
+logger = logging.getLogger(__name__)
 settings = get_settings()
 celery_app = Celery("zero_touch", broker=settings.broker_url)
+celery_app.conf.task_default_queue = queues.DEFAULT_QUEUE
+celery_app.conf.beat_schedule = {
+    "retention": {"task": "app.worker.run_retention", "schedule": settings.retention_interval},
+    "rollup-fold": {"task": "app.worker.fold_rollups", "schedule": settings.rollup_fold_interval},
+    "rollup-reconcile": {"task": "app.worker.reconcile_rollups", "schedule": settings.rollup_reconcile_interval},
+}
 
 
-def enqueue_workflow(workflow_id: uuid.UUID, dry_run: bool = False) -> None:
-    celery_app.send_task("app.worker.run_workflow", args=[str(workflow_id), dry_run])
+def _resumable(previous: List[Dict[str, Any]], blueprint_hash: str) -> Dict[str, Dict[str, Any]]:
+    fetched = next((step for step in previous if step.get("name") == "fetch_blueprint"), None)
+    if not fetched or (fetched.get("detail") or {}).get("content_hash") != blueprint_hash:
+        return {}
+    return {
+        step["name"]: {**step, "resumed": True}
+        for step in previous
+        if step.get("status") == "ok" and step.get("name") != "fetch_blueprint"
+    }
 
 
-@celery_app.task(name="app.worker.run_workflow")
-def run_workflow(workflow_id: str, dry_run: bool = False) -> None:
-    with get_session() as session:
-        run = session.get(WorkflowRun, workflow_id)
-        if not run:
-            return
-        device = session.get(Device, run.device_id)
-        blueprint = session.get(Blueprint, run.blueprint_id)
-        if not device or not blueprint:
-            run.status = "failed"
-            run.last_error = "missing device or blueprint"
-            session.commit()
-            return
-
-        steps = []
+def _execute(
+    device: Optional[Device],
+    blueprint: Optional[Blueprint],
+    dry_run: bool,
+    previous: Optional[List[Dict[str, Any]]] = None,
+) -> Tuple[Dict[str, Any], Optional[str]]:
+    if not device or not blueprint:
+        return {"status": "failed", "steps": [], "last_error": "missing device or blueprint"}, None
+
+    blueprint_hash = blueprint.content_hash or content_hash(blueprint.dict())
+    plan: List[Dict[str, Any]] = []
+
+    def fetch() -> Dict[str, Any]:
+        plan.extend(steps_for(device.os_type, blueprint))
+        return {"content_hash": blueprint_hash, "steps": [step["name"] for step in plan]}
+
+    steps = [dag.timed("fetch_blueprint", fetch)]
+    if steps[0]["status"] != "ok":
+        return {"status": "failed", "steps": steps, "last_error": steps[0]["detail"]}, "error"
+    facts = device.facts or {}
+    delta, unchanged = diff(plan, facts)
+    if dry_run:
+        steps.append(
+            dag.timed(
+                "plan",
+                lambda: {
+                    "steps": [{"name": step["name"], "actions": render(step["actions"], facts)} for step in delta],
+                    "unchanged": unchanged,
+                },
+            )
+        )
+        return {"status": "completed", "steps": steps, "last_error": None}, None
+
+    kept = {step["name"] for step in delta}
+    steps += [
+        {"name": step["name"], "status": "skipped", "detail": "unchanged", "after": step["after"], "skipped": unchanged[step["name"]]}
+        for step in plan
+        if step["name"] not in kept
+    ]
+    try:
+        records = dag.run_dag(
+            delta,
+            lambda step: render(step["actions"], facts),
+            completed=_resumable(previous or [], blueprint_hash),
+        )
+    except ValueError as exc:
+        steps.append({"name": "error", "status": "failed", "detail": str(exc)})
+        return {"status": "failed", "steps": steps, "last_error": str(exc)}, "error"
+    steps += [{**record, "skipped": unchanged[record["name"]]} if record["name"] in unchanged else record for record in records]
+    failed = next((step for step in steps if step["status"] == "failed"), None)
+    if failed:
+        return {"status": "failed", "steps": steps, "last_error": f"{failed['name']}: {failed['detail']}"}, "error"
+    return {"status": "completed", "steps": steps, "last_error": None}, "provisioned"
+
+
+def _claim(session: Session, *criteria, limit: Optional[int] = None) -> List[Any]:
+    query = (
+        select(
+            WorkflowRun.id,
+            WorkflowRun.device_id,
+            WorkflowRun.blueprint_id,
+            WorkflowRun.rollout_id,
+            WorkflowRun.dry_run,
+            WorkflowRun.steps,
+            WorkflowRun.started_at,
+        )
+        .where(WorkflowRun.status == "queued", *criteria)
+        .order_by(WorkflowRun.started_at)
+        .with_for_update(skip_locked=True)
+    )
+    if limit:
+        query = query.limit(limit)
+    return session.exec(query).all()
+
+
+def _process(session: Session, runs: List[Any], force_dry_run: bool = False) -> int:
+    if not runs:
+        return 0
+    devices = {
+        device.id: device
+        for device in session.exec(
+            select(Device).where(Device.id.in_({run.device_id for run in runs}))
+        )
+    }
+    blueprints = blueprint_cache.cache.get_many(session, {run.blueprint_id for run in runs})
+
+    now = dt.datetime.utcnow()
+    run_rows, device_rows, audit_rows, run_events = [], [], [], []
+    deltas: Counter = Counter()
+    statuses = {device.id: device.status for device in devices.values()}
+    for run in runs:
         try:
-            steps.append({"name": "fetch_blueprint", "status": "ok"})
-            if dry_run:
-                result_actions = ["dry-run no-op"]
-                steps.append({"name": "plan", "status": "ok", "detail": result_actions})
-                run.status = "completed"
-            else:
-                result = dispatch(device.os_type, blueprint.dict(), device.facts)
-                if not result.ok:
-                    raise RuntimeError(result.error or "provision failed")
-                steps.append({"name": "apply", "status": "ok", "detail": result.actions})
-                run.status = "completed"
-                device.status = "provisioned"
-        except Exception as exc:  # pragma: no cover - defensive
-            run.status = "failed"
-            run.last_error = str(exc)
-            steps.append({"name": "error", "status": "failed", "detail": str(exc)})
-            device.status = "error"
-
-        run.steps = steps
-        run.updated_at = dt.datetime.utcnow()
-        session.add(
-            AuditLog(
-                actor="worker",
-                action="workflow_update",
-                target_type="workflow",
-                target_id=str(run.id),
-                message=f"status={run.status}",
+            values, device_status = _execute(
+                devices.get(run.device_id),
+                blueprints.get(run.blueprint_id),
+                force_dry_run or run.dry_run,
+                run.steps,
             )
+        except Exception as exc:
+            logger.exception("workflow %s failed while planning", run.id)
+            values, device_status = {"status": "failed", "steps": [], "last_error": f"{type(exc).__name__}: {exc}"}, "error"
+        run_rows.append({"id": run.id, "updated_at": now, **values})
+        rollups.move(deltas, rollups.workflow_key(run.blueprint_id, run.started_at, "queued"), rollups.workflow_key(run.blueprint_id, run.started_at, values["status"]))
+        if device_status:
+            device_rows.append({"id": run.device_id, "status": device_status})
+            device = devices.get(run.device_id)
+            if device:
+                rollups.move(deltas, rollups.device_key(device.os_type, statuses[device.id]), rollups.device_key(device.os_type, device_status))
+                statuses[device.id] = device_status
+        run_events.append(
+            {
+                "type": "workflow",
+                "workflow_id": run.id,
+                "device_id": run.device_id,
+                "rollout_id": run.rollout_id,
+                "updated_at": now,
+                **values,
+            }
         )
-        session.commit()
+        audit_rows.append(
+            {
+                "actor": "worker",
+                "action": "workflow_update",
+                "target_type": "workflow",
+                "target_id": str(run.id),
+                "message": f"status={values['status']}",
+            }
+        )
+
+    session.execute(update(WorkflowRun), run_rows)
+    if device_rows:
+        session.execute(update(Device), device_rows)
+        groups.update_memberships(session, [row["id"] for row in device_rows], {"status"})
+    rollups.stage(session, deltas)
+    session.commit()
+    audit.record_many(audit_rows)
+    events.publish_many(run_events)
+    return len(runs)
+
+
+@celery_app.task(name="app.worker.run_workflow")
+def run_workflow(workflow_id: str, dry_run: bool = False) -> None:
+    with get_session() as session:
+        runs = _claim(session, WorkflowRun.id == uuid.UUID(workflow_id))
+        _process(session, runs, force_dry_run=dry_run)
+
+
+@celery_app.task(name="app.worker.run_workflow_batch")
+def run_workflow_batch(workflow_ids: Optional[List[str]] = None, limit: Optional[int] = None) -> int:
+    with get_session() as session:
+        if workflow_ids:
+            ids = [uuid.UUID(workflow_id) for workflow_id in workflow_ids]
+            runs = _claim(session, WorkflowRun.id.in_(ids))
+        else:
+            runs = _claim(session, limit=limit or settings.enqueue_batch_size)
+        return _process(session, runs)
+
+
+@celery_app.task(name="app.worker.run_retention")
+def run_retention() -> Dict[str, Any]:
+    return retention.run()
+
+
+@celery_app.task(name="app.worker.fold_rollups")
+def fold_rollups() -> int:
+    with get_session() as session:
+        return rollups.fold(session)
+
+
+@celery_app.task(name="app.worker.reconcile_rollups")
+def reconcile_rollups() -> Dict[str, Any]:
+    return rollups.run()
@@ -0,0 +1 @@
+# Benchmarks for the zero-touch backend
@@ -0,0 +1,103 @@
+"""Measure cold-start cost of the API and worker processes.
+
+Usage (from zero-touch/backend):
+
+    python -m bench.cold_start --runs 5 --top 15
+
+Each run starts a fresh interpreter. "import" is the time to import the
+entry module; "ready" adds app construction and, for the API, the startup
+hooks (schema check, pool pre-warm, background tasks), measured from
+process spawn so interpreter boot is included. The per-module table comes from
+`python -X importtime` and lists cumulative import time of the slowest
+top-level modules. Runs against DATABASE_URL when set, otherwise a
+throwaway SQLite file migrated up front.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.sqlite"
+os.environ.setdefault("BROKER_URL", "memory://")
+os.environ.setdefault("REDIS_URL", "")
+
+TARGETS = {
+    "api": (
+        "app.main",
+        "import asyncio, time\n"
+        "from app.main import app\n"
+        "async def ready():\n"
+        "    async with app.router.lifespan_context(app):\n"
+        "        print(time.time(), flush=True)\n"
+        "asyncio.run(ready())\n",
+    ),
+    "worker": (
+        "app.worker",
+        "import time\n"
+        "from app.worker import celery_app\n"
+        "celery_app.finalize()\n"
+        "celery_app.tasks['app.worker.run_workflow_batch']\n"
+        "print(time.time(), flush=True)\n",
+    ),
+}
+
+
+def timed(code: str) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True, env=os.environ)
+    return time.perf_counter() - started
+
+
+def time_to_ready(code: str) -> float:
+    started = time.time()
+    result = subprocess.run([sys.executable, "-c", code], check=True, env=os.environ, capture_output=True, text=True)
+    return float(result.stdout.split()[-1]) - started
+
+
+def import_times(module: str) -> Tuple[float, List[Tuple[str, float]]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        env=os.environ,
+        capture_output=True,
+        text=True,
+    )
+    total = 0.0
+    modules: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        if line.count("|") != 2:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        if name.strip() == module:
+            total = int(cumulative) / 1e6
+        elif name.startswith("   ") and not name.startswith("    "):
+            modules[name.strip()] = int(cumulative) / 1e6
+    return total, sorted(modules.items(), key=lambda item: item[1], reverse=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    subprocess.run([sys.executable, "-m", "app.migrate"], check=True, env=os.environ, capture_output=True)
+    for name, (module, ready_code) in TARGETS.items():
+        imports = [timed(f"import {module}") for _ in range(args.runs)]
+        ready = [time_to_ready(ready_code) for _ in range(args.runs)]
+        total, modules = import_times(module)
+        print(f"{name}: import {statistics.median(imports) * 1000:7.1f} ms  ready {statistics.median(ready) * 1000:7.1f} ms  (median of {args.runs}, incl. interpreter start)")
+        print(f"  {module} import tree: {total * 1000:7.1f} ms")
+        for top, seconds in modules[: args.top]:
+            print(f"    {top:<28} {seconds * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
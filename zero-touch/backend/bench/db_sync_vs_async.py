@@ -0,0 +1,94 @@
+"""Compare the sync and async request paths under concurrent load.
+
+Usage (from zero-touch/backend):
+
+    python -m bench.db_sync_vs_async --devices 500 --requests 2000 --concurrency 64
+
+Runs against DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.sqlite"
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlmodel import Session, select
+
+from app.config import get_settings
+from app.db import get_engine
+from app.main import create_app
+from app.migrate import migrate
+from app.models import Device
+
+
+def seed(count: int) -> None:
+    migrate()
+    with Session(get_engine()) as session:
+        session.add_all(
+            Device(hostname=f"bench-{i}", os_type="linux", arch="x86_64", facts={"i": i})
+            for i in range(count)
+        )
+        session.commit()
+
+
+def sync_app() -> FastAPI:
+    app = FastAPI()
+
+    def get_sync_session():
+        with Session(get_engine()) as session:
+            yield session
+
+    @app.get("/devices")
+    def list_devices(session=Depends(get_sync_session)):
+        return [d.model_dump() for d in session.exec(select(Device)).all()]
+
+    return app
+
+
+async def drive(app: FastAPI, total: int, concurrency: int) -> dict:
+    headers = {"X-API-Key": get_settings().api_key}
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def one() -> None:
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get("/devices", headers=headers)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    seed(args.devices)
+    for name, app in (("sync", sync_app()), ("async", create_app())):
+        result = asyncio.run(drive(app, args.requests, args.concurrency))
+        print(f"{name:>5}: {result}")
+
+
+if __name__ == "__main__":
+    main()
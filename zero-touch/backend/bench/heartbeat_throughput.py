@@ -0,0 +1,90 @@
+"""Measure sustained heartbeat intake and flush throughput.
+
+Usage (from zero-touch/backend):
+
+    python -m bench.heartbeat_throughput --devices 5000 --heartbeats 20000 --concurrency 128
+
+Uses the Redis buffer when REDIS_URL is set, otherwise the in-process
+buffer. Runs against DATABASE_URL or a throwaway SQLite file. Rate
+limits are off unless RATE_LIMIT_ENABLED is set, since every heartbeat
+comes from the same client address and would hit AGENT_LIMIT_PER_IP.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.sqlite"
+os.environ.setdefault("REDIS_URL", "")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import httpx
+from sqlmodel import Session
+
+from app import heartbeats
+from app.tokens import device_token
+from app.db import get_engine
+from app.main import create_app
+from app.migrate import migrate
+from app.models import Device
+
+
+def seed(count: int) -> list:
+    migrate()
+    devices = [
+        Device(hostname=f"hb-{i}", os_type="linux", arch="x86_64", facts={})
+        for i in range(count)
+    ]
+    with Session(get_engine()) as session:
+        session.add_all(devices)
+        session.commit()
+        return [device.id for device in devices]
+
+
+async def run(device_ids: list, total: int, concurrency: int) -> None:
+    app = create_app()
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def beat() -> None:
+            device_id = random.choice(device_ids)
+            async with semaphore:
+                response = await client.post(
+                    f"/devices/{device_id}/heartbeat",
+                    json={"facts": {"uptime": random.randint(0, 10**6)}},
+                    headers={"X-Device-Token": device_token(device_id)},
+                )
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(beat() for _ in range(total)))
+        intake = time.perf_counter() - started
+
+    started = time.perf_counter()
+    flushed = 0
+    while True:
+        count = await heartbeats.flush()
+        if not count:
+            break
+        flushed += count
+    flush_time = time.perf_counter() - started
+
+    print(f"intake: {total / intake:10.1f} heartbeats/s ({total} in {intake:.2f}s)")
+    print(f"flush:  {flushed / max(flush_time, 1e-9):10.1f} devices/s ({flushed} rows in {flush_time:.2f}s)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=5000)
+    parser.add_argument("--heartbeats", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=128)
+    args = parser.parse_args()
+    asyncio.run(run(seed(args.devices), args.heartbeats, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
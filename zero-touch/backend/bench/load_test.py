@@ -0,0 +1,288 @@
+"""Enrollment-storm load test for the API.
+
+Usage (from zero-touch/backend):
+
+    python -m bench.load_test --devices 2000 --concurrency 64 --duration 30
+    python -m bench.load_test --base-url http://localhost:8000 --api-key changeme-api-key
+    python -m bench.load_test --output after.json --compare before.json
+
+Runs three phases: token minting, a burst of /enrollment/register calls, and
+a mixed phase of device listing, workflow starts and workflow status polls.
+Without --base-url the app runs in-process against a throwaway SQLite file
+and the in-memory broker, so no services are needed. Reports throughput,
+p50/p95/p99 latency and error rate per endpoint and writes them as JSON.
+Requests rejected with 429 by rate limiting are counted separately from
+errors; set RATE_LIMIT_ENABLED=false to measure raw capacity.
+"""
+import argparse
+import asyncio
+import datetime as dt
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.sqlite"
+os.environ.setdefault("BROKER_URL", "memory://")
+os.environ.setdefault("REDIS_URL", "")
+os.environ.setdefault("AUTO_MIGRATE", "true")
+
+import httpx
+
+OS_TYPES = [("windows", "x86_64"), ("linux", "x86_64"), ("linux", "arm64"), ("macos", "arm64")]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.throttled: Dict[str, int] = {}
+        self.started = time.perf_counter()
+
+    async def call(self, name: str, request: Awaitable[httpx.Response]) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            response = None
+        self.samples.setdefault(name, []).append(time.perf_counter() - started)
+        if response is not None and response.status_code == 429:
+            self.throttled[name] = self.throttled.get(name, 0) + 1
+            return None
+        if response is None or response.status_code >= 400:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            return None
+        return response
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        elapsed = time.perf_counter() - self.started
+        report = {}
+        for name, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            errors = self.errors.get(name, 0)
+            report[name] = {
+                "requests": len(ordered),
+                "errors": errors,
+                "error_rate": round(errors / len(ordered), 4),
+                "throttled": self.throttled.get(name, 0),
+                "throughput_rps": round(len(ordered) / elapsed, 1),
+                "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2),
+            }
+        return report
+
+
+async def closed_loop(concurrency: int, work: Callable[[], Awaitable[None]], total: Optional[int] = None, duration: Optional[float] = None) -> None:
+    remaining = [total] if total is not None else None
+    deadline = time.perf_counter() + duration if duration is not None else None
+
+    async def worker() -> None:
+        while True:
+            if remaining is not None:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            await work()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+@asynccontextmanager
+async def client_for(args: argparse.Namespace) -> AsyncIterator[httpx.AsyncClient]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+            yield client
+        return
+
+    from app.main import create_app
+
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+            yield client
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    headers = {"X-API-Key": args.api_key}
+    phases: Dict[str, Dict[str, Any]] = {}
+    async with client_for(args) as client:
+        blueprint = await client.post(
+            "/blueprints",
+            json={"name": f"load-{time.time_ns()}", "packages": {"apt": ["curl"], "choco": ["git"]}},
+            headers=headers,
+        )
+        blueprint.raise_for_status()
+        blueprint_id = blueprint.json()["id"]
+
+        recorder = Recorder()
+        tokens: List[str] = []
+        uses = -(-args.devices // args.tokens)
+
+        async def mint() -> None:
+            response = await recorder.call(
+                "POST /enrollment/tokens",
+                client.post("/enrollment/tokens", json={"ttl_minutes": 60, "max_uses": min(uses, 1000)}, headers=headers),
+            )
+            if response is not None:
+                tokens.append(response.json()["token"])
+
+        await closed_loop(min(args.concurrency, args.tokens), mint, total=args.tokens)
+        phases["mint"] = recorder.summary()
+        if not tokens:
+            raise SystemExit("no enrollment tokens could be created")
+
+        recorder = Recorder()
+        device_ids: List[str] = []
+        counter = iter(range(args.devices))
+
+        async def register() -> None:
+            index = next(counter)
+            os_type, arch = random.choice(OS_TYPES)
+            response = await recorder.call(
+                "POST /enrollment/register",
+                client.post(
+                    "/enrollment/register",
+                    json={
+                        "token": tokens[index % len(tokens)],
+                        "hostname": f"load-{index}",
+                        "os_type": os_type,
+                        "arch": arch,
+                        "facts": {"serial": f"SN{index:08d}", "model": random.choice(["A", "B", "C"])},
+                    },
+                ),
+            )
+            if response is not None:
+                device_ids.append(response.json()["id"])
+
+        await closed_loop(args.concurrency, register, total=args.devices)
+        phases["register"] = recorder.summary()
+        if not device_ids:
+            raise SystemExit("no devices registered")
+
+        recorder = Recorder()
+        workflow_ids: List[str] = []
+
+        async def list_devices() -> None:
+            await recorder.call("GET /devices", client.get("/devices", headers=headers))
+
+        async def start_workflow() -> None:
+            response = await recorder.call(
+                "POST /workflows/devices/{id}",
+                client.post(
+                    f"/workflows/devices/{random.choice(device_ids)}",
+                    json={"blueprint_id": blueprint_id},
+                    headers=headers,
+                ),
+            )
+            if response is not None:
+                workflow_ids.append(response.json()["id"])
+
+        async def poll_workflow() -> None:
+            if not workflow_ids:
+                return await start_workflow()
+            await recorder.call(
+                "GET /workflows/{id}",
+                client.get(f"/workflows/{random.choice(workflow_ids)}", headers=headers),
+            )
+
+        actions = [list_devices, start_workflow, poll_workflow]
+        weights = [args.list_weight, args.start_weight, args.poll_weight]
+
+        async def mixed() -> None:
+            await random.choices(actions, weights)[0]()
+
+        await closed_loop(args.concurrency, mixed, duration=args.duration)
+        phases["mixed"] = recorder.summary()
+    return phases
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(phases: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Any]]) -> None:
+    header = f"{'phase':<9}{'endpoint':<30}{'reqs':>7}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'err%':>7}{'429s':>7}"
+    print(header)
+    print("-" * len(header))
+    for phase, endpoints in phases.items():
+        for name, stats in endpoints.items():
+            line = (
+                f"{phase:<9}{name:<30}{stats['requests']:>7}{stats['throughput_rps']:>9.1f}"
+                f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+                f"{stats['error_rate'] * 100:>7.2f}{stats.get('throttled', 0):>7}"
+            )
+            before = (baseline or {}).get("phases", {}).get(phase, {}).get(name)
+            if before:
+                line += (
+                    f"   rps {stats['throughput_rps'] - before['throughput_rps']:+.1f}"
+                    f"  p99 {stats['p99_ms'] - before['p99_ms']:+.1f}ms"
+                )
+            print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", help="target a running API instead of an in-process app")
+    parser.add_argument("--api-key", default=os.getenv("API_KEY", "changeme-api-key"))
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds of mixed traffic")
+    parser.add_argument("--list-weight", type=float, default=1)
+    parser.add_argument("--start-weight", type=float, default=3)
+    parser.add_argument("--poll-weight", type=float, default=6)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="JSON results path (default: load-<commit>.json)")
+    parser.add_argument("--compare", default=None, help="baseline JSON to diff against")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    commit = git_commit()
+    phases = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as handle:
+            baseline = json.load(handle)
+    print_report(phases, baseline)
+
+    result = {
+        "commit": commit,
+        "created_at": dt.datetime.utcnow().isoformat(),
+        "mode": "http" if args.base_url else "in-process",
+        "python": platform.python_version(),
+        "args": {key: value for key, value in vars(args).items() if key not in ("api_key", "compare", "output")},
+        "phases": phases,
+    }
+    output = args.output or f"load-{commit}.json"
+    with open(output, "w", encoding="utf-8") as handle:
+        json.dump(result, handle, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
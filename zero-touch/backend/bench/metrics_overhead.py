@@ -0,0 +1,68 @@
+"""Measure per-request overhead of the metrics middleware.
+
+Usage (from zero-touch/backend):
+
+    python -m bench.metrics_overhead --requests 5000 --rounds 10
+
+Alternates between an uninstrumented and an instrumented app and keeps the
+best round of each, so warm-up and scheduler noise do not skew the delta.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.sqlite"
+
+import httpx
+
+from app.config import get_settings
+from app.main import create_app
+
+
+async def timed(client: httpx.AsyncClient, total: int) -> float:
+    started = time.perf_counter()
+    for _ in range(total):
+        await client.get("/healthz")
+    return (time.perf_counter() - started) / total
+
+
+async def compare(baseline_app, instrumented_app, total: int, rounds: int) -> tuple[float, float]:
+    clients = [
+        httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+        for app in (baseline_app, instrumented_app)
+    ]
+    best = [float("inf"), float("inf")]
+    for client in clients:
+        await timed(client, 200)
+    for _ in range(rounds):
+        for index, client in enumerate(clients):
+            best[index] = min(best[index], await timed(client, total // rounds))
+    for client in clients:
+        await client.aclose()
+    return best[0], best[1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    settings = get_settings()
+    settings.metrics_enabled = False
+    baseline_app = create_app()
+    settings.metrics_enabled = True
+    instrumented_app = create_app()
+    baseline, instrumented = asyncio.run(
+        compare(baseline_app, instrumented_app, args.requests, args.rounds)
+    )
+    print(f"baseline:     {baseline * 1e6:8.1f} us/request")
+    print(f"instrumented: {instrumented * 1e6:8.1f} us/request")
+    print(f"overhead:     {(instrumented - baseline) * 1e6:8.1f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Compare per-row cost of pydantic and raw JSON response serialization.
+
+Usage (from zero-touch/backend):
+
+    python -m bench.serialization --rows 5000 --rounds 10
+
+The pydantic path builds DeviceOut/WorkflowOut objects per row, then has
+FastAPI validate and encode the response model as it would for a
+response_model endpoint. The raw path turns the same rows into dicts and
+encodes them with orjson. Keeps the best round of each.
+"""
+import argparse
+import asyncio
+import datetime as dt
+import os
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Callable, List
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.sqlite"
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from app import schemas, serialization
+
+DEVICE_FIELD = create_model_field("devices", List[schemas.DeviceOut], mode="serialization")
+WORKFLOW_FIELD = create_model_field("workflows", List[schemas.WorkflowOut], mode="serialization")
+
+
+def device_rows(count: int) -> List[SimpleNamespace]:
+    now = dt.datetime.utcnow()
+    return [
+        SimpleNamespace(
+            id=uuid.uuid4(),
+            hostname=f"bench-{i}",
+            os_type="linux",
+            arch="x86_64",
+            status="enrolled",
+            blueprint_id=uuid.uuid4(),
+            last_seen=now,
+            facts={"serial": f"SN{i:08d}", "model": "t14", "ip": f"10.0.{i // 256 % 256}.{i % 256}", "cpus": 8},
+        )
+        for i in range(count)
+    ]
+
+
+def workflow_rows(count: int) -> List[SimpleNamespace]:
+    now = dt.datetime.utcnow()
+    steps = [
+        {"name": name, "status": "ok", "detail": None, "after": [], "started_at": now.isoformat(), "finished_at": now.isoformat(), "duration_ms": 1.5}
+        for name in ("fetch_blueprint", "packages", "files", "users")
+    ]
+    return [
+        SimpleNamespace(
+            id=uuid.uuid4(),
+            device_id=uuid.uuid4(),
+            blueprint_id=uuid.uuid4(),
+            status="completed",
+            started_at=now,
+            updated_at=now,
+            steps=steps,
+            last_error=None,
+        )
+        for _ in range(count)
+    ]
+
+
+def pydantic_devices(rows) -> bytes:
+    content = [
+        schemas.DeviceOut(
+            id=d.id,
+            hostname=d.hostname,
+            os_type=d.os_type,
+            arch=d.arch,
+            status=d.status,
+            blueprint_id=d.blueprint_id,
+            last_seen=d.last_seen,
+            facts=d.facts,
+        )
+        for d in rows
+    ]
+    return _encode(DEVICE_FIELD, content)
+
+
+def pydantic_workflows(rows) -> bytes:
+    content = [
+        schemas.WorkflowOut(
+            id=run.id,
+            device_id=run.device_id,
+            blueprint_id=run.blueprint_id,
+            status=run.status,
+            started_at=run.started_at,
+            updated_at=run.updated_at,
+            steps=[schemas.WorkflowStep(**step) for step in run.steps],
+            last_error=run.last_error,
+        )
+        for run in rows
+    ]
+    return _encode(WORKFLOW_FIELD, content)
+
+
+def raw_devices(rows) -> bytes:
+    return serialization.RawJSONResponse(serialization.devices(rows, {d.id: d.last_seen for d in rows})).body
+
+
+def raw_workflows(rows) -> bytes:
+    return serialization.RawJSONResponse([serialization.workflow(run) for run in rows]).body
+
+
+def _encode(field, content) -> bytes:
+    body = asyncio.run(serialize_response(field=field, response_content=content, is_coroutine=True))
+    return JSONResponse(body).body
+
+
+def best(fn: Callable, rows, rounds: int) -> float:
+    fastest = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn(rows)
+        fastest = min(fastest, time.perf_counter() - started)
+    return fastest / len(rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    for label, rows, before, after in (
+        ("devices", device_rows(args.rows), pydantic_devices, raw_devices),
+        ("workflows", workflow_rows(args.rows), pydantic_workflows, raw_workflows),
+    ):
+        slow, fast = best(before, rows, args.rounds), best(after, rows, args.rounds)
+        print(f"{label:<10} pydantic: {slow * 1e6:7.2f} us/row  raw: {fast * 1e6:7.2f} us/row  speedup: {slow / fast:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp()
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{_tmp}/test.sqlite",
+    BLOB_ROOT=f"{_tmp}/blobs",
+    BROKER_URL="memory://",
+    REDIS_URL="",
+    RATE_LIMIT_ENABLED="false",
+    AUTO_MIGRATE="true",
+    API_KEY="test-api-key",
+)
+
+import httpx
+import pytest
+
+from app.main import create_app
+
+API_HEADERS = {"X-API-Key": "test-api-key"}
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def client():
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            yield http
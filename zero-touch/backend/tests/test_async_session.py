@@ -0,0 +1,36 @@
+import uuid
+
+import pytest
+from sqlalchemy import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db import get_async_session
+from tests.conftest import API_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_get_async_session_runs_on_aiosqlite(client):
+    sessions = get_async_session()
+    session = await sessions.__anext__()
+    try:
+        assert isinstance(session, AsyncSession)
+        assert session.bind.dialect.driver == "aiosqlite"
+        assert (await session.execute(text("SELECT 1"))).scalar_one() == 1
+    finally:
+        await sessions.aclose()
+
+
+async def test_register_then_get_device(client):
+    token = (await client.post("/enrollment/tokens", json={"ttl_minutes": 5, "max_uses": 1}, headers=API_HEADERS)).json()["token"]
+    registered = await client.post(
+        "/enrollment/register",
+        json={"token": token, "hostname": "host-1", "os_type": "linux", "arch": "x86_64", "facts": {"serial": str(uuid.uuid4())}},
+    )
+    assert registered.status_code == 200
+    device_id = registered.json()["id"]
+
+    fetched = await client.get(f"/devices/{device_id}", headers=API_HEADERS)
+    assert fetched.status_code == 200
+    assert fetched.json()["hostname"] == "host-1"
+    assert fetched.json()["status"] == "enrolled"
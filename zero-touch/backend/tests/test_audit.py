@@ -0,0 +1,61 @@
+import datetime as dt
+import os
+import tempfile
+
+import pytest
+from sqlmodel import select
+
+from app.audit import AuditWriter
+from app.db import get_session
+from app.migrate import migrate
+from app.models import AuditLog, time_ordered_uuid
+from tests.conftest import API_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+def _rows(target_type, count, created_at):
+    return [
+        {"id": time_ordered_uuid(), "created_at": created_at, "actor": "test", "action": str(i), "target_type": target_type, "target_id": None, "message": ""}
+        for i in range(count)
+    ]
+
+
+async def test_cursor_pages_through_ties_on_created_at(client):
+    tied = dt.datetime(2024, 5, 1, 12, 0, 0)
+    with get_session() as session:
+        session.add_all(AuditLog(**row) for row in _rows("cursor-test", 5, tied) + _rows("cursor-test", 2, tied - dt.timedelta(seconds=1)))
+        session.commit()
+
+    seen, cursor = [], None
+    while True:
+        params = {"target_type": "cursor-test", "limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = (await client.get("/audit", params=params, headers=API_HEADERS)).json()
+        seen += page["items"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    keys = [(entry["created_at"], entry["id"]) for entry in seen]
+    assert len(keys) == len(set(keys)) == 7
+    assert keys == sorted(keys, reverse=True)
+
+
+async def test_invalid_cursor_is_rejected(client):
+    response = await client.get("/audit", params={"cursor": "not-a-cursor"}, headers=API_HEADERS)
+    assert response.status_code == 400
+
+
+def test_writer_flushes_on_close_and_replays_spooled_rows():
+    migrate()
+    spool = os.path.join(tempfile.mkdtemp(), "audit.spool")
+    writer = AuditWriter(max_queue=100, batch_size=2, flush_interval=0.05, spool_path=spool)
+    writer.record_many([{"actor": "test", "action": str(i), "target_type": "writer-test"} for i in range(3)])
+    writer.close()
+    writer._spool(_rows("spool-test", 3, dt.datetime.utcnow()))
+
+    assert writer.replay() == 3
+    assert not os.path.exists(spool)
+    with get_session() as session:
+        assert len(session.exec(select(AuditLog).where(AuditLog.target_type == "writer-test")).all()) == 3
+        assert len(session.exec(select(AuditLog).where(AuditLog.target_type == "spool-test")).all()) == 3
@@ -0,0 +1,38 @@
+import json
+import uuid
+
+import pytest
+
+from app import blobs, tokens
+from tests.conftest import API_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+def test_externalize_stores_structured_files_as_json():
+    refs = blobs.externalize({"/etc/app.json": {"a": 1}, "/etc/motd": "hello ✓", "/bin/tool": b"\x00\x01"})
+    store = blobs.get_store()
+
+    def read(path):
+        with store.open(refs[path]["sha256"]) as handle:
+            return handle.read()
+
+    assert json.loads(read("/etc/app.json")) == {"a": 1}
+    assert read("/etc/motd") == "hello ✓".encode()
+    assert read("/bin/tool") == b"\x00\x01"
+
+
+async def test_blob_download_requires_credentials(client):
+    uploaded = await client.post("/blobs", content=b"secret config", headers=API_HEADERS)
+    assert uploaded.status_code == 201
+    url = f"/blobs/{uploaded.json()['sha256']}"
+    device_id = uuid.uuid4()
+
+    assert (await client.get(url)).status_code == 401
+    assert (await client.get(url, params={"device_id": str(device_id)})).status_code == 401
+    assert (await client.get(url, params={"device_id": str(device_id)}, headers={"X-Device-Token": "0" * 64})).status_code == 401
+    by_device = await client.get(url, params={"device_id": str(device_id)}, headers={"X-Device-Token": tokens.device_token(device_id)})
+    by_key = await client.get(url, headers=API_HEADERS)
+
+    assert by_device.status_code == 200 and by_device.content == b"secret config"
+    assert by_key.status_code == 200 and by_key.content == b"secret config"
@@ -0,0 +1,51 @@
+from sqlmodel import Session
+
+from app.blueprint_cache import BlueprintCache
+from app.db import get_engine
+from app.migrate import migrate
+from app.models import Blueprint
+
+
+def _blueprint() -> Blueprint:
+    migrate()
+    with Session(get_engine()) as session:
+        blueprint = Blueprint(name="cached", os_targets=["linux"], packages={"apt": ["vim"]})
+        session.add(blueprint)
+        session.commit()
+        session.refresh(blueprint)
+        return blueprint
+
+
+def test_local_entries_are_trusted_without_pubsub():
+    blueprint = _blueprint()
+    cache = BlueprintCache(16, ttl=300, verify_after=60, channel="test")
+    with Session(get_engine()) as session:
+        first = cache.get(session, blueprint.id)
+        second = cache.get(session, blueprint.id)
+
+    assert cache.counts == {"hit": 1, "verified": 0, "stale": 0, "miss": 1}
+    assert second is first
+    assert cache.hit_ratio() == 0.5
+
+
+def test_verified_lookups_are_not_counted_as_hits():
+    blueprint = _blueprint()
+    cache = BlueprintCache(16, ttl=300, verify_after=0, channel="test")
+    with Session(get_engine()) as session:
+        cache.get(session, blueprint.id)
+        cache.get(session, blueprint.id)
+
+    assert cache.counts["verified"] == 1
+    assert cache.hit_ratio() == 0.0
+    assert cache.verified_ratio() == 0.5
+
+
+def test_invalidate_drops_local_entry():
+    blueprint = _blueprint()
+    cache = BlueprintCache(16, ttl=300, verify_after=60, channel="test")
+    with Session(get_engine()) as session:
+        cache.get(session, blueprint.id)
+        cache.invalidate([blueprint.id])
+        cache.get(session, blueprint.id)
+
+    assert cache.counts["miss"] == 2
@@ -0,0 +1,137 @@
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from app import dag, worker
+from app.db import get_session
+from app.models import WorkflowRun
+from tests.conftest import API_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+def _names(records):
+    return [record["name"] for record in records]
+
+
+def test_topological_order_puts_dependencies_first():
+    steps = [{"name": "users", "after": ["packages", "files"]}, {"name": "files", "after": ["packages"]}, {"name": "packages"}]
+    assert _names(dag.topological_order(steps)) == ["packages", "files", "users"]
+
+
+@pytest.mark.parametrize(
+    "steps, message",
+    [
+        ([{"name": "a"}, {"name": "a"}], "duplicate step names"),
+        ([{"name": "a", "after": ["b"]}, {"name": "b", "after": ["a"]}], "dependency cycle"),
+        ([{"name": "a", "after": ["missing"]}], "unknown step dependency missing"),
+    ],
+)
+def test_topological_order_rejects_invalid_graphs(steps, message):
+    with pytest.raises(ValueError, match=message):
+        dag.topological_order(steps)
+
+
+def test_run_dag_skips_dependents_of_a_failed_step():
+    def execute(step):
+        if step["name"] == "packages":
+            raise RuntimeError("apt unavailable")
+        return step["name"]
+
+    steps = [{"name": "packages"}, {"name": "files"}, {"name": "users", "after": ["packages"]}, {"name": "security", "after": ["users"]}]
+    records = {record["name"]: record for record in dag.run_dag(steps, execute, concurrency=2)}
+
+    assert records["packages"]["status"] == "failed"
+    assert records["packages"]["detail"] == "apt unavailable"
+    assert records["files"]["status"] == "ok"
+    assert records["users"] == {"name": "users", "status": "skipped", "detail": "dependency failed", "after": ["packages"]}
+    assert records["security"]["status"] == "skipped"
+
+
+def test_run_dag_reuses_completed_records_without_executing_them():
+    executed = []
+    completed = {"packages": {"name": "packages", "status": "ok", "detail": "cached", "after": []}}
+    steps = [{"name": "packages"}, {"name": "files", "after": ["packages"]}]
+
+    records = dag.run_dag(steps, lambda step: executed.append(step["name"]), completed=completed)
+
+    assert executed == ["files"]
+    assert records[0] is completed["packages"]
+    assert records[1]["status"] == "ok"
+
+
+def test_resumable_requires_the_same_blueprint_hash():
+    previous = [
+        {"name": "fetch_blueprint", "status": "ok", "detail": {"content_hash": "abc"}},
+        {"name": "packages", "status": "ok", "detail": []},
+        {"name": "files", "status": "failed", "detail": "disk full"},
+    ]
+
+    assert worker._resumable(previous, "abc") == {"packages": {**previous[1], "resumed": True}}
+    assert worker._resumable(previous, "changed") == {}
+    assert worker._resumable([], "abc") == {}
+
+
+def test_execute_reports_dependency_cycles_as_failures(monkeypatch):
+    monkeypatch.setattr(worker, "steps_for", lambda os_type, blueprint: [{"name": "a", "actions": [], "after": ["a"]}])
+    device = SimpleNamespace(os_type="linux", facts={})
+    blueprint = SimpleNamespace(content_hash="abc")
+
+    values, device_status = worker._execute(device, blueprint, False)
+
+    assert values["status"] == "failed"
+    assert "dependency cycle" in values["last_error"]
+    assert device_status == "error"
+
+
+async def test_resume_skips_steps_that_already_succeeded(client, monkeypatch):
+    executed, failing = [], {"files"}
+    real_render = worker.render
+
+    def render(actions, facts):
+        name = "files" if "/etc/motd" in actions[0] else "packages"
+        executed.append(name)
+        if name in failing:
+            raise OSError("disk full")
+        return real_render(actions, facts)
+
+    monkeypatch.setattr(worker, "render", render)
+    blueprint = (
+        await client.post(
+            "/blueprints",
+            json={"name": "resume", "os_targets": ["linux"], "packages": {"apt": ["vim"]}, "files": {"/etc/motd": "hi"}},
+            headers=API_HEADERS,
+        )
+    ).json()
+    token = (await client.post("/enrollment/tokens", json={"ttl_minutes": 5, "max_uses": 1}, headers=API_HEADERS)).json()["token"]
+    device = (
+        await client.post(
+            "/enrollment/register",
+            json={"token": token, "hostname": "dag-resume", "os_type": "linux", "arch": "x86_64", "hardware_id": "dag-resume", "facts": {}},
+        )
+    ).json()
+    run_id = (await client.post(f"/workflows/devices/{device['id']}", json={"blueprint_id": blueprint["id"]}, headers=API_HEADERS)).json()["id"]
+
+    assert (await client.post(f"/workflows/{run_id}/resume", headers=API_HEADERS)).status_code == 409
+
+    worker.run_workflow_batch([run_id])
+    with get_session() as session:
+        failed = session.get(WorkflowRun, uuid.UUID(run_id))
+        assert failed.status == "failed"
+        assert failed.last_error == "files: disk full"
+    assert sorted(executed) == ["files", "packages"]
+
+    resumed = await client.post(f"/workflows/{run_id}/resume", headers=API_HEADERS)
+    assert resumed.status_code == 200
+    assert resumed.json()["status"] == "queued"
+
+    failing.clear()
+    executed.clear()
+    worker.run_workflow_batch([run_id])
+    with get_session() as session:
+        steps = {step["name"]: step for step in session.get(WorkflowRun, uuid.UUID(run_id)).steps}
+        assert session.get(WorkflowRun, uuid.UUID(run_id)).status == "completed"
+    assert executed == ["files"]
+    assert steps["packages"]["resumed"] is True
+    assert steps["files"]["status"] == "ok" and "resumed" not in steps["files"]
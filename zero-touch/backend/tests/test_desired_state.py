@@ -0,0 +1,61 @@
+import uuid
+
+import pytest
+
+from app import desired_state
+
+pytestmark = pytest.mark.anyio
+
+
+class AsyncRedis:
+    def __init__(self):
+        self.values = {}
+        self.expiry = {}
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value.encode()
+        self.expiry[key] = ex
+
+    async def get(self, key):
+        return self.values.get(key)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = AsyncRedis()
+    monkeypatch.setattr(desired_state, "get_async_redis", lambda: client)
+    return client
+
+
+async def test_shared_keys_expire(fake_redis, monkeypatch):
+    monkeypatch.setattr(desired_state.settings, "desired_state_ttl", 120)
+    device_id, blueprint_id = uuid.uuid4(), uuid.uuid4()
+
+    await desired_state.remember_assignment(device_id, blueprint_id, "linux", {"packages": ["vim"]})
+    await desired_state.remember_blueprint(blueprint_id, "abc")
+
+    assert fake_redis.expiry == {
+        desired_state.ASSIGNMENT_KEY.format(device_id): 120,
+        desired_state.BLUEPRINT_HASH_KEY.format(blueprint_id): 120,
+    }
+
+
+async def test_cached_etag_reads_through_to_redis(fake_redis):
+    device_id, blueprint_id = uuid.uuid4(), uuid.uuid4()
+    await desired_state.remember_assignment(device_id, blueprint_id, "linux")
+    await desired_state.remember_blueprint(blueprint_id, "abc")
+    expected = await desired_state.cached_etag(device_id)
+
+    desired_state._assignments.delete(device_id)
+    desired_state._blueprint_hashes.delete(blueprint_id)
+
+    assert await desired_state.cached_etag(device_id) == expected
+    fake_redis.values.clear()
+    desired_state._assignments.delete(device_id)
+    assert await desired_state.cached_etag(device_id) is None
+
+
+def test_local_entries_expire_without_redis():
+    assert desired_state.get_redis() is None
+    assert desired_state._assignments.ttl == desired_state.settings.desired_state_ttl
+    assert desired_state._blueprint_hashes.ttl == desired_state.settings.desired_state_ttl
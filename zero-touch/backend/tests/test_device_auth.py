@@ -0,0 +1,63 @@
+import pytest
+
+from tests.conftest import API_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+async def _enroll(client, hostname):
+    token = (await client.post("/enrollment/tokens", json={"ttl_minutes": 5, "max_uses": 1}, headers=API_HEADERS)).json()["token"]
+    registered = await client.post(
+        "/enrollment/register",
+        json={"token": token, "hostname": hostname, "os_type": "linux", "arch": "x86_64", "hardware_id": hostname},
+        headers={"Idempotency-Key": f"{hostname}-key"},
+    )
+    return registered.json()
+
+
+async def test_plan_requires_device_token(client):
+    device = await _enroll(client, "auth-plan")
+    url = f"/devices/{device['id']}/plan"
+
+    assert (await client.get(url)).status_code == 401
+    assert (await client.get(url, headers={"X-Device-Token": "0" * 64})).status_code == 401
+    assert (await client.get(url, headers={"X-Device-Token": device["device_token"]})).status_code == 200
+    assert (await client.get(url, headers=API_HEADERS)).status_code == 200
+
+
+async def test_device_token_is_not_valid_for_other_devices(client):
+    first = await _enroll(client, "auth-first")
+    second = await _enroll(client, "auth-second")
+
+    response = await client.get(f"/devices/{second['id']}/plan", headers={"X-Device-Token": first["device_token"]})
+    assert response.status_code == 401
+
+
+async def test_replayed_registration_returns_device_token(client):
+    token = (await client.post("/enrollment/tokens", json={"ttl_minutes": 5, "max_uses": 1}, headers=API_HEADERS)).json()["token"]
+    request = {"token": token, "hostname": "auth-replay", "os_type": "linux", "arch": "x86_64", "hardware_id": "auth-replay"}
+    first = await client.post("/enrollment/register", json=request, headers={"Idempotency-Key": "replay-key"})
+    replayed = await client.post("/enrollment/register", json=request, headers={"Idempotency-Key": "replay-key"})
+
+    assert replayed.headers["Idempotent-Replayed"] == "true"
+    assert replayed.json()["device_token"] == first.json()["device_token"]
+
+
+async def test_reenrollment_needs_a_usable_token_or_the_device_token(client):
+    victim = await _enroll(client, "auth-victim")
+    spent = (await client.post("/enrollment/tokens", json={"ttl_minutes": 5, "max_uses": 1}, headers=API_HEADERS)).json()["token"]
+    await client.post(
+        "/enrollment/register",
+        json={"token": spent, "hostname": "auth-other", "os_type": "linux", "arch": "x86_64", "hardware_id": "auth-other"},
+    )
+    takeover = {"token": spent, "hostname": "evil", "os_type": "linux", "arch": "x86_64", "hardware_id": "auth-victim"}
+
+    rejected = await client.post("/enrollment/register", json=takeover)
+    forged = await client.post("/enrollment/register", json=takeover, headers={"X-Device-Token": "0" * 64})
+    assert rejected.status_code == 400 and "device_token" not in rejected.json()
+    assert forged.status_code == 400
+
+    fresh = (await client.post("/enrollment/tokens", json={"ttl_minutes": 5, "max_uses": 1}, headers=API_HEADERS)).json()["token"]
+    reimaged = await client.post("/enrollment/register", json={**takeover, "token": fresh, "hostname": "auth-victim"})
+    assert reimaged.status_code == 200
+    assert reimaged.json()["id"] == victim["id"]
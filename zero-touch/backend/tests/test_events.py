@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.concurrency import run_in_threadpool
+
+from app import events, worker
+from tests.conftest import API_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+def _parse(body):
+    return [
+        (frame.split("\n")[0].removeprefix("event: "), json.loads(frame.split("\n")[1].removeprefix("data: ")))
+        for frame in body.strip().split("\n\n")
+        if frame.startswith("event:")
+    ]
+
+
+async def _queued_run(client, hostname):
+    blueprint = (await client.post("/blueprints", json={"name": hostname, "os_targets": ["linux"], "packages": {"apt": ["vim"]}}, headers=API_HEADERS)).json()
+    token = (await client.post("/enrollment/tokens", json={"ttl_minutes": 5, "max_uses": 1}, headers=API_HEADERS)).json()["token"]
+    device = (
+        await client.post(
+            "/enrollment/register",
+            json={"token": token, "hostname": hostname, "os_type": "linux", "arch": "x86_64", "hardware_id": hostname, "facts": {}},
+        )
+    ).json()
+    started = await client.post(f"/workflows/devices/{device['id']}", json={"blueprint_id": blueprint["id"]}, headers=API_HEADERS)
+    return device["id"], started.json()["id"]
+
+
+async def test_broadcaster_routes_by_key_and_drops_the_oldest_event():
+    broadcaster = events.Broadcaster(queue_size=2)
+    workflow = broadcaster.subscribe(("workflow", "w1"))
+    device = broadcaster.subscribe(("device", "d1"))
+
+    for status in ("queued", "running", "completed"):
+        broadcaster.deliver({"workflow_id": "w1", "device_id": "d1", "status": status})
+    broadcaster.deliver({"workflow_id": "w2", "status": "queued"})
+
+    assert [workflow.get_nowait()["status"] for _ in range(workflow.qsize())] == ["running", "completed"]
+    assert device.qsize() == 2
+    broadcaster.unsubscribe(("workflow", "w1"), workflow)
+    assert ("workflow", "w1") not in broadcaster._subscribers
+
+
+def test_format_sse_uses_the_event_type():
+    assert events.format_sse({"type": "workflow", "status": "queued"}) == 'event: workflow\ndata: {"type": "workflow", "status": "queued"}\n\n'
+    assert events.format_sse({}).startswith("event: message\n")
+
+
+async def test_workflow_stream_closes_when_the_run_finishes(client):
+    _, run_id = await _queued_run(client, "sse-live")
+    key = ("workflow", run_id)
+    stream = asyncio.create_task(client.get(f"/workflows/{run_id}/events", headers=API_HEADERS))
+    while key not in events.broadcaster._subscribers:
+        await asyncio.sleep(0.01)
+
+    await run_in_threadpool(worker.run_workflow_batch, [run_id])
+    response = await asyncio.wait_for(stream, timeout=5)
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert [(kind, event["status"]) for kind, event in _parse(response.text)] == [("workflow", "queued"), ("workflow", "completed")]
+    assert key not in events.broadcaster._subscribers
+
+
+async def test_workflow_stream_of_a_finished_run_returns_immediately(client):
+    _, run_id = await _queued_run(client, "sse-done")
+    worker.run_workflow_batch([run_id])
+
+    response = await asyncio.wait_for(client.get(f"/workflows/{run_id}/events", headers=API_HEADERS), timeout=5)
+
+    assert [event["status"] for _, event in _parse(response.text)] == ["completed"]
+
+
+async def test_event_streams_validate_their_target(client):
+    assert (await client.get("/workflows/events", headers=API_HEADERS)).status_code == 400
+    unknown = "00000000-0000-0000-0000-000000000000"
+    assert (await client.get(f"/workflows/{unknown}/events", headers=API_HEADERS)).status_code == 404
+    assert (await client.get(f"/workflows/events?rollout_id={unknown}", headers=API_HEADERS)).status_code == 404
+    assert not events.broadcaster._subscribers
@@ -0,0 +1,96 @@
+import ipaddress
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app import facts
+from tests.conftest import API_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+DEVICES = {
+    "facts-a": {"suite": "facts", "ip": "10.20.1.5", "model": "X", "ram_gb": 32, "disk": {"type": "ssd"}},
+    "facts-b": {"suite": "facts", "ip": "10.21.0.9", "model": "X", "ram_gb": 8},
+    "facts-c": {"suite": "facts", "ip": "192.168.1.2", "model": "Y", "ram_gb": "16", "managed": True},
+}
+
+
+def test_parse_builds_conditions():
+    conditions = facts.parse('facts.ip in 10.20.0.0/16 and facts.disk.type = "ssd" and os_type in [linux, windows] and facts.tpm exists')
+
+    assert conditions == [
+        facts.Condition("facts", ("ip",), "in", ipaddress.ip_network("10.20.0.0/16")),
+        facts.Condition("facts", ("disk", "type"), "=", "ssd"),
+        facts.Condition("os_type", (), "in", ["linux", "windows"]),
+        facts.Condition("facts", ("tpm",), "exists", None),
+    ]
+    assert facts.parse("facts.ram_gb >= 16 AND facts.managed = true")[1].value is True
+
+
+@pytest.mark.parametrize(
+    "query, message",
+    [
+        ("owner = bob", "unknown field"),
+        ("facts.a b 1", "unknown operator"),
+        ("hostname exists", "only applies to facts"),
+        ("facts.a =", "missing value"),
+        ("facts.a", "incomplete condition"),
+        ("facts.a = 1 or facts.b = 2", "expected 'and'"),
+        ("facts.a in 3", r"expects a \[list\]"),
+        ("hostname > a", "unsupported comparison"),
+        ("facts.a = 1 !", "unexpected input"),
+    ],
+)
+def test_parse_rejects_malformed_queries(query, message):
+    with pytest.raises(facts.QueryError, match=message):
+        facts.parse(query)
+
+
+def test_compile_predicate_matches_types_strictly():
+    matches = facts.compile_predicate(facts.parse("facts.ram_gb >= 16 and facts.ip in 10.0.0.0/8"))
+
+    assert matches({"facts": DEVICES["facts-a"]})
+    assert not matches({"facts": DEVICES["facts-b"]})
+    assert not matches({"facts": {**DEVICES["facts-a"], "ram_gb": "32"}})
+
+
+def test_postgresql_conditions_cast_facts_to_jsonb(monkeypatch):
+    monkeypatch.setattr(facts, "DIALECT", "postgresql")
+    clauses, post_filters = facts.compile_conditions(
+        facts.parse('facts.owner.team = "ops" and facts.addr in 10.20.0.0/16 and facts.cores > 4')
+    )
+    sql = [str(clause.compile(dialect=postgresql.dialect())) for clause in clauses]
+
+    assert "CAST(device.facts AS JSONB) @>" in sql[0]
+    assert "CAST(device.facts AS JSONB) ? " in sql[1]
+    assert "AS INET) END <<= CAST(" in sql[3]
+    assert "AS NUMERIC" in sql[4] and "jsonb_typeof" in sql[4]
+    assert post_filters == []
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ('facts.model = "X"', {"facts-a", "facts-b"}),
+        ("facts.ram_gb >= 16", {"facts-a"}),
+        ('facts.ram_gb = "16"', {"facts-c"}),
+        ("facts.ip in 10.20.0.0/16", {"facts-a"}),
+        ("facts.ip in 10.0.0.0/8", {"facts-a", "facts-b"}),
+        ('facts.disk.type = "ssd"', {"facts-a"}),
+        ("facts.managed exists", {"facts-c"}),
+        ("facts.managed = true", {"facts-c"}),
+        ('facts.model != "X"', {"facts-c"}),
+        ("facts.model in [Y, Z]", {"facts-c"}),
+    ],
+)
+async def test_search_on_sqlite(client, query, expected):
+    token = (await client.post("/enrollment/tokens", json={"ttl_minutes": 5, "max_uses": len(DEVICES)}, headers=API_HEADERS)).json()["token"]
+    for hostname, values in DEVICES.items():
+        await client.post(
+            "/enrollment/register",
+            json={"token": token, "hostname": hostname, "os_type": "linux", "arch": "x86_64", "hardware_id": hostname, "facts": values},
+        )
+
+    found = await client.get("/devices/search", params={"q": f'facts.suite = "facts" and {query}'}, headers=API_HEADERS)
+    assert found.status_code == 200
+    assert {device["hostname"] for device in found.json()["items"]} == expected
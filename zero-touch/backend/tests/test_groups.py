@@ -0,0 +1,79 @@
+import uuid
+
+import pytest
+
+from app import groups, heartbeats
+from tests.conftest import API_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+async def _enroll(client, hostname, facts):
+    token = (await client.post("/enrollment/tokens", json={"ttl_minutes": 5, "max_uses": 1}, headers=API_HEADERS)).json()["token"]
+    registered = await client.post(
+        "/enrollment/register",
+        json={"token": token, "hostname": hostname, "os_type": "linux", "arch": "x86_64", "hardware_id": hostname, "facts": facts},
+    )
+    return registered.json()
+
+
+async def _members(client, group_id):
+    response = await client.get(f"/groups/{group_id}/devices", headers=API_HEADERS)
+    return {device["hostname"] for device in response.json()["items"]}
+
+
+async def _report(client, device, facts):
+    response = await client.post(
+        f"/devices/{device['id']}/heartbeat", json={"facts": facts}, headers={"X-Device-Token": device["device_token"]}
+    )
+    assert response.status_code == 202
+    await heartbeats.flush()
+
+
+def test_group_index_only_rechecks_groups_using_changed_fields():
+    by_model, by_status = uuid.uuid4(), uuid.uuid4()
+    index = groups.GroupIndex([(by_model, 'facts.model = "X"'), (by_status, 'status = "enrolled" and facts.ip exists')])
+
+    assert index.candidates({"facts.model"}) == {by_model}
+    assert index.candidates({"status"}) == {by_status}
+    assert index.candidates({"hostname"}) == set()
+    assert index.candidates() == {by_model, by_status}
+
+
+async def test_membership_follows_registration_facts_and_query_changes(client):
+    first = await _enroll(client, "group-a", {"model": "G1"})
+    second = await _enroll(client, "group-b", {"model": "G2"})
+    created = await client.post("/groups", json={"name": "model-g1", "query": 'facts.model = "G1"'}, headers=API_HEADERS)
+    group_id = created.json()["id"]
+    assert created.json()["members"] == 1
+    assert await _members(client, group_id) == {"group-a"}
+
+    await _enroll(client, "group-c", {"model": "G1"})
+    assert await _members(client, group_id) == {"group-a", "group-c"}
+
+    await _report(client, second, {"model": "G1"})
+    await _report(client, first, {"model": "G3"})
+    assert await _members(client, group_id) == {"group-b", "group-c"}
+
+    updated = await client.put(f"/groups/{group_id}", json={"name": "model-g3", "query": 'facts.model = "G3"'}, headers=API_HEADERS)
+    assert updated.json()["members"] == 1
+    assert await _members(client, group_id) == {"group-a"}
+
+
+async def test_membership_follows_status_changes(client):
+    device = await _enroll(client, "group-status", {"rack": "status-test"})
+    group_id = (
+        await client.post(
+            "/groups", json={"name": "provisioning", "query": 'status = "provisioning" and facts.rack = "status-test"'}, headers=API_HEADERS
+        )
+    ).json()["id"]
+    assert await _members(client, group_id) == set()
+
+    blueprint = (await client.post("/blueprints", json={"name": "group-status", "os_targets": ["linux"]}, headers=API_HEADERS)).json()
+    await client.post(f"/workflows/devices/{device['id']}", json={"blueprint_id": blueprint["id"]}, headers=API_HEADERS)
+    assert await _members(client, group_id) == {"group-status"}
+
+
+async def test_invalid_group_query_is_rejected(client):
+    response = await client.post("/groups", json={"name": "broken", "query": "owner = bob"}, headers=API_HEADERS)
+    assert response.status_code == 400
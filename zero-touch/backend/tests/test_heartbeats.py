@@ -0,0 +1,72 @@
+import datetime as dt
+import uuid
+
+import pytest
+from redis import asyncio as aioredis
+
+from app import heartbeats
+from tests.conftest import API_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+async def _enroll(client, hostname):
+    token = (await client.post("/enrollment/tokens", json={"ttl_minutes": 5, "max_uses": 1}, headers=API_HEADERS)).json()["token"]
+    registered = await client.post(
+        "/enrollment/register",
+        json={"token": token, "hostname": hostname, "os_type": "linux", "arch": "x86_64", "hardware_id": hostname},
+    )
+    return registered.json()
+
+
+def _unreachable_buffer():
+    return heartbeats.RedisHeartbeatBuffer(
+        aioredis.Redis.from_url("redis://127.0.0.1:1", socket_timeout=0.2, socket_connect_timeout=0.2)
+    )
+
+
+async def test_heartbeat_requires_device_token_and_known_facts(client):
+    device = await _enroll(client, "hb-auth")
+    url = f"/devices/{device['id']}/heartbeat"
+    headers = {"X-Device-Token": device["device_token"]}
+
+    assert (await client.post(url, json={"facts": {"ip": "10.0.0.1"}})).status_code == 401
+    assert (await client.post(url, json={"facts": {"ip": "10.0.0.1"}}, headers=headers)).status_code == 202
+    rejected = await client.post(url, json={"facts": {"blueprint_id": str(uuid.uuid4())}}, headers=headers)
+    assert rejected.status_code == 422
+
+
+async def test_requeue_keeps_newer_heartbeat():
+    buffer = heartbeats.MemoryHeartbeatBuffer()
+    device_id = uuid.uuid4()
+    older = dt.datetime(2026, 1, 1, 10, 0)
+    newer = older + dt.timedelta(seconds=30)
+    await buffer.record(device_id, older, {"ip": "10.0.0.1", "uptime": 1})
+    drained = await buffer.drain(10)
+    await buffer.record(device_id, newer, {"ip": "10.0.0.2"})
+
+    await buffer.requeue(drained)
+
+    assert await buffer.drain(10) == [(device_id, newer, {"ip": "10.0.0.2", "uptime": 1})]
+    assert (await buffer.last_seen([device_id]))[device_id] == newer
+
+
+async def test_unreachable_redis_falls_back_to_process_buffer():
+    buffer = _unreachable_buffer()
+    device_id = uuid.uuid4()
+    seen_at = dt.datetime(2026, 1, 1, 10, 0)
+
+    await buffer.record(device_id, seen_at, {"ip": "10.0.0.1"})
+
+    assert await buffer.last_seen([device_id]) == {device_id: seen_at}
+    assert await buffer.drain(10) == [(device_id, seen_at, {"ip": "10.0.0.1"})]
+
+
+async def test_device_reads_survive_unreachable_redis(client, monkeypatch):
+    device = await _enroll(client, "hb-redis-down")
+    monkeypatch.setattr(heartbeats, "buffer", _unreachable_buffer())
+
+    assert (await client.get("/devices", headers=API_HEADERS)).status_code == 200
+    fetched = await client.get(f"/devices/{device['id']}", headers=API_HEADERS)
+    assert fetched.status_code == 200
+    assert fetched.json()["last_seen"] is not None
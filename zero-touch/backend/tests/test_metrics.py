@@ -0,0 +1,71 @@
+import datetime as dt
+import uuid
+from collections import Counter
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session
+
+from app import metrics, rollups
+from app.db import get_engine
+
+pytestmark = pytest.mark.anyio
+
+
+def _statements():
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    return statements, record
+
+
+async def test_workflow_gauge_reads_rollups(client, monkeypatch):
+    monkeypatch.setattr(metrics.get_settings(), "metrics_db_cache", 0)
+    await client.get("/metrics")
+    blueprint_id = uuid.uuid4()
+    with Session(get_engine()) as session:
+        deltas = Counter({rollups.workflow_key(blueprint_id, dt.datetime.utcnow(), "metrics-test"): 3})
+        rollups.stage(session, deltas)
+        session.commit()
+
+    statements, record = _statements()
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        body = (await client.get("/metrics")).text
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+
+    assert 'ztp_workflows{status="metrics-test"} 3.0' in body
+    assert not any("FROM workflowrun" in statement for statement in statements)
+
+
+async def test_scrapes_reuse_database_gauges_within_the_cache_interval(client, monkeypatch):
+    monkeypatch.setattr(metrics.get_settings(), "metrics_db_cache", 60)
+    first = (await client.get("/metrics")).text
+    with Session(get_engine()) as session:
+        rollups.stage(session, Counter({rollups.workflow_key(uuid.uuid4(), dt.datetime.utcnow(), "metrics-cached"): 1}))
+        session.commit()
+
+    statements, record = _statements()
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        body = (await client.get("/metrics")).text
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+
+    assert "ztp_outbox_pending" in first
+    assert 'status="metrics-cached"' not in body
+    assert not any("rollup" in statement or "outboxmessage" in statement for statement in statements)
+
+
+def test_failed_statements_do_not_leak_query_timers(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/errors.sqlite")
+    metrics.instrument_engine(engine)
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM missing"))
+        conn.execute(text("SELECT 1"))
+        assert conn.info["ztp_query_start"] == []
+    engine.dispose()
@@ -0,0 +1,137 @@
+import datetime as dt
+import json
+import tempfile
+import uuid
+
+from sqlalchemy import create_engine, inspect, text
+from sqlmodel import Session, select
+
+from app import blobs, tokens
+from app.db import SCHEMA_VERSION, read_schema_version
+from app.migrate import migrate
+from app.models import Blueprint, Device, EnrollmentToken, WorkflowRun
+
+BASELINE_SCHEMA = """
+CREATE TABLE auditlog (
+    id CHAR(32) NOT NULL, actor VARCHAR NOT NULL, action VARCHAR NOT NULL, target_type VARCHAR NOT NULL,
+    target_id VARCHAR, message VARCHAR NOT NULL, created_at DATETIME NOT NULL, PRIMARY KEY (id)
+);
+CREATE TABLE blueprint (
+    id CHAR(32) NOT NULL, name VARCHAR NOT NULL, description VARCHAR NOT NULL, os_targets JSON,
+    packages JSON, files JSON, users JSON, security JSON, PRIMARY KEY (id)
+);
+CREATE INDEX ix_blueprint_name ON blueprint (name);
+CREATE TABLE enrollmenttoken (
+    id CHAR(32) NOT NULL, token VARCHAR NOT NULL, expires_at DATETIME NOT NULL, uses_remaining INTEGER NOT NULL,
+    created_by VARCHAR NOT NULL, claims JSON, PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_enrollmenttoken_token ON enrollmenttoken (token);
+CREATE TABLE device (
+    id CHAR(32) NOT NULL, hostname VARCHAR NOT NULL, os_type VARCHAR NOT NULL, arch VARCHAR NOT NULL,
+    status VARCHAR NOT NULL, last_seen DATETIME, blueprint_id CHAR(32), enrollment_token_id CHAR(32), facts JSON,
+    PRIMARY KEY (id), FOREIGN KEY(blueprint_id) REFERENCES blueprint (id),
+    FOREIGN KEY(enrollment_token_id) REFERENCES enrollmenttoken (id)
+);
+CREATE TABLE workflowrun (
+    id CHAR(32) NOT NULL, device_id CHAR(32) NOT NULL, blueprint_id CHAR(32) NOT NULL, status VARCHAR NOT NULL,
+    steps JSON, started_at DATETIME NOT NULL, updated_at DATETIME NOT NULL, last_error VARCHAR,
+    PRIMARY KEY (id), FOREIGN KEY(device_id) REFERENCES device (id), FOREIGN KEY(blueprint_id) REFERENCES blueprint (id)
+)
+"""
+
+BLUEPRINT_ID = uuid.uuid4()
+DEVICE_ID = uuid.uuid4()
+RUN_ID = uuid.uuid4()
+
+
+def baseline_engine(seed=()):
+    engine = create_engine(f"sqlite:///{tempfile.mkdtemp()}/baseline.sqlite")
+    now = dt.datetime.utcnow()
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA.split(";"):
+            conn.execute(text(statement))
+        conn.execute(
+            text("INSERT INTO blueprint VALUES (:id, 'base', '', '[\"linux\"]', '{\"apt\": [\"vim\"]}', '{}', '{}', '{}')"),
+            {"id": BLUEPRINT_ID.hex},
+        )
+        conn.execute(
+            text("INSERT INTO device VALUES (:id, 'base-host', 'linux', 'x86_64', 'enrolled', :now, :blueprint, NULL, '{\"ip\": \"10.0.0.5\"}')"),
+            {"id": DEVICE_ID.hex, "now": now, "blueprint": BLUEPRINT_ID.hex},
+        )
+        conn.execute(
+            text("INSERT INTO workflowrun VALUES (:id, :device, :blueprint, 'completed', '[]', :now, :now, NULL)"),
+            {"id": RUN_ID.hex, "device": DEVICE_ID.hex, "blueprint": BLUEPRINT_ID.hex, "now": now},
+        )
+        for statement, params in seed:
+            conn.execute(text(statement), params)
+    return engine
+
+
+def test_migrate_upgrades_baseline_schema():
+    engine = baseline_engine()
+
+    assert migrate(engine) == SCHEMA_VERSION
+    assert migrate(engine) == SCHEMA_VERSION
+
+    inspector = inspect(engine)
+    columns = {table: {column["name"] for column in inspector.get_columns(table)} for table in ("blueprint", "device", "workflowrun")}
+    assert {"content_hash", "version"} <= columns["blueprint"]
+    assert "hardware_id" in columns["device"]
+    assert {"rollout_id", "dry_run"} <= columns["workflowrun"]
+    indexes = {table: {index["name"] for index in inspector.get_indexes(table)} for table in ("auditlog", "device", "workflowrun")}
+    assert {"ix_auditlog_target", "ix_auditlog_created"} <= indexes["auditlog"]
+    assert {"ix_device_hardware_id", "ix_device_enrollment_token_id"} <= indexes["device"]
+    assert "ix_workflowrun_rollout_status" in indexes["workflowrun"]
+    assert "ix_device_facts_gin" not in indexes["device"]
+
+    with engine.connect() as conn:
+        assert read_schema_version(conn) == SCHEMA_VERSION
+    with Session(engine) as session:
+        blueprint = session.get(Blueprint, BLUEPRINT_ID)
+        assert blueprint.version == 1 and blueprint.content_hash
+        assert session.get(Device, DEVICE_ID).hardware_id is None
+        run = session.get(WorkflowRun, RUN_ID)
+        assert run.dry_run is False and run.rollout_id is None
+        assert session.exec(select(Device).where(Device.hardware_id == "missing")).first() is None
+
+
+def test_migrate_hashes_plaintext_tokens():
+    token_id = uuid.uuid4()
+    expires_at = dt.datetime.utcnow() + dt.timedelta(hours=1)
+    engine = baseline_engine(
+        [(
+            "INSERT INTO enrollmenttoken VALUES (:id, 'plain-token', :expires_at, 1, 'system', '{}')",
+            {"id": token_id.hex, "expires_at": expires_at},
+        )]
+    )
+
+    migrate(engine)
+    migrate(engine)
+
+    with Session(engine) as session:
+        token = session.get(EnrollmentToken, token_id)
+        assert token.token_hash == tokens.hash_token("plain-token")
+
+
+def test_migrate_externalizes_inline_blueprint_files():
+    blueprint_id = uuid.uuid4()
+    files = {"/etc/motd": "welcome", "/etc/app.json": {"debug": False}}
+    engine = baseline_engine(
+        [(
+            "INSERT INTO blueprint VALUES (:id, 'inline', '', '[]', '{}', :files, '{}', '{}')",
+            {"id": blueprint_id.hex, "files": json.dumps(files)},
+        )]
+    )
+
+    migrate(engine)
+
+    with Session(engine) as session:
+        blueprint = session.get(Blueprint, blueprint_id)
+        assert set(blueprint.files) == set(files)
+        assert all(blobs.is_ref(value) for value in blueprint.files.values())
+        assert blueprint.content_hash
+    store = blobs.get_store()
+    with store.open(blueprint.files["/etc/motd"]["sha256"]) as handle:
+        assert handle.read() == b"welcome"
+    with store.open(blueprint.files["/etc/app.json"]["sha256"]) as handle:
+        assert json.loads(handle.read()) == {"debug": False}
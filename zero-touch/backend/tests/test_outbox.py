@@ -0,0 +1,119 @@
+import datetime as dt
+import uuid
+
+import pytest
+from sqlmodel import select
+
+from app import outbox
+from app.autoscale import BrokerDepth
+from app.db import get_session
+from app.migrate import migrate
+from app.models import OutboxMessage
+from tests.conftest import API_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def migrated():
+    migrate()
+
+
+class Recorder:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    def send_task(self, name, args, queue):
+        if queue in self.failing:
+            raise ConnectionError(f"{queue} unavailable")
+        self.sent.append((name, queue, sorted(args[0])))
+
+
+def _drain(session):
+    while outbox.Relay(Recorder()).relay_once(session):
+        pass
+
+
+def _stage(session, runs, **options):
+    outbox.stage(session, runs, **options)
+    session.commit()
+    return [str(workflow_id) for workflow_id, _ in runs]
+
+
+def test_stage_routes_each_run_to_its_queue(migrated):
+    runs = [(uuid.uuid4(), "windows"), (uuid.uuid4(), "linux"), (uuid.uuid4(), "ios")]
+    with get_session() as session:
+        _stage(session, runs, priority="normal")
+        _stage(session, [(uuid.uuid4(), "linux")], dry_run=True)
+        queues = {
+            str(row.workflow_id): row.queue
+            for row in session.exec(select(OutboxMessage).where(OutboxMessage.workflow_id.in_([run[0] for run in runs])))
+        }
+        _drain(session)
+
+    assert queues == {
+        str(runs[0][0]): "ztp.normal.windows",
+        str(runs[1][0]): "ztp.normal.macos-linux",
+        str(runs[2][0]): "ztp.normal.mobile-iot",
+    }
+
+
+def test_relay_sends_one_batch_per_queue_and_deletes_rows(migrated):
+    with get_session() as session:
+        _drain(session)
+        linux = _stage(session, [(uuid.uuid4(), "linux"), (uuid.uuid4(), "darwin")])
+        windows = _stage(session, [(uuid.uuid4(), "windows")])
+        recorder = Recorder()
+
+        assert outbox.Relay(recorder, batch_size=10).relay_once(session) == 3
+        assert session.exec(select(OutboxMessage)).all() == []
+
+    assert sorted(recorder.sent) == [
+        ("app.worker.run_workflow_batch", "ztp.high.macos-linux", sorted(linux)),
+        ("app.worker.run_workflow_batch", "ztp.high.windows", windows),
+    ]
+
+
+def test_failed_send_backs_off_and_keeps_rows(migrated):
+    with get_session() as session:
+        _drain(session)
+        _stage(session, [(uuid.uuid4(), "windows")])
+        linux = _stage(session, [(uuid.uuid4(), "linux")])
+        recorder = Recorder(failing={"ztp.high.windows"})
+        before = dt.datetime.utcnow()
+
+        assert outbox.Relay(recorder).relay_once(session) == 2
+        assert recorder.sent == [("app.worker.run_workflow_batch", "ztp.high.macos-linux", linux)]
+        (kept,) = session.exec(select(OutboxMessage)).all()
+        assert kept.queue == "ztp.high.windows"
+        assert kept.attempts == 1
+        assert "unavailable" in kept.last_error
+        assert kept.available_at >= before + dt.timedelta(seconds=outbox.backoff(1)) - dt.timedelta(seconds=1)
+
+        assert outbox.Relay(Recorder()).relay_once(session) == 0
+        session.delete(kept)
+        session.commit()
+
+
+def test_relay_publishes_to_the_memory_broker(migrated):
+    from app.worker import celery_app
+
+    depth = BrokerDepth(celery_app)
+    before = depth(["ztp.high.windows", "ztp.high.mobile-iot"])
+    with get_session() as session:
+        _drain(session)
+        _stage(session, [(uuid.uuid4(), "windows"), (uuid.uuid4(), "windows"), (uuid.uuid4(), "android")])
+        assert outbox.Relay(celery_app).relay_once(session) == 3
+
+    assert depth(["ztp.high.windows", "ztp.high.mobile-iot"]) == before + 2
+
+
+async def test_deleting_a_blueprint_used_by_a_rollout_conflicts(client):
+    blueprint = (await client.post("/blueprints", json={"name": "rolled", "os_targets": ["linux"]}, headers=API_HEADERS)).json()
+    rollout = await client.post("/workflows/rollouts", json={"blueprint_id": blueprint["id"], "selector": {"hostname": "nobody"}}, headers=API_HEADERS)
+    assert rollout.status_code == 200
+
+    deleted = await client.delete(f"/blueprints/{blueprint['id']}", headers=API_HEADERS)
+    assert deleted.status_code == 409
+    assert (await client.get(f"/blueprints/{blueprint['id']}", headers=API_HEADERS)).status_code == 200
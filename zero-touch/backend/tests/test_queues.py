@@ -0,0 +1,100 @@
+import pytest
+
+from app import queues
+from app.autoscale import Autoscaler, BrokerDepth, desired_concurrency
+
+SPEC = "urgent:1:2-8,windows:4:1-4,macos-linux:4:1-4,mobile-iot:4:1,dryrun:8:1-2"
+
+
+class FakePools:
+    def __init__(self, workers):
+        self.concurrency = workers
+        self.resized = []
+
+    def workers(self, pool):
+        return {name: value for name, value in self.concurrency.items() if name.startswith(f"{pool}@")}
+
+    def resize(self, worker, delta):
+        self.resized.append((worker, delta))
+        self.concurrency[worker] += delta
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_queue_for_routes_by_priority_family_and_dry_run():
+    assert queues.queue_for("Windows 11", "high") == "ztp.high.windows"
+    assert queues.queue_for("darwin") == "ztp.normal.macos-linux"
+    assert queues.queue_for("android", "urgent") == "ztp.normal.mobile-iot"
+    assert queues.queue_for("linux", "high", dry_run=True) == queues.DRY_RUN_QUEUE
+    assert {queues.queue_for(os_type, priority) for os_type in ("windows", "linux", "ios") for priority in queues.PRIORITIES} <= set(queues.ALL_QUEUES)
+
+
+def test_parse_pools_and_worker_argv():
+    pools = queues.parse_pools(SPEC)
+
+    assert pools["urgent"].queues == (queues.DEFAULT_QUEUE, "ztp.high.windows", "ztp.high.macos-linux", "ztp.high.mobile-iot")
+    assert (pools["mobile-iot"].min_concurrency, pools["mobile-iot"].max_concurrency) == (1, 1)
+    assert queues.worker_argv(pools["windows"]) == [
+        "worker",
+        "--hostname=windows@%h",
+        "--queues=ztp.normal.windows",
+        "--prefetch-multiplier=4",
+        "--concurrency=1",
+        "--loglevel=info",
+    ]
+    with pytest.raises(ValueError, match="without a worker pool"):
+        queues.parse_pools("urgent:1:2-8")
+    with pytest.raises(ValueError, match="unknown worker pool"):
+        queues.parse_pools(SPEC + ",gpu:1:1")
+
+
+def test_desired_concurrency_halves_the_step_down():
+    pool = queues.parse_pools(SPEC)["urgent"]
+
+    assert desired_concurrency(pool, 0, 1, 8, 10) == 5
+    assert desired_concurrency(pool, 1000, 2, 2, 10) == 8
+    assert desired_concurrency(pool, 30, 1, 2, 10) == 3
+
+
+def test_autoscaler_grows_shrinks_and_respects_cooldown():
+    pool = queues.parse_pools(SPEC)["windows"]
+    depth = {"value": 60}
+    backend = FakePools({"windows@a": 1, "other@a": 1})
+    clock = Clock()
+    scaler = Autoscaler([pool], lambda names: depth["value"], backend, per_process=20, cooldown=30, clock=clock)
+
+    assert scaler.tick() == {"windows@a": {"depth": 60, "from": 1, "to": 3}}
+    assert backend.resized == [("windows@a", 2)]
+
+    depth["value"] = 0
+    clock.now = 10
+    assert scaler.tick()["windows@a"]["to"] == 3
+    assert backend.resized == [("windows@a", 2)]
+
+    clock.now = 45
+    assert scaler.tick()["windows@a"]["to"] == 2
+    clock.now = 80
+    assert scaler.tick()["windows@a"]["to"] == 1
+    assert backend.resized == [("windows@a", 2), ("windows@a", -1), ("windows@a", -1)]
+    assert backend.concurrency == {"windows@a": 1, "other@a": 1}
+
+
+def test_broker_depth_counts_messages_on_the_memory_broker():
+    from app.worker import celery_app
+
+    depth = BrokerDepth(celery_app)
+    names = ["ztp.normal.windows", "ztp.dryrun", "ztp.missing"]
+    before = depth(names)
+    with celery_app.connection_for_write() as conn:
+        for queue in ("ztp.normal.windows", "ztp.normal.windows", "ztp.dryrun"):
+            conn.default_channel.queue_declare(queue=queue)
+            producer = conn.Producer()
+            producer.publish({"n": 1}, routing_key=queue, exchange="")
+
+    assert depth(names) == before + 3
@@ -0,0 +1,86 @@
+import pytest
+import redis
+from fastapi import HTTPException
+
+from app import ratelimit
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    buckets = ratelimit.MemoryBuckets()
+    monkeypatch.setattr(ratelimit, "buckets", buckets)
+    monkeypatch.setattr(ratelimit.settings, "rate_limit_enabled", True)
+    return buckets
+
+
+class Script:
+    def __init__(self, result=None):
+        self.result = result
+        self.calls = []
+
+    async def __call__(self, keys, args):
+        self.calls.append((keys, args))
+        if self.result is None:
+            raise redis.ConnectionError("down")
+        return self.result
+
+
+class Client:
+    def __init__(self, script):
+        self.script = script
+
+    def register_script(self, source):
+        return self.script
+
+
+async def test_global_rejection_leaves_the_per_ip_allowance_untouched(memory):
+    limits = [("ip:10.0.0.1", (0.001, 5)), ("global", (0.001, 1))]
+
+    await ratelimit.enforce("register", limits)
+    with pytest.raises(HTTPException) as rejected:
+        await ratelimit.enforce("register", limits)
+
+    assert rejected.value.status_code == 429
+    assert int(rejected.value.headers["Retry-After"]) > 1
+    assert memory._buckets["register:ip:10.0.0.1"][0] == pytest.approx(4, abs=0.01)
+    assert memory._buckets["register:global"][0] < 1
+
+
+async def test_memory_buckets_report_the_longest_wait():
+    buckets = ratelimit.MemoryBuckets()
+    limits = [("a", 1.0, 1), ("b", 0.1, 1)]
+
+    assert await buckets.take(limits) == (None, 0.0)
+    limited, wait = await buckets.take(limits)
+
+    assert limited == 1
+    assert wait == pytest.approx(10, rel=0.01)
+
+
+async def test_disabled_or_zero_rate_limits_are_skipped(memory, monkeypatch):
+    await ratelimit.enforce("agent", [("ip:10.0.0.2", (0, 0))])
+    assert not memory._buckets
+    monkeypatch.setattr(ratelimit.settings, "rate_limit_enabled", False)
+    for _ in range(3):
+        await ratelimit.enforce("agent", [("ip:10.0.0.2", (0.001, 1))])
+    assert not memory._buckets
+
+
+async def test_redis_buckets_check_every_key_in_one_call():
+    script = Script([2, b"3.5"])
+    buckets = ratelimit.RedisBuckets(Client(script), ratelimit.MemoryBuckets())
+
+    assert await buckets.take([("register:ip:1", 20.0, 100), ("register:global", 100.0, 200)]) == (1, 3.5)
+    assert script.calls == [(["ztp:rl:register:ip:1", "ztp:rl:register:global"], [20.0, 100, 100.0, 200])]
+    script.result = [0, b"0"]
+    assert await buckets.take([("register:global", 100.0, 200)]) == (None, 0.0)
+
+
+async def test_redis_buckets_fall_back_to_local_buckets():
+    fallback = ratelimit.MemoryBuckets()
+    buckets = ratelimit.RedisBuckets(Client(Script()), fallback)
+
+    assert await buckets.take([("agent:ip:1", 1.0, 1)]) == (None, 0.0)
+    assert "agent:ip:1" in fallback._buckets
@@ -0,0 +1,80 @@
+import datetime as dt
+import uuid
+
+import pytest
+from sqlmodel import select
+
+from app import retention
+from app.db import get_session
+from app.migrate import migrate
+from app.models import AuditLog, EnrollmentToken, WorkflowArchive, WorkflowRun
+from tests.conftest import API_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+async def _finished_run(client, hostname):
+    blueprint = (await client.post("/blueprints", json={"name": hostname, "os_targets": ["linux"]}, headers=API_HEADERS)).json()
+    token = (await client.post("/enrollment/tokens", json={"ttl_minutes": 5, "max_uses": 1}, headers=API_HEADERS)).json()["token"]
+    device = (
+        await client.post(
+            "/enrollment/register",
+            json={"token": token, "hostname": hostname, "os_type": "linux", "arch": "x86_64", "hardware_id": hostname},
+        )
+    ).json()
+    started = await client.post(f"/workflows/devices/{device['id']}", json={"blueprint_id": blueprint["id"]}, headers=API_HEADERS)
+    return uuid.UUID(started.json()["id"])
+
+
+def test_pack_round_trips():
+    run = WorkflowRun(device_id=uuid.uuid4(), blueprint_id=uuid.uuid4(), dry_run=True, steps=[{"name": "packages"}], last_error="boom")
+
+    assert retention.unpack(retention.pack(run)) == {"dry_run": True, "steps": [{"name": "packages"}], "last_error": "boom"}
+
+
+async def test_run_archives_finished_workflows_and_purges_old_rows(client):
+    run_id = await _finished_run(client, "retention-old")
+    recent_id = await _finished_run(client, "retention-recent")
+    now = dt.datetime.utcnow()
+    old = now - dt.timedelta(days=365)
+    with get_session() as session:
+        for workflow_id, updated_at in ((run_id, old), (recent_id, now)):
+            run = session.get(WorkflowRun, workflow_id)
+            run.status, run.updated_at, run.steps = "completed", updated_at, [{"name": "packages", "status": "succeeded"}]
+        session.add(AuditLog(actor="retention-test", action="old", target_type="test", created_at=old))
+        session.add(EnrollmentToken(token_hash=uuid.uuid4().hex, expires_at=old))
+        session.commit()
+
+    report = retention.run(now)
+
+    assert report["workflows_archived"]["rows"] >= 1
+    assert report["audit_purged"]["rows"] >= 1
+    assert report["tokens_purged"]["rows"] >= 1
+    with get_session() as session:
+        assert session.get(WorkflowRun, run_id) is None
+        assert session.get(WorkflowRun, recent_id) is not None
+        assert session.get(WorkflowArchive, run_id).status == "completed"
+        assert session.exec(select(AuditLog).where(AuditLog.actor == "retention-test")).all() == []
+        assert session.exec(select(EnrollmentToken).where(EnrollmentToken.expires_at < now - dt.timedelta(days=30))).all() == []
+
+    archived = await client.get(f"/workflows/{run_id}", headers=API_HEADERS)
+    assert archived.status_code == 200
+    assert archived.json()["archived"] is True
+    assert archived.json()["steps"][0]["name"] == "packages"
+    assert (await client.get(f"/workflows/{recent_id}", headers=API_HEADERS)).json()["archived"] is False
+
+
+def test_drain_works_in_batches_and_stops_at_the_batch_limit(monkeypatch):
+    migrate()
+    monkeypatch.setattr(retention.settings, "retention_batch_pause", 0)
+    created_at = dt.datetime.utcnow() - dt.timedelta(days=365)
+    with get_session() as session:
+        session.add_all([AuditLog(actor="drain-test", action=str(i), target_type="test", created_at=created_at) for i in range(5)])
+        session.commit()
+        query = select(AuditLog.id).where(AuditLog.actor == "drain-test").order_by(AuditLog.id)
+
+        monkeypatch.setattr(retention.settings, "retention_max_batches", 2)
+        assert retention.drain(session, query, retention._purge(AuditLog), batch_size=2) == 4
+        monkeypatch.setattr(retention.settings, "retention_max_batches", 500)
+        assert retention.drain(session, query, retention._purge(AuditLog), batch_size=2) == 1
+        assert session.exec(query).all() == []
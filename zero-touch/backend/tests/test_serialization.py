@@ -0,0 +1,37 @@
+import datetime as dt
+import json
+import uuid
+
+import pytest
+
+from app import serialization
+from tests.conftest import API_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+def test_dumps_falls_back_for_wide_integers():
+    value = {"id": uuid.UUID(int=1), "at": dt.datetime(2024, 1, 2, 3, 4, 5), "n": 10**30}
+
+    assert json.loads(serialization.dumps(value)) == {
+        "id": str(uuid.UUID(int=1)),
+        "at": "2024-01-02T03:04:05",
+        "n": 10**30,
+    }
+
+
+async def test_wide_integer_facts_do_not_break_device_listings(client):
+    token = (await client.post("/enrollment/tokens", json={"ttl_minutes": 5, "max_uses": 1}, headers=API_HEADERS)).json()["token"]
+    registered = await client.post(
+        "/enrollment/register",
+        json={"token": token, "hostname": "wide-int", "os_type": "linux", "arch": "x86_64", "facts": {"n": 10**30}},
+    )
+    assert registered.status_code == 200
+    assert registered.json()["facts"] == {"n": 10**30}
+
+    listed = await client.get("/devices", headers=API_HEADERS)
+    assert listed.status_code == 200
+    assert {"n": 10**30} in [device["facts"] for device in listed.json()]
+
+    found = await client.get("/devices/search", params={"q": 'hostname = "wide-int"'}, headers=API_HEADERS)
+    assert found.status_code == 200
@@ -0,0 +1,78 @@
+import datetime as dt
+
+import pytest
+from sqlmodel import Session
+
+from app import tokens
+from app.db import get_engine
+from app.models import EnrollmentToken
+from tests.conftest import API_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+class SequenceRedis:
+    def __init__(self, seq):
+        self.seq = seq
+
+    async def get(self, key):
+        return str(self.seq).encode()
+
+
+def _filter():
+    return tokens.TokenFilter(1000, 0.001, "test-token-filter", 300)
+
+
+async def test_rebuild_keeps_exhausted_tokens_and_drops_expired(client, monkeypatch):
+    monkeypatch.setattr(tokens, "get_async_redis", lambda: SequenceRedis(0))
+    now = dt.datetime.utcnow()
+    exhausted = EnrollmentToken(token_hash=tokens.hash_token("exhausted"), expires_at=now + dt.timedelta(minutes=5), uses_remaining=0)
+    expired = EnrollmentToken(token_hash=tokens.hash_token("expired"), expires_at=now - dt.timedelta(minutes=5))
+    with Session(get_engine()) as session:
+        session.add_all([exhausted, expired])
+        session.commit()
+        token_filter = _filter()
+        token_filter.rebuild(session)
+
+    token_filter.ready = True
+    assert await token_filter.might_contain(tokens.hash_token("exhausted"))
+    assert not await token_filter.might_contain(tokens.hash_token("expired"))
+
+
+async def test_missed_announcement_falls_back_to_database(monkeypatch):
+    token_filter = _filter()
+    token_filter.ready = True
+    token_filter._handle(b"add:" + tokens.hash_token("first").encode() + b":1")
+    token_filter._handle(b"add:" + tokens.hash_token("third").encode() + b":3")
+    assert token_filter.seq == 1
+
+    monkeypatch.setattr(tokens, "get_async_redis", lambda: SequenceRedis(1))
+    assert not await token_filter.might_contain(tokens.hash_token("second"))
+    assert not token_filter.stale
+
+    monkeypatch.setattr(tokens, "get_async_redis", lambda: SequenceRedis(3))
+    assert await token_filter.might_contain(tokens.hash_token("second"))
+    assert token_filter.stale
+
+
+async def test_exhausted_token_is_rejected_by_the_database(client, monkeypatch):
+    monkeypatch.setattr(tokens.token_filter, "ready", True)
+    monkeypatch.setattr(tokens, "get_async_redis", lambda: SequenceRedis(tokens.token_filter.seq))
+    token = (await client.post("/enrollment/tokens", json={"ttl_minutes": 5, "max_uses": 1}, headers=API_HEADERS)).json()["token"]
+    request = {"token": token, "os_type": "linux", "arch": "x86_64"}
+
+    first = await client.post("/enrollment/register", json={**request, "hostname": "filter-a", "hardware_id": "filter-a"})
+    again = await client.post("/enrollment/register", json={**request, "hostname": "filter-a", "hardware_id": "filter-a"})
+    renewed = await client.post(
+        "/enrollment/register",
+        json={**request, "hostname": "filter-a", "hardware_id": "filter-a"},
+        headers={"X-Device-Token": first.json()["device_token"]},
+    )
+    other = await client.post("/enrollment/register", json={**request, "hostname": "filter-b", "hardware_id": "filter-b"})
+    unknown = await client.post("/enrollment/register", json={**request, "token": "unknown", "hostname": "filter-c"})
+
+    assert first.status_code == 200
+    assert again.status_code == 400
+    assert renewed.status_code == 200 and renewed.json()["id"] == first.json()["id"]
+    assert other.status_code == 400
+    assert unknown.status_code == 404
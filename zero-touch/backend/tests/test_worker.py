@@ -0,0 +1,46 @@
+import uuid
+
+import pytest
+
+from app import worker
+from app.db import get_session
+from app.models import WorkflowRun
+from tests.conftest import API_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+async def _register(client, token, hostname, facts):
+    response = await client.post(
+        "/enrollment/register",
+        json={"token": token, "hostname": hostname, "os_type": "linux", "arch": "x86_64", "hardware_id": hostname, "facts": facts},
+    )
+    return response.json()["id"]
+
+
+async def test_one_bad_run_does_not_abort_the_batch(client, monkeypatch):
+    real_diff = worker.diff
+
+    def diff(plan, facts):
+        if facts.get("broken"):
+            raise TypeError("package names must be strings")
+        return real_diff(plan, facts)
+
+    monkeypatch.setattr(worker, "diff", diff)
+    blueprint = (await client.post("/blueprints", json={"name": "batch", "os_targets": ["linux"], "packages": {"apt": ["vim"]}}, headers=API_HEADERS)).json()
+    token = (await client.post("/enrollment/tokens", json={"ttl_minutes": 5, "max_uses": 2}, headers=API_HEADERS)).json()["token"]
+    good = await _register(client, token, "worker-good", {})
+    bad = await _register(client, token, "worker-bad", {"broken": True})
+    runs = {}
+    for device_id in (good, bad):
+        started = await client.post(f"/workflows/devices/{device_id}", json={"blueprint_id": blueprint["id"]}, headers=API_HEADERS)
+        runs[device_id] = started.json()["id"]
+
+    assert worker.run_workflow_batch(list(runs.values())) == 2
+
+    with get_session() as session:
+        good_run = session.get(WorkflowRun, uuid.UUID(runs[good]))
+        bad_run = session.get(WorkflowRun, uuid.UUID(runs[bad]))
+        assert good_run.status == "completed"
+        assert bad_run.status == "failed"
+        assert "package names must be strings" in bad_run.last_error